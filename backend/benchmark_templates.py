@@ -0,0 +1,90 @@
+"""Micro-benchmark of the evaluator's per-query request building and answer extraction for custom endpoints.
+
+Compares the per-query deepcopy / placeholder walk / path split that query_custom used to do
+against request templates and response paths compiled once per run.
+
+    python benchmark_templates.py [queries]
+"""
+import copy
+import sys
+import time
+
+from templating import RequestTemplate, compile_response_path, flatten_dict
+
+REQUEST_FORMAT = {
+    "model": "rag-large",
+    "input": {"question": "{prompt}", "history": [], "locale": "en"},
+    "retrieval": {"top_k": 5, "filters": {"source": ["docs", "kb"], "min_score": 0.4}},
+    "messages": [
+        {"role": "system", "content": "Answer from the retrieved documents only."},
+        {"role": "user", "content": "Question: {prompt}"}
+    ],
+    "stream": False
+}
+RESPONSE_PATH = "data.result.answer"
+RESPONSE = {"data": {"result": {"answer": "An answer", "sources": [{"text": f"Source {i}"} for i in range(5)]}}}
+
+def legacy_replace_placeholder(obj, placeholder, value):
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            if isinstance(v, (dict, list)):
+                legacy_replace_placeholder(v, placeholder, value)
+            elif isinstance(v, str) and placeholder in v:
+                obj[k] = v.replace(placeholder, value)
+    elif isinstance(obj, list):
+        for i, item in enumerate(obj):
+            if isinstance(item, (dict, list)):
+                legacy_replace_placeholder(item, placeholder, value)
+            elif isinstance(item, str) and placeholder in item:
+                obj[i] = item.replace(placeholder, value)
+
+def legacy_extract_from_json(json_obj, path):
+    current = json_obj
+    for part in path.split('.'):
+        if isinstance(current, dict) and part in current:
+            current = current[part]
+        elif isinstance(current, list) and part.isdigit() and int(part) < len(current):
+            current = current[int(part)]
+        else:
+            return None
+    return current
+
+def legacy_query(prompt, method):
+    request_body = copy.deepcopy(REQUEST_FORMAT)
+    legacy_replace_placeholder(request_body, "{prompt}", prompt)
+    if method == "GET":
+        request_body = flatten_dict(request_body)
+    return request_body, legacy_extract_from_json(RESPONSE, RESPONSE_PATH)
+
+def run(label, build, prompts):
+    started = time.perf_counter()
+    for prompt in prompts:
+        build(prompt)
+    elapsed = time.perf_counter() - started
+    print(f"{label:<34} {elapsed:8.3f} s  {elapsed / len(prompts) * 1e6:8.2f} us/query")
+    return elapsed
+
+def main(queries=100_000):
+    prompts = [f"What is question number {i}?" for i in range(queries)]
+    print(f"{queries} queries")
+    for method in ("POST", "GET"):
+        # The compiled path pays for compilation inside the timed loop's first call, as a run would
+        compiled = {}
+
+        def compiled_query(prompt):
+            if not compiled:
+                compiled["template"] = RequestTemplate(REQUEST_FORMAT, method)
+                compiled["extract"] = compile_response_path(RESPONSE_PATH)
+            return compiled["template"].render(prompt), compiled["extract"](RESPONSE)
+
+        assert legacy_query(prompts[0], method) == compiled_query(prompts[0])
+        compiled.clear()
+        legacy = run(f"{method} deepcopy + walk + split", lambda prompt: legacy_query(prompt, method), prompts)
+        fast = run(f"{method} compiled template + path", compiled_query, prompts)
+        print(f"{method} speedup: {legacy / fast:.1f}x")
+
+    extract = compile_response_path("answer=data.result.answer, data.result.sources[*].text")
+    run("multi-field extraction", lambda prompt: extract(RESPONSE), prompts)
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -1,27 +1,47 @@
 # main.py
-from fastapi import FastAPI
-from pydantic import BaseModel
+from fastapi import FastAPI, UploadFile, File, Request
+from starlette.concurrency import run_in_threadpool
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, PrivateAttr
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, FileResponse, Response, JSONResponse
+from fastapi.responses import HTMLResponse, FileResponse, Response, JSONResponse, StreamingResponse
 import os
+import time
+import random
+import uuid
+import math
+import html
+import itertools
+import socket
+import threading
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import NewConnectionError, ConnectTimeoutError
+from urllib.parse import urlsplit
 import pandas as pd
+import numpy as np
 from dotenv import load_dotenv
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import A4, letter
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.fonts import addMapping
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-from reportlab.lib.enums import TA_CENTER, TA_LEFT
-import io
+import hashlib
 import tempfile
-from typing import Optional
+from typing import Optional, List
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+import asyncio
+import multiprocessing
 import json
-from datetime import datetime
+import sqlite3
+from datetime import datetime, timedelta
 import logging
 from pythonjsonlogger import jsonlogger
+from metrics import METRIC_NAMES, ReferenceIndex, pack_texts, score_shard, summarize
+from templating import BATCH_PLACEHOLDER, RequestTemplate, ResponseExtractor, compile_response_path
+from resilience import (MAX_RESPONSE_BYTES, BodyReader, EndpointProfiles, circuit_breaker_views, current_query_trace, estimate_tokens,
+                        get_circuit_breaker, get_rate_limiter, query_trace, rate_limited, read_json_answer)
+from reports import (LATENCY_PHASES, PDF_WORST_N, generate_pdf_report, write_pdf_report, render_html_report,
+                     render_comparison_report, row_score)
 
 # Set up logging
 logger = logging.getLogger("rag_evaluation")
@@ -34,7 +54,21 @@ logger.setLevel(logging.INFO)
 # Load environment variables (ensure OPENAI_API_KEY is set in your .env file)
 load_dotenv()
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Index the built-in reference answers once, before the first evaluation
+    get_reference_index()
+    yield
+    # Stop accepting evaluation jobs and drop the ones that have not started
+    job_executor.shutdown(wait=False, cancel_futures=True)
+    hedge_executor.shutdown(wait=False, cancel_futures=True)
+    pdf_executor.shutdown(wait=False, cancel_futures=True)
+    scoring_executor.shutdown(wait=False, cancel_futures=True)
+    # Release pooled connections held by the outbound HTTP clients
+    close_http_sessions()
+    endpoint_profiles.save()
+
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS (update origins as needed)
 origins = [
@@ -51,45 +85,373 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
-    expose_headers=["Content-Disposition"]
+    expose_headers=["Content-Disposition", "X-Run-Id"]
 )
 
 # Get the current directory
 current_dir = os.path.dirname(os.path.abspath(__file__))
-fonts_dir = os.path.join(current_dir, 'fonts')
-
-# Register Poppins font
-pdfmetrics.registerFont(TTFont('Poppins', os.path.join(fonts_dir, 'Poppins-Regular.ttf')))
-pdfmetrics.registerFont(TTFont('Poppins-Bold', os.path.join(fonts_dir, 'Poppins-Bold.ttf')))
-addMapping('Poppins', 0, 0, 'Poppins')
-addMapping('Poppins', 1, 0, 'Poppins-Bold')
 
 # Configuration constants
-TIMEOUT_SECONDS = 15  # Increased from 8 to handle more queries
+TIMEOUT_SECONDS = 15  # Request timeout until an endpoint's latency profile has enough samples
 MAX_RETRIES = 3      # Increased from 2 to handle more retries
-KNOWN_ENDPOINTS = {
-    # Add specific configurations for problematic endpoints
-    "10.229.222.15:8000": {
-        "note": "Internal endpoint that requires specific params",
-        "timeout": 10,  # Increased timeout for this endpoint
-        "params": {
-            "groupid": 12,
-            "session_id": 111
-        }
-    }
-}
+RETRY_BACKOFF_BASE = float(os.getenv("RETRY_BACKOFF_BASE", "0.5"))  # Seconds before the first retry (before jitter)
+RETRY_BACKOFF_MAX = float(os.getenv("RETRY_BACKOFF_MAX", "8"))  # Cap on a single backoff delay
+RETRY_STATUS_CODES = [429, 502, 503, 504]  # Responses worth retrying
+HEDGE_MIN_SAMPLES = 20  # Latency samples needed before hedging on the observed p95
+DEFAULT_CONCURRENCY = int(os.getenv("EVALUATION_CONCURRENCY", "5"))  # Parallel queries per evaluation run
+MAX_CONCURRENCY = 32  # Upper bound so a single run cannot flood the target endpoint
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", str(MAX_CONCURRENCY)))  # Pooled connections per host
+HTTP_KEEPALIVE = os.getenv("HTTP_KEEPALIVE", "true").lower() != "false"  # Reuse connections between queries
+RUN_STORE_SIZE = int(os.getenv("RUN_STORE_SIZE", "100"))  # Evaluation runs kept in memory
+RUN_STORE_TTL_SECONDS = int(os.getenv("RUN_STORE_TTL_SECONDS", "3600"))  # How long a run can be re-downloaded
+RUN_STORE_DIR = os.getenv("RUN_STORE_DIR")  # Optional directory to persist runs across restarts
+DATASET_DIR = os.getenv("DATASET_DIR", os.path.join(current_dir, "datasets"))  # Where uploaded datasets are kept
+DATASET_CHUNK_ROWS = int(os.getenv("DATASET_CHUNK_ROWS", "5000"))  # Rows parsed at a time when reading datasets
+MAX_DATASET_UPLOAD_MB = int(os.getenv("MAX_DATASET_UPLOAD_MB", "512"))
+REFERENCE_INDEX_CACHE_SIZE = int(os.getenv("REFERENCE_INDEX_CACHE_SIZE", "16"))  # Dataset reference indexes kept in memory
+JOB_WORKERS = int(os.getenv("EVALUATION_JOB_WORKERS", "4"))  # Evaluation jobs running at the same time
+JOB_QUEUE_LIMIT = int(os.getenv("EVALUATION_JOB_QUEUE_LIMIT", "20"))  # Queued plus running jobs before rejecting with 429
+JOB_RETENTION_SECONDS = int(os.getenv("EVALUATION_JOB_RETENTION_SECONDS", "3600"))  # How long finished jobs can be polled
+LOAD_TEST_MAX_IN_FLIGHT = int(os.getenv("LOAD_TEST_MAX_IN_FLIGHT", "256"))  # Worker threads sending load-test requests
+LOAD_TEST_MAX_RATE = float(os.getenv("LOAD_TEST_MAX_RATE", "500"))  # Highest target arrival rate (requests/second)
+LOAD_TEST_MAX_SECONDS = int(os.getenv("LOAD_TEST_MAX_SECONDS", "3600"))  # Longest total load-test duration
+LOAD_TEST_MIX_SIZE = 10000  # Dataset queries loaded into memory as the load-test request mix
+REPORT_PAGE_SIZE = int(os.getenv("REPORT_PAGE_SIZE", "500"))  # Rows per page of a paginated HTML run report
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 1)))  # Processes rendering PDF reports
+SCORING_WORKERS = int(os.getenv("SCORING_WORKERS", str(os.cpu_count() or 1)))  # Processes scoring large runs; 1 scores in-process
+SCORING_SHARD_ROWS = int(os.getenv("SCORING_SHARD_ROWS", "5000"))  # Fewest rows per scoring shard; smaller runs are scored in-process
+PDF_LARGE_REPORT_ROWS = int(os.getenv("PDF_LARGE_REPORT_ROWS", "1000"))  # Rows above which PDFs are written to disk and served as files
+PDF_QUEUE_LIMIT = int(os.getenv("PDF_QUEUE_LIMIT", str(PDF_WORKERS * 4)))  # Renders queued or running before rejecting with 429
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "10000"))  # Endpoint responses kept for reuse; 0 disables the cache
+RESPONSE_CACHE_TTL_SECONDS = int(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "86400"))  # How long a cached response is reused
+RESPONSE_CACHE_DB = os.getenv("RESPONSE_CACHE_DB")  # Optional SQLite file so the cache survives restarts and is shared by workers
+HISTORY_DB = os.getenv("HISTORY_DB", os.path.join(current_dir, "history.db"))  # SQLite evaluation history; empty to disable
+HISTORY_MAX_RUNS = int(os.getenv("HISTORY_MAX_RUNS", "500"))  # Newest runs kept in the history; 0 keeps every run
+HISTORY_MAX_AGE_DAYS = float(os.getenv("HISTORY_MAX_AGE_DAYS", "90"))  # Runs older than this are deleted from the history; 0 keeps them
+HISTORY_DIFF_TOP_N = 20  # Regressions and improvements listed by the run diff API
+COMPARE_MAX_ENDPOINTS = int(os.getenv("COMPARE_MAX_ENDPOINTS", "8"))  # Endpoints accepted by one comparative evaluation
+ENDPOINTS_CONFIG = os.getenv("ENDPOINTS_CONFIG", os.path.join(current_dir, "endpoints.json"))  # Per-host endpoint settings
+ENDPOINT_PROFILES_PATH = os.getenv("ENDPOINT_PROFILES_PATH", os.path.join(current_dir, "endpoint_profiles.json"))  # Learned latency profiles; empty to keep them in memory only
+MAX_BATCH_SIZE = 256  # Most queries packed into one batch request
+BATCH_TIMEOUT_SECONDS = int(os.getenv("BATCH_TIMEOUT_SECONDS", "60"))  # Read timeout of a batch request
+def load_endpoint_configs(path):
+    """Per-endpoint settings keyed by host:port (or host): a fixed timeout, retry policy, and for
+    generic endpoints the request method, extra params and response field"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"Could not load endpoint configuration from {path}: {str(e)}")
+        return {}
+
+KNOWN_ENDPOINTS = load_endpoint_configs(ENDPOINTS_CONFIG)
 
 def get_endpoint_config(url):
     """Get specific config for known endpoints"""
-    for endpoint_key, config in KNOWN_ENDPOINTS.items():
-        if endpoint_key in url:
-            logger.info(f"Using custom configuration for endpoint: {endpoint_key}")
-            return config
-    return {}
+    parts = urlsplit(url.strip())
+    return KNOWN_ENDPOINTS.get(parts.netloc) or KNOWN_ENDPOINTS.get(parts.hostname or "") or {}
+
+class _TimedConnectionMixin:
+    """Adds DNS and TCP connect times of new connections to the current query trace"""
+    _connect_seconds = 0.0
+
+    def _new_conn(self):
+        started = time.perf_counter()
+        host = self._dns_host
+        addresses = [host]
+        try:
+            # Resolve up front so DNS time can be told apart from the TCP handshake
+            addresses = list(dict.fromkeys(info[4][0] for info in socket.getaddrinfo(host, self.port, 0, socket.SOCK_STREAM)))
+        except socket.gaierror:
+            pass  # urllib3 raises its own NameResolutionError below
+        resolved = time.perf_counter()
+        try:
+            for i, address in enumerate(addresses):
+                self._dns_host = address
+                try:
+                    sock = super()._new_conn()
+                    break
+                except (NewConnectionError, ConnectTimeoutError):
+                    if i == len(addresses) - 1:
+                        raise
+        finally:
+            self._dns_host = host
+        connected = time.perf_counter()
+        self._connect_seconds = connected - started
+        trace = current_query_trace()
+        if trace is not None:
+            trace["dns_ms"] += (resolved - started) * 1000
+            trace["connect_ms"] += (connected - resolved) * 1000
+            trace["connections_opened"] += 1
+        return sock
+
+class TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    pass
+
+class TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    def connect(self):
+        started = time.perf_counter()
+        super().connect()
+        trace = current_query_trace()
+        if trace is not None:
+            trace["tls_ms"] += max(0.0, time.perf_counter() - started - self._connect_seconds) * 1000
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections report their setup timings to the current query trace"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": TimedHTTPConnectionPool, "https": TimedHTTPSConnectionPool}
+
+# Shared HTTP sessions keyed by scheme and host, so queries reuse pooled keep-alive connections
+_http_sessions = {}
+_http_sessions_lock = threading.Lock()
+
+def get_http_session(url):
+    """Get the pooled session for the scheme and host of a URL"""
+    parts = urlsplit(url)
+    key = f"{parts.scheme}://{parts.netloc}".lower()
+    with _http_sessions_lock:
+        session = _http_sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = TimedHTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            if not HTTP_KEEPALIVE:
+                session.headers["Connection"] = "close"
+            _http_sessions[key] = session
+            logger.info(f"Created HTTP connection pool for {key}", extra={"pool_size": HTTP_POOL_SIZE})
+        return session
+
+def close_http_sessions():
+    """Close every pooled session, e.g. on application shutdown"""
+    with _http_sessions_lock:
+        sessions = list(_http_sessions.values())
+        _http_sessions.clear()
+    for session in sessions:
+        session.close()
+
+class RetryPolicy(BaseModel):
+    """How a query adapter retries and hedges requests to one endpoint"""
+    max_attempts: int = MAX_RETRIES
+    backoff_base: float = RETRY_BACKOFF_BASE    # Seconds; doubled on every retry
+    backoff_max: float = RETRY_BACKOFF_MAX
+    retry_statuses: List[int] = RETRY_STATUS_CODES
+    hedge: bool = False                         # Send a duplicate request when the first one is slow
+    hedge_after_ms: Optional[float] = None      # Defaults to the endpoint's observed p95 latency
+    circuit_breaker: bool = True                # Fail fast while the endpoint's circuit breaker is open
+
+def get_retry_policy(url, policy=None):
+    """Use the given policy, or the one configured for a known endpoint, or the defaults"""
+    if policy is not None:
+        return policy
+    return RetryPolicy(**get_endpoint_config(url).get("retry", {}))
+
+endpoint_profiles = EndpointProfiles(ENDPOINT_PROFILES_PATH, TIMEOUT_SECONDS)
+
+def record_latency(url, seconds):
+    endpoint_profiles.record(url, seconds)
+
+def observed_latency_percentile(url, percentile):
+    """Latency percentile in seconds over recent requests, or None without enough samples"""
+    return endpoint_profiles.percentile(url, percentile, HEDGE_MIN_SAMPLES)
+
+def request_timeout(url, attempt=0):
+    """Timeout of a request attempt: the endpoint's configured timeout, or one learned from its latency"""
+    return get_endpoint_config(url).get("timeout") or endpoint_profiles.timeout(url, attempt)
+
+def backoff_delay(policy, attempt, response=None):
+    """Exponential backoff with full jitter, honouring a numeric Retry-After header"""
+    if response is not None:
+        retry_after = response.headers.get("Retry-After", "")
+        if retry_after.replace(".", "", 1).isdigit():
+            return min(float(retry_after), policy.backoff_max)
+    return random.uniform(0, min(policy.backoff_max, policy.backoff_base * (2 ** attempt)))
+
+# Threads for hedged duplicate requests
+hedge_executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY * 2, thread_name_prefix="rag-hedge")
+
+def _discard_response(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+def _hedged_send(send, attempt, hedge_after):
+    """Send a request and, if it hasn't answered after hedge_after seconds, a duplicate; first success wins"""
+    trace = current_query_trace()
+    primary_started = threading.Event()
+
+    def traced_send(attempt, started=None):
+        if started is not None:
+            started.set()
+        with query_trace(trace):
+            return send(attempt)
+
+    primary = hedge_executor.submit(traced_send, attempt, primary_started)
+    # The delay runs from when the primary is sent, not from when it was queued behind other runs' requests;
+    # a primary cancelled before it starts sets the event too
+    primary.add_done_callback(lambda _: primary_started.set())
+    primary_started.wait()
+    done, _ = wait([primary], timeout=hedge_after)
+    if done:
+        return primary.result()
+    logger.info(f"Hedging request after {hedge_after:.2f}s")
+    backup = hedge_executor.submit(traced_send, attempt)
+    pending = {primary, backup}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None or not pending:
+                for other in pending:
+                    other.add_done_callback(_discard_response)
+                return future.result()
+
+def send_with_policy(send, url, policy, profiled=True):
+    """Call send(attempt) until it returns a response that shouldn't be retried.
+
+    Requests are sent with stream=True and their bodies read afterwards through a BodyReader.
+    Timeouts, connection errors and retryable status codes are retried with backoff.
+    The last response is returned, or the last exception raised, once attempts run out.
+    Retries and time to first byte are added to the current query trace.
+    Connection failures and 5xx responses count against the endpoint's circuit breaker, and while
+    it is open CircuitOpenError is raised without sending anything.
+    Latencies feed the endpoint's profile (hedge delays and learned timeouts) unless profiled is False,
+    which also turns hedging off: batch requests take longer than single queries by design.
+    """
+    trace = current_query_trace()
+    breaker = get_circuit_breaker(url) if policy.circuit_breaker else None
+    for attempt in range(policy.max_attempts):
+        last_attempt = attempt == policy.max_attempts - 1
+        if breaker is not None and not breaker.allow():
+            raise breaker.error()
+        if attempt and trace is not None:
+            trace["retries"] += 1
+        started = time.perf_counter()
+        try:
+            hedge_after = None
+            if policy.hedge and profiled:
+                hedge_after = policy.hedge_after_ms / 1000 if policy.hedge_after_ms else observed_latency_percentile(url, 95)
+            response = _hedged_send(send, attempt, hedge_after) if hedge_after else send(attempt)
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+            if breaker is not None:
+                breaker.record(False, f"{type(e).__name__}")
+            # A timed-out request took at least this long; leaving it out would keep the learned timeout too short
+            if profiled and isinstance(e, requests.exceptions.ReadTimeout):
+                record_latency(url, time.perf_counter() - started)
+            if last_attempt:
+                raise
+            delay = backoff_delay(policy, attempt)
+            logger.warning(f"Attempt {attempt+1}/{policy.max_attempts} failed ({type(e).__name__}), retrying in {delay:.2f}s")
+        except Exception as e:
+            if breaker is not None:
+                breaker.record(False, f"{type(e).__name__}")
+            raise
+        else:
+            if breaker is not None:
+                breaker.record(response.status_code < 500, f"HTTP {response.status_code}")
+            if response.status_code not in policy.retry_statuses:
+                if profiled:
+                    record_latency(url, time.perf_counter() - started)
+                return record_response(trace, response)
+            if last_attempt:
+                return record_response(trace, response)
+            delay = backoff_delay(policy, attempt, response)
+            logger.warning(f"Attempt {attempt+1}/{policy.max_attempts} got status {response.status_code}, retrying in {delay:.2f}s")
+            response.close()
+        time.sleep(delay)
+
+def record_response(trace, response):
+    """Add the final response's time to first byte to the query trace"""
+    if trace is not None:
+        # requests measures elapsed from sending the request until the response headers are parsed
+        trace["ttfb_ms"] = response.elapsed.total_seconds() * 1000
+        # When the final attempt was sent, after any failed attempts, backoff and rate-limiter waits
+        trace["sent_at"] = time.perf_counter() - response.elapsed.total_seconds()
+    return response
+
+# Answer of an OpenAI-style chat completion, and the text delta of each event when it is streamed
+OPENAI_ANSWER = compile_response_path("choices[0].message.content")
+OPENAI_STREAM_DELTA = compile_response_path("choices[0].delta.content")
+
+def iter_sse_data(chunks):
+    """Data payloads of the server-sent events in a stream of text chunks, as each event completes"""
+    buffer, data = "", []
+    for chunk in itertools.chain(chunks, ["\n\n"]):
+        buffer += chunk
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            line = line.rstrip("\r")
+            if not line:
+                if data:
+                    yield "\n".join(data)
+                    data = []
+            elif line.startswith("data:"):
+                data.append(line[6:] if line.startswith("data: ") else line[5:])
+
+def read_streamed_answer(response, delta_path=OPENAI_STREAM_DELTA):
+    """Assemble the answer of a response requested with stream=True as it arrives.
+
+    Server-sent event streams are joined from each event's delta_path field (or the raw data of
+    events that aren't JSON) up to a [DONE] event; any other body is joined from its chunks.
+    Time to first token (from when the final attempt was sent), inter-token latency and tokens per
+    second go to the query trace.
+    """
+    trace = current_query_trace()
+    reader = BodyReader(response)
+    parts, arrivals, usage_tokens = [], [], None
+
+    try:
+        if response.headers.get("Content-Type", "").startswith("text/event-stream"):
+            for data in iter_sse_data(reader):
+                if data.strip() == "[DONE]":
+                    break
+                try:
+                    event = json.loads(data)
+                except json.JSONDecodeError:
+                    delta = data
+                else:
+                    if isinstance(event, dict) and isinstance(event.get("usage"), dict):
+                        usage_tokens = event["usage"].get("completion_tokens", usage_tokens)
+                    delta = delta_path(event)
+                if delta:
+                    parts.append(delta if isinstance(delta, str) else str(delta))
+                    arrivals.append(time.perf_counter())
+        else:
+            for text in reader:
+                parts.append(text)
+                arrivals.append(time.perf_counter())
+    finally:
+        reader.close()
+
+    if trace is not None:
+        if arrivals:
+            tokens = usage_tokens or len(arrivals)
+            trace["ttft_ms"] = (arrivals[0] - trace["sent_at"]) * 1000
+            trace["tokens"] = tokens
+            generation = arrivals[-1] - arrivals[0]
+            if tokens > 1 and generation > 0:
+                trace["inter_token_ms"] = generation * 1000 / (tokens - 1)
+                trace["tokens_per_second"] = (tokens - 1) / generation
+    return "".join(parts)
+
+class QueryError(str):
+    """Error message an adapter returns in place of an answer; its row is marked failed and it is never cached"""
+
+def is_error_response(response):
+    """Whether an adapter's return value is an error rather than an answer"""
+    return isinstance(response, QueryError) or isinstance(response, str) and response.startswith("Error:")
 
 # Fallback function for non-OpenAI endpoints (original GET method)
-def query_rag(prompt, rag_endpoint, group_id=12, session_id=111, headers=None):
-    headers = headers or {}
+def query_rag(prompt, rag_endpoint, group_id=12, session_id=111, headers=None, retry_policy=None):
+    headers = dict(headers or {})
     headers.update({
         "accept": "application/json",
         "Content-Type": "application/json"
@@ -104,6 +466,7 @@ def query_rag(prompt, rag_endpoint, group_id=12, session_id=111, headers=None):
         "query": prompt,
         "session_id": session_id
     }
+    params.update(endpoint_config.get("params", {}))
     
     # Log attempt details
     logger.info(f"Attempting to query endpoint: {rag_endpoint}", extra={
@@ -112,93 +475,113 @@ def query_rag(prompt, rag_endpoint, group_id=12, session_id=111, headers=None):
         "headers": {k: "***" if k.lower() in ["authorization", "api-key"] else v for k, v in headers.items()}
     })
     
-    for attempt in range(MAX_RETRIES):
+    session = get_http_session(rag_endpoint)
+    policy = get_retry_policy(rag_endpoint, retry_policy)
+    
+    def send(attempt):
+        # Use endpoint-specific timeout or one learned from the endpoint's latency
+        current_timeout = request_timeout(rag_endpoint, attempt)
+        
+        logger.info(f"Request attempt {attempt+1}/{policy.max_attempts} with timeout {current_timeout}s")
+        
+        # Some endpoints take the params as a JSON body instead
+        if endpoint_config.get("method", "GET").upper() == "POST":
+            return session.post(
+                rag_endpoint,
+                json=params,  # Send as JSON body
+                headers=headers,
+                timeout=current_timeout,
+                verify=False,  # Skip SSL verification if needed
+                stream=True
+            )
+        return session.get(
+            rag_endpoint,
+            params=params,
+            headers=headers,
+            timeout=current_timeout,
+            verify=False,  # Skip SSL verification if needed
+            stream=True
+        )
+    
+    try:
+        response = send_with_policy(send, rag_endpoint, policy)
+        
+        # Log the response status and time
+        logger.info(f"Response received with status code: {response.status_code}")
+        
+        if not response.ok:
+            response.close()
+        response.raise_for_status()
+        reader = BodyReader(response)
+
+        # Endpoints configured with a response field return the answer there; read the body no further than it
+        response_field = endpoint_config.get("response_field")
+        if response_field and response.headers.get("Content-Type", "").startswith("application/json"):
+            answer = read_json_answer(reader, compile_response_path(response_field))
+            if answer is None:
+                error_msg = reader.truncation_error() if reader.truncated else f"Error: No '{response_field}' field in the response"
+                logger.warning(error_msg)
+                return QueryError(error_msg)
+            return answer
+        text = reader.text()
+        if reader.truncated:
+            # A cut-off body is neither valid JSON nor the whole answer
+            error_msg = reader.truncation_error()
+            logger.warning(error_msg)
+            return QueryError(error_msg)
+
+        # Try to parse as JSON
         try:
-            # Use endpoint-specific timeout or default shorter timeout for first attempt
-            current_timeout = endpoint_config.get("timeout", TIMEOUT_SECONDS/2 if attempt == 0 else TIMEOUT_SECONDS)
-            
-            logger.info(f"Request attempt {attempt+1}/{MAX_RETRIES} with timeout {current_timeout}s")
-            
-            # For your specific endpoint, use POST instead of GET
-            if "10.229.222.15:8000" in rag_endpoint:
-                response = requests.post(
-                    rag_endpoint,
-                    json=params,  # Send as JSON body
-                    headers=headers,
-                    timeout=current_timeout,
-                    verify=False  # Skip SSL verification if needed
-                )
-            else:
-                response = requests.get(
-                    rag_endpoint,
-                    params=params,
-                    headers=headers,
-                    timeout=current_timeout,
-                    verify=False  # Skip SSL verification if needed
-                )
-            
-            # Log the response status and time
-            logger.info(f"Response received with status code: {response.status_code}")
-            
-            response.raise_for_status()
-            
-            # Try to parse as JSON
-            try:
-                data = response.json()
-                logger.info("Successfully parsed JSON response", extra={
-                    "keys": list(data.keys()) if isinstance(data, dict) else "non-dict-response",
-                    "response_type": type(data).__name__
-                })
-                
-                # For your specific endpoint, extract answer from the response format
-                if "10.229.222.15:8000" in rag_endpoint:
-                    if isinstance(data, dict) and "response" in data:
-                        return data["response"]
-                    else:
-                        logger.warning(f"Unexpected response format: {data}")
-                        return str(data)
-                
-                # For other endpoints, try to find the answer in common fields
-                if isinstance(data, dict):
-                    for key in ["answer", "response", "result", "text", "content"]:
-                        if key in data:
-                            return data[key]
-                    
-                    # If no known fields found, return the whole response
-                    return str(data)
+            data = json.loads(text)
+            logger.info("Successfully parsed JSON response", extra={
+                "keys": list(data.keys()) if isinstance(data, dict) else "non-dict-response",
+                "response_type": type(data).__name__
+            })
+
+            if response_field:
+                if isinstance(data, dict) and response_field in data:
+                    return data[response_field]
                 else:
+                    logger.warning(f"Unexpected response format: {str(data)[:500]}")
                     return str(data)
-                    
-            except json.JSONDecodeError:
-                # Not JSON, return as text
-                logger.warning("Response is not valid JSON, returning as text")
-                return f"Raw response: {response.text[:500]}..."
+
+            # For other endpoints, try to find the answer in common fields
+            if isinstance(data, dict):
+                for key in ["answer", "response", "result", "text", "content"]:
+                    if key in data:
+                        return data[key]
                 
-        except requests.exceptions.Timeout:
-            logger.warning(f"Timeout on attempt {attempt+1}/{MAX_RETRIES}")
-            if attempt == MAX_RETRIES - 1:
-                return "Error: Server response timeout. Please try again later or check your endpoint configuration."
-            continue
-        except requests.exceptions.ConnectionError as e:
-            error_msg = f"Connection error: {str(e)}"
-            logger.error(error_msg)
-            return f"Error: Unable to connect to the server. Please check your network connection and endpoint URL. Details: {str(e)}"
-        except requests.exceptions.RequestException as e:
-            error_msg = f"Request exception: {str(e)}"
-            logger.error(error_msg)
-            return f"Error: {str(e)}"
-        except Exception as e:
-            error_msg = f"Unexpected error: {str(e)}"
-            logger.error(error_msg, exc_info=True)
-            return f"Unexpected error: {str(e)}"
-    
-    return "Error: Maximum retries exceeded. The endpoint is not responding in a timely manner."
+                # If no known fields found, return the whole response
+                return str(data)
+            else:
+                return str(data)
+                
+        except json.JSONDecodeError:
+            # Not JSON, return as text
+            logger.warning("Response is not valid JSON, returning as text")
+            return f"Raw response: {text[:500]}..."
+            
+    except requests.exceptions.Timeout:
+        logger.warning(f"Timeout after {policy.max_attempts} attempts")
+        return QueryError("Error: Server response timeout. Please try again later or check your endpoint configuration.")
+    except requests.exceptions.ConnectionError as e:
+        error_msg = f"Connection error: {str(e)}"
+        logger.error(error_msg)
+        return QueryError(f"Error: Unable to connect to the server. Please check your network connection and endpoint URL. Details: {str(e)}")
+    except requests.exceptions.RequestException as e:
+        error_msg = f"Request exception: {str(e)}"
+        logger.error(error_msg)
+        return QueryError(f"Error: {str(e)}")
+    except Exception as e:
+        error_msg = f"Unexpected error: {str(e)}"
+        logger.error(error_msg, exc_info=True)
+        return QueryError(f"Unexpected error: {str(e)}")
 
 # Function to call OpenAI's Chat Completions API (POST method)
-def query_openai(prompt, rag_endpoint, api_key=None):
+def query_openai(prompt, rag_endpoint, api_key=None, retry_policy=None, stream=False, rpm=None, tpm=None):
     api_key = api_key or os.getenv("OPENAI_API_KEY")
     if not api_key:
-        return "Error: OPENAI_API_KEY not set in environment."
+        return QueryError("Error: OPENAI_API_KEY not set in environment.")
     headers = {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {api_key}"
@@ -209,31 +592,90 @@ def query_openai(prompt, rag_endpoint, api_key=None):
         "temperature": 0.7,
         "max_tokens": 150
     }
+    if stream:
+        # The final event then carries the completion's token count
+        data.update(stream=True, stream_options={"include_usage": True})
+    session = get_http_session(rag_endpoint)
+    limiter = get_rate_limiter(rag_endpoint, api_key, rpm, tpm)
     try:
-        response = requests.post(
+        response = send_with_policy(
+            rate_limited(
+                lambda attempt: session.post(rag_endpoint, headers=headers, json=data, timeout=request_timeout(rag_endpoint, attempt),
+                                         stream=True),
+                limiter,
+                estimate_tokens(prompt) + data["max_tokens"]
+            ),
             rag_endpoint,
-            headers=headers,
-            json=data,
-            timeout=TIMEOUT_SECONDS
+            get_retry_policy(rag_endpoint, retry_policy)
         )
+        if not response.ok:
+            response.close()
         response.raise_for_status()
-        json_response = response.json()
-        answer = json_response["choices"][0]["message"]["content"]
+        if stream:
+            return read_streamed_answer(response)
+        reader = BodyReader(response)
+        answer = read_json_answer(reader, OPENAI_ANSWER)
+        if answer is None:
+            return QueryError(reader.truncation_error() if reader.truncated else "Error: No answer in the completion response")
         return answer
     except requests.exceptions.Timeout:
-        return "Error: Server response timeout. Please try again later."
+        return QueryError("Error: Server response timeout. Please try again later.")
     except requests.exceptions.RequestException as e:
-        return f"Error: {str(e)}"
+        return QueryError(f"Error: {str(e)}")
     except Exception as e:
-        return f"Unexpected error: {str(e)}"
+        return QueryError(f"Unexpected error: {str(e)}")
 
-# Simple evaluation function (placeholder metrics)
-def evaluate(dataset=None):
-    return {
-        "Context Recall": 0.85,
-        "Faithfulness": 0.92,
-        "Factual Correctness": 0.88
-    }
+def row_metrics(scores, index):
+    """Per-row metric values from the arrays returned by score_pairs"""
+    return {key: round(float(values[index]), 4) for key, values in scores.items()}
+
+# Scoring tokenizes every response in Python, which holds the GIL, so large runs are split into
+# shards scored by worker processes. Spawned workers only import the metrics module.
+scoring_executor = ProcessPoolExecutor(max_workers=SCORING_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+
+def score_responses(responses, reference_index):
+    """Score responses against their references, in shards across the scoring processes for large runs.
+
+    Workers load the reference index from its file and get the responses as packed UTF-8 buffers;
+    their per-row scores are concatenated back in order. Every shard uses the whole index, so the
+    scores are the same as scoring in one piece.
+    """
+    if SCORING_WORKERS <= 1 or len(responses) < 2 * SCORING_SHARD_ROWS:
+        return reference_index.score(responses)
+    temporary = None
+    if reference_index.path is None:
+        # Indexes that were never saved (the built-in set, a run's own references) go to a file for the workers
+        fd, temporary = tempfile.mkstemp(prefix="rag_index_", suffix=".npz")
+        os.close(fd)
+        reference_index.save(temporary)
+    try:
+        shard_rows = max(SCORING_SHARD_ROWS, -(-len(responses) // SCORING_WORKERS))
+        futures = [
+            scoring_executor.submit(score_shard, reference_index.path, start, *pack_texts(responses[start:start + shard_rows]))
+            for start in range(0, len(responses), shard_rows)
+        ]
+        shards = [future.result() for future in futures]
+    finally:
+        if temporary:
+            reference_index.path = None
+            _remove_file(temporary)
+    return {key: np.concatenate([shard[key] for shard in shards]) for key in shards[0]}
+
+# Evaluation function: scores every row with the lexical metrics (stored on the row under
+# "metrics") and averages them over the successful rows. When the dataset's reference index
+# is given, the references are not tokenized again.
+def evaluate(dataset=None, reference_index=None):
+    dataset = dataset or []
+    successful = np.array([d.get("status") == "success" for d in dataset], dtype=bool)
+    if not successful.any():
+        return {name: 0 for name in METRIC_NAMES.values()}
+    responses = [str(d["response"]) for d in dataset]
+    if reference_index is None or len(reference_index) != len(dataset):
+        reference_index = ReferenceIndex.build(str(d["reference"]) for d in dataset)
+    scores = score_responses(responses, reference_index)
+    for index, row in enumerate(dataset):
+        row["metrics"] = row_metrics(scores, index)
+    return summarize(scores, successful)
 
 # Sample queries and expected responses for evaluation
 sample_queries = [
@@ -301,25 +743,826 @@ class EvaluateRequest(BaseModel):
     request_format: dict = None     # Custom format for the request body
     response_path: str = "answer"   # JSON path to extract the answer from response
     headers: dict = None            # Custom headers
+    max_concurrency: int = DEFAULT_CONCURRENCY  # Queries sent to the endpoint in parallel
+    dataset_id: Optional[str] = None  # Uploaded dataset to evaluate instead of the built-in sample queries
+    retry: Optional[RetryPolicy] = None  # Retry/hedging policy; defaults to the endpoint's configured policy
+    report_page_size: Optional[int] = None  # Rows in the HTML report's first page (0 or unset: every row); the rest via /api/runs/{run_id}/report
+    bypass_cache: bool = False      # Always query the endpoint instead of reusing cached responses
+    incremental: bool = False       # Only query rows whose query isn't answered in the baseline run
+    stream: bool = False            # Request and consume streamed answers to measure time to first token (openai, azure, custom)
+    stream_path: Optional[str] = None  # Path of the text delta in each streamed JSON event; OpenAI's choices[0].delta.content by default
+    rate_limit_rpm: Optional[int] = None  # Requests/minute the OpenAI or Azure key allows, until its rate-limit headers say otherwise
+    rate_limit_tpm: Optional[int] = None  # Tokens/minute the OpenAI or Azure key allows, until its rate-limit headers say otherwise
+    batch_size: int = 1             # Queries packed into each POST for endpoints that accept several (generic and custom)
+    batch_format: Optional[dict] = None  # Batch request body; a "{prompts}" value is replaced by the list of queries
+    batch_item_format: Optional[dict] = None  # Optional template ("{prompt}") for each query in that list
+    batch_response_path: str = "answers"  # Path of the answers in a batch response, one per query, e.g. "results[*].answer"
+    baseline_run_id: Optional[str] = None  # Run to reuse answers from; defaults to the latest run of this endpoint
+    _custom_endpoint: Optional[tuple] = PrivateAttr(default=None)  # Compiled request template and response extractor
+    _batch_endpoint: Optional[tuple] = PrivateAttr(default=None)  # Compiled batch templates and answer extractor
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries expire after a fixed time-to-live"""
+
+    def __init__(self, max_items, ttl_seconds):
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def __len__(self):
+        return len(self._items)
+
+def sqlite_connection(local, path):
+    """Per-thread autocommit SQLite connection; WAL lets readers in other processes run alongside a writer"""
+    db = getattr(local, "db", None)
+    if db is None:
+        db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+        local.db = db
+    return db
+
+class SQLiteCache:
+    """TTLCache with the same interface backed by a SQLite file, so entries survive restarts and
+    are shared by every worker process using the file. Values must be JSON-serializable."""
+
+    def __init__(self, path, max_items, ttl_seconds):
+        self.path = path
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        self._writes = 0
+        db = self._connect()
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS cache "
+            "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, used_at REAL NOT NULL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS cache_used_at ON cache (used_at)")
+
+    def _connect(self):
+        return sqlite_connection(self._local, self.path)
+
+    def get(self, key):
+        db = self._connect()
+        now = time.time()
+        row = db.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] < now:
+            db.execute("DELETE FROM cache WHERE key = ?", (key,))
+            return None
+        db.execute("UPDATE cache SET used_at = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        db = self._connect()
+        now = time.time()
+        db.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at, used_at) VALUES (?, ?, ?, ?)",
+            (key, json.dumps(value), now + self.ttl_seconds, now)
+        )
+        # Evict in batches rather than on every write; the size cap can be overshot by up to 100 entries
+        self._writes += 1
+        if self._writes % 100 == 0:
+            db.execute("DELETE FROM cache WHERE expires_at < ?", (now,))
+            db.execute(
+                "DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_items,)
+            )
+
+    def __len__(self):
+        return self._connect().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
+
+class RunHistory:
+    """Every finished evaluation run and its per-query rows (answers, metrics, timings), kept in
+    SQLite and indexed by endpoint configuration and dataset hash.
+
+    Recording a run deletes runs beyond the newest max_runs or older than max_age_days, with their
+    rows, so the database doesn't grow without bound.
+    """
+
+    def __init__(self, path, max_runs=None, max_age_days=None):
+        self.path = path
+        self.max_runs = max_runs
+        self.max_age_days = max_age_days
+        self._local = threading.local()
+        self._connect().executescript("""
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id TEXT PRIMARY KEY,
+                created_at TEXT NOT NULL,
+                rag_endpoint TEXT NOT NULL,
+                endpoint_type TEXT,
+                endpoint_key TEXT NOT NULL,
+                dataset_id TEXT,
+                dataset_hash TEXT NOT NULL,
+                total INTEGER NOT NULL,
+                success_count INTEGER NOT NULL,
+                evaluation_results TEXT NOT NULL,
+                latency TEXT
+            );
+            CREATE INDEX IF NOT EXISTS runs_endpoint ON runs (endpoint_key, dataset_hash, created_at);
+            CREATE INDEX IF NOT EXISTS runs_dataset ON runs (dataset_hash, created_at);
+            CREATE TABLE IF NOT EXISTS run_rows (
+                run_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                query_hash TEXT NOT NULL,
+                status TEXT NOT NULL,
+                row TEXT NOT NULL,
+                PRIMARY KEY (run_id, position)
+            );
+        """)
+
+    def _connect(self):
+        return sqlite_connection(self._local, self.path)
+
+    def record(self, run):
+        db = self._connect()
+        dataset = run["dataset"]
+        db.execute("BEGIN")
+        try:
+            db.execute(
+                "INSERT INTO runs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (run["run_id"], run["created_at"], run["rag_endpoint"], run["endpoint_type"], run["endpoint_key"],
+                 run["dataset_id"], run["dataset_hash"], len(dataset),
+                 sum(1 for row in dataset if row["status"] == "success"),
+                 json.dumps(run["evaluation_results"]), json.dumps(run["latency"]))
+            )
+            db.executemany(
+                "INSERT INTO run_rows VALUES (?, ?, ?, ?, ?)",
+                ((run["run_id"], position, query_hash(row["user_input"]), row["status"], json.dumps(row))
+                 for position, row in enumerate(dataset))
+            )
+            self._prune(db)
+            db.execute("COMMIT")
+        except BaseException:
+            db.execute("ROLLBACK")
+            raise
+
+    def _prune(self, db):
+        conditions, params = [], []
+        if self.max_age_days:
+            conditions.append("created_at < ?")
+            params.append((datetime.now() - timedelta(days=self.max_age_days)).isoformat())
+        if self.max_runs:
+            conditions.append("run_id NOT IN (SELECT run_id FROM runs ORDER BY created_at DESC LIMIT ?)")
+            params.append(self.max_runs)
+        if not conditions:
+            return
+        expired = f"SELECT run_id FROM runs WHERE {' OR '.join(conditions)}"
+        db.execute(f"DELETE FROM run_rows WHERE run_id IN ({expired})", params)
+        db.execute(f"DELETE FROM runs WHERE run_id IN ({expired})", params)
+
+    def get(self, run_id):
+        """A stored run in the same shape as the run store's entries, or None"""
+        db = self._connect()
+        columns = ("run_id", "created_at", "rag_endpoint", "endpoint_type", "endpoint_key", "dataset_id", "dataset_hash",
+                   "evaluation_results", "latency")
+        found = db.execute(f"SELECT {', '.join(columns)} FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+        if found is None:
+            return None
+        run = dict(zip(columns, found))
+        run["evaluation_results"] = json.loads(run["evaluation_results"])
+        run["latency"] = json.loads(run["latency"]) if run["latency"] else None
+        run["dataset"] = [
+            json.loads(row) for row, in
+            db.execute("SELECT row FROM run_rows WHERE run_id = ? ORDER BY position", (run_id,))
+        ]
+        return run
+
+    def list(self, rag_endpoint=None, dataset_hash=None, limit=50):
+        """Run summaries, newest first"""
+        columns = ("run_id", "created_at", "rag_endpoint", "endpoint_type", "dataset_id", "dataset_hash",
+                   "total", "success_count", "evaluation_results")
+        conditions, params = [], []
+        if rag_endpoint:
+            conditions.append("rag_endpoint = ?")
+            params.append(rag_endpoint)
+        if dataset_hash:
+            conditions.append("dataset_hash = ?")
+            params.append(dataset_hash)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        runs = []
+        for found in self._connect().execute(
+            f"SELECT {', '.join(columns)} FROM runs {where} ORDER BY created_at DESC LIMIT ?", (*params, limit)
+        ):
+            run = dict(zip(columns, found))
+            run["evaluation_results"] = json.loads(run["evaluation_results"])
+            runs.append(run)
+        return runs
+
+    def latest(self, endpoint_key, dataset_hash=None):
+        """Most recent run id for an endpoint configuration, preferring runs over the same dataset"""
+        db = self._connect()
+        found = None
+        if dataset_hash:
+            found = db.execute(
+                "SELECT run_id FROM runs WHERE endpoint_key = ? AND dataset_hash = ? ORDER BY created_at DESC LIMIT 1",
+                (endpoint_key, dataset_hash)
+            ).fetchone()
+        if found is None:
+            found = db.execute(
+                "SELECT run_id FROM runs WHERE endpoint_key = ? ORDER BY created_at DESC LIMIT 1", (endpoint_key,)
+            ).fetchone()
+        return found[0] if found else None
+
+    def answers(self, run_id):
+        """Successful rows of a run keyed by query hash"""
+        return {
+            key: json.loads(row) for key, row in self._connect().execute(
+                "SELECT query_hash, row FROM run_rows WHERE run_id = ? AND status = 'success'", (run_id,)
+            )
+        }
+
+run_history = RunHistory(HISTORY_DB, HISTORY_MAX_RUNS, HISTORY_MAX_AGE_DAYS) if HISTORY_DB else None
+
+# Completed evaluation runs, so reports can be re-rendered without querying the endpoint again
+run_store = TTLCache(RUN_STORE_SIZE, RUN_STORE_TTL_SECONDS)
+
+# Percentiles reported for each latency phase (see reports.LATENCY_PHASES)
+LATENCY_PERCENTILES = [50, 90, 95, 99]
+
+def query_timings(trace, total_ms):
+    """Per-query timings stored on a dataset row"""
+    return {
+        "dns_ms": round(trace["dns_ms"], 1),
+        "connect_ms": round(trace["connect_ms"], 1),
+        "tls_ms": round(trace["tls_ms"], 1),
+        "ttfb_ms": round(trace["ttfb_ms"], 1) if trace["ttfb_ms"] is not None else None,
+        "total_ms": total_ms,
+        "bytes_received": trace["bytes_received"],
+        "retries": trace["retries"],
+        "connections_opened": trace["connections_opened"],
+        "cached": trace["cached"],
+        "ttft_ms": round(trace["ttft_ms"], 1) if trace["ttft_ms"] is not None else None,
+        "inter_token_ms": round(trace["inter_token_ms"], 2) if trace["inter_token_ms"] is not None else None,
+        "tokens": trace["tokens"],
+        "tokens_per_second": round(trace["tokens_per_second"], 1) if trace["tokens_per_second"] is not None else None,
+        "truncated": trace["truncated"]
+    }
+
+def latency_percentiles(values):
+    """p50/p90/p95/p99/max/mean of a list of millisecond values, or None if it is empty"""
+    values = np.asarray(values, dtype=float)
+    if not len(values):
+        return None
+    stats = {f"p{p}": round(float(v), 1) for p, v in zip(LATENCY_PERCENTILES, np.percentile(values, LATENCY_PERCENTILES))}
+    stats.update(max=round(float(values.max()), 1), mean=round(float(values.mean()), 1))
+    return stats
+
+def summarize_latency(dataset, wall_seconds):
+    """Aggregate per-query timings into percentiles per phase and throughput for a run"""
+    timings = [row.get("timings") or {"total_ms": row["latency_ms"]} for row in dataset]
+    # Answers served from the response cache or reused from an earlier run say nothing about the endpoint's latency
+    measured = [t for t in timings if not (t.get("cached") or t.get("reused_from"))]
+    phases = {}
+    for key in LATENCY_PHASES:
+        stats = latency_percentiles([t[key] for t in measured if t.get(key) is not None])
+        if stats:
+            phases[key] = stats
+    return {
+        "queries": len(dataset),
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_qps": round(len(dataset) / wall_seconds, 2) if wall_seconds > 0 else 0.0,
+        "retries": sum(t.get("retries", 0) for t in timings),
+        "bytes_received": sum(t.get("bytes_received", 0) for t in timings),
+        "connections_opened": sum(t.get("connections_opened", 0) for t in timings),
+        "cached_queries": sum(1 for t in timings if t.get("cached")),
+        "reused_queries": sum(1 for t in timings if t.get("reused_from")),
+        "truncated_responses": sum(1 for t in timings if t.get("truncated")),
+        "phases": phases,
+        # Decoding rate of streamed answers
+        "tokens_per_second": latency_percentiles([t["tokens_per_second"] for t in measured if t.get("tokens_per_second") is not None])
+    }
+
+def save_run(request, dataset, evaluation_results, latency=None):
+    """Store a finished evaluation run and return its identifier"""
+    run_id = uuid.uuid4().hex
+    run = {
+        "run_id": run_id,
+        "created_at": datetime.now().isoformat(),
+        "rag_endpoint": request.rag_endpoint.strip(),
+        "endpoint_type": request.endpoint_type,
+        "dataset_id": request.dataset_id,
+        "dataset_hash": dataset_hash(request),
+        "endpoint_key": endpoint_config_key(request),
+        "dataset": dataset,
+        "evaluation_results": evaluation_results,
+        "latency": latency
+    }
+    run_store.set(run_id, run)
+    if run_history is not None:
+        try:
+            run_history.record(run)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not record evaluation run {run_id} in history: {str(e)}")
+    if RUN_STORE_DIR:
+        try:
+            os.makedirs(RUN_STORE_DIR, exist_ok=True)
+            with open(os.path.join(RUN_STORE_DIR, f"{run_id}.json"), "w", encoding="utf-8") as f:
+                json.dump(run, f)
+        except OSError as e:
+            logger.warning(f"Could not persist evaluation run {run_id}: {str(e)}")
+    return run_id
+
+def load_run(run_id):
+    """Look up a stored evaluation run, falling back to the on-disk copy and then the history"""
+    run = run_store.get(run_id)
+    if run is not None:
+        return run
+    # Run ids are generated hex strings, reject anything else before touching the filesystem
+    if not run_id.isalnum():
+        return None
+    if RUN_STORE_DIR:
+        path = os.path.join(RUN_STORE_DIR, f"{run_id}.json")
+        try:
+            if time.time() - os.path.getmtime(path) > RUN_STORE_TTL_SECONDS:
+                os.remove(path)
+            else:
+                with open(path, encoding="utf-8") as f:
+                    run = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            pass
+    if run is None and run_history is not None:
+        run = run_history.get(run_id)
+    if run is not None:
+        run_store.set(run_id, run)
+    return run
+
+# Uploaded evaluation datasets, stored under their content hash so the same file is only kept once
+DATASET_FORMATS = {".csv": "csv", ".jsonl": "jsonl", ".ndjson": "jsonl", ".parquet": "parquet"}
+QUERY_COLUMNS = ("query", "question", "user_input", "prompt")
+REFERENCE_COLUMNS = ("reference", "expected_response", "ground_truth", "answer", "expected")
+
+def _dataset_path(dataset_id, suffix):
+    return os.path.join(DATASET_DIR, f"{dataset_id}{suffix}")
+
+def load_dataset_info(dataset_id):
+    """Get the metadata of an uploaded dataset, or None if it doesn't exist"""
+    # Dataset ids are hex digests, reject anything else before touching the filesystem
+    if not dataset_id or not dataset_id.isalnum():
+        return None
+    try:
+        with open(_dataset_path(dataset_id, ".json"), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+def _iter_dataset_chunks(path, file_format, columns=None):
+    """Yield DataFrames of at most DATASET_CHUNK_ROWS rows without loading the whole file"""
+    if file_format == "csv":
+        yield from pd.read_csv(path, chunksize=DATASET_CHUNK_ROWS, usecols=columns, dtype=str, keep_default_na=False)
+    elif file_format == "jsonl":
+        for chunk in pd.read_json(path, lines=True, chunksize=DATASET_CHUNK_ROWS, dtype=False):
+            yield chunk[columns] if columns else chunk
+    elif file_format == "parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ValueError("Parquet datasets require the pyarrow package to be installed")
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=DATASET_CHUNK_ROWS, columns=columns):
+            yield batch.to_pandas()
+    else:
+        raise ValueError(f"Unsupported dataset format: {file_format}")
+
+def _scan_dataset(path, file_format):
+    """Validate a dataset file chunk by chunk and work out its query/reference columns and row count"""
+    query_column = reference_column = None
+    rows = 0
+    for chunk in _iter_dataset_chunks(path, file_format):
+        if query_column is None:
+            columns = {str(c).lower(): c for c in chunk.columns}
+            query_column = next((columns[c] for c in QUERY_COLUMNS if c in columns), None)
+            reference_column = next((columns[c] for c in REFERENCE_COLUMNS if c in columns), None)
+            if query_column is None or reference_column is None:
+                raise ValueError(
+                    f"Dataset must have a query column ({', '.join(QUERY_COLUMNS)}) "
+                    f"and a reference column ({', '.join(REFERENCE_COLUMNS)})"
+                )
+        rows += len(chunk)
+    if rows == 0:
+        raise ValueError("Dataset is empty")
+    return query_column, reference_column, rows
+
+def iter_dataset(dataset_id):
+    """Stream (query, reference) pairs from an uploaded dataset"""
+    info = load_dataset_info(dataset_id)
+    path = _dataset_path(dataset_id, info["extension"])
+    columns = [info["query_column"], info["reference_column"]]
+    for chunk in _iter_dataset_chunks(path, info["format"], columns):
+        for query, reference in zip(chunk[columns[0]], chunk[columns[1]]):
+            yield ("" if pd.isna(query) else str(query)), ("" if pd.isna(reference) else str(reference))
+
+# Content hash of the built-in sample set; uploaded datasets are already named by their content hash
+BUILTIN_DATASET_HASH = hashlib.sha256(json.dumps([sample_queries, expected_responses]).encode()).hexdigest()
+
+def dataset_hash(request):
+    return request.dataset_id or BUILTIN_DATASET_HASH
+
+def evaluation_input(request):
+    """Return the (query, reference) pairs and their count for an evaluation, or None if the dataset is unknown"""
+    if not request.dataset_id:
+        return zip(sample_queries, expected_responses), len(sample_queries)
+    info = load_dataset_info(request.dataset_id)
+    if info is None:
+        return None
+    return iter_dataset(request.dataset_id), info["rows"]
+
+# Reference indexes hold each dataset's tokenized, TF-IDF weighted references so runs only
+# have to process the responses. The built-in set is indexed at startup, uploads when stored.
+builtin_reference_index = None
+reference_indexes = TTLCache(REFERENCE_INDEX_CACHE_SIZE, 24 * 3600)
+
+def build_dataset_index(dataset_id):
+    """Index the references of an uploaded dataset and save the index next to it"""
+    index = ReferenceIndex.build(reference for _, reference in iter_dataset(dataset_id))
+    index.save(_dataset_path(dataset_id, ".index.npz"))
+    reference_indexes.set(dataset_id, index)
+    return index
+
+def get_reference_index(dataset_id=None):
+    """Get the reference index of a dataset (the built-in sample set by default)"""
+    global builtin_reference_index
+    if not dataset_id:
+        if builtin_reference_index is None:
+            builtin_reference_index = ReferenceIndex.build(expected_responses)
+        return builtin_reference_index
+    index = reference_indexes.get(dataset_id)
+    if index is not None:
+        return index
+    if load_dataset_info(dataset_id) is None:
+        return None
+    path = _dataset_path(dataset_id, ".index.npz")
+    try:
+        index = ReferenceIndex.load(path)
+    except (OSError, ValueError, KeyError):
+        logger.info(f"Building missing reference index for dataset {dataset_id}")
+        return build_dataset_index(dataset_id)
+    reference_indexes.set(dataset_id, index)
+    return index
+
+# Endpoint responses keyed by the endpoint configuration and query, so repeated benchmark runs
+# against an unchanged endpoint don't pay for every query again. Only successful answers are cached.
+response_cache = None
+if RESPONSE_CACHE_SIZE > 0:
+    if RESPONSE_CACHE_DB:
+        response_cache = SQLiteCache(RESPONSE_CACHE_DB, RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL_SECONDS)
+    else:
+        response_cache = TTLCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL_SECONDS)
+
+def endpoint_config_key(request):
+    """Hash of the endpoint configuration that determines its answers; credentials only enter as hashes"""
+    secrets = hashlib.sha256(json.dumps([request.headers or {}, request.api_key], sort_keys=True).encode()).hexdigest()
+    return hashlib.sha256(json.dumps([
+        request.rag_endpoint.strip(),
+        request.endpoint_type,
+        request.request_method,
+        request.request_format,
+        request.response_path,
+        secrets
+    ], sort_keys=True).encode()).hexdigest()
+
+def query_hash(query):
+    return hashlib.sha256(str(query).encode()).hexdigest()
+
+def response_cache_key(query, request):
+    return hashlib.sha256(f"{endpoint_config_key(request)}:{query_hash(query)}".encode()).hexdigest()
+
+def query_endpoint(query, request):
+    """Answer a query from the response cache, or query the endpoint and cache a successful answer"""
+    if response_cache is None or request.bypass_cache:
+        return query_adapter(query, request)
+    key = response_cache_key(query, request)
+    response = response_cache.get(key)
+    if response is not None:
+        trace = current_query_trace()
+        if trace is not None:
+            trace["cached"] = True
+        return response
+    response = query_adapter(query, request)
+    if not is_error_response(response):
+        response_cache.set(key, response)
+    return response
+
+# Send a single query using the adapter that matches the request's endpoint type
+def query_adapter(query, request):
+    rag_endpoint = request.rag_endpoint.strip()
+    if request.endpoint_type == "openai" or "openai.com" in rag_endpoint:
+        return query_openai(query, rag_endpoint, request.api_key, retry_policy=request.retry, stream=request.stream,
+                            rpm=request.rate_limit_rpm, tpm=request.rate_limit_tpm)
+    elif request.endpoint_type == "azure":
+        return query_azure(query, rag_endpoint, request.api_key, request.headers, retry_policy=request.retry,
+                           stream=request.stream, rpm=request.rate_limit_rpm, tpm=request.rate_limit_tpm)
+    elif request.endpoint_type == "custom" and request.request_format:
+        template, extractor = compiled_custom_endpoint(request)
+        return query_custom(query, rag_endpoint, request.api_key,
+                            request.request_method, template,
+                            extractor, request.headers, retry_policy=request.retry,
+                            stream=request.stream, stream_path=request.stream_path)
+    else:
+        return query_rag(query, rag_endpoint, headers=request.headers, retry_policy=request.retry)
+
+def compiled_custom_endpoint(request):
+    """The request's request_format and response_path, compiled on first use and reused for the rest of the run"""
+    if request._custom_endpoint is None:
+        request._custom_endpoint = (
+            RequestTemplate(request.request_format, request.request_method),
+            compile_response_path(request.response_path)
+        )
+    return request._custom_endpoint
+
+def response_row(query, reference, response, latency_ms):
+    """Dataset row for an endpoint's answer to a query (or its error message)"""
+    # Check if the response indicates an error
+    if is_error_response(response):
+        response = str(response)
+        return {
+            "user_input": query,
+            "retrieved_contexts": [response],
+            "response": response,
+            "reference": reference,
+            "status": "error",
+            "latency_ms": latency_ms
+        }
+    # Response paths with several fields return the answer and its contexts separately
+    if isinstance(response, dict) and "answer" in response:
+        response_list = response.get("contexts") or response["answer"]
+        response = response["answer"]
+    else:
+        response_list = response
+    # Ensure retrieved_contexts is stored as a list
+    response_list = response_list if isinstance(response_list, list) else [response_list]
+    return {
+        "user_input": query,
+        "retrieved_contexts": response_list,
+        "response": response,
+        "reference": reference,
+        "status": "success",
+        "latency_ms": latency_ms
+    }
+
+def run_single_query(index, total, query, reference, request):
+    """Query the endpoint once and build the dataset row for the result"""
+    started = time.perf_counter()
+    with query_trace() as trace:
+        try:
+            logger.info(f"Processing query {index + 1}/{total}: {query[:30]}...")
+            response = query_endpoint(query, request)
+            row = response_row(query, reference, response, round((time.perf_counter() - started) * 1000, 1))
+            if row["status"] == "error":
+                logger.warning(f"Error in query {index + 1}: {response}")
+        except Exception as e:
+            logger.error(f"Exception processing query {index + 1}: {str(e)}", exc_info=True)
+            row = {
+                "user_input": query,
+                "retrieved_contexts": [f"Error: {str(e)}"],
+                "response": f"Error: {str(e)}",
+                "reference": reference,
+                "status": "error",
+                "latency_ms": round((time.perf_counter() - started) * 1000, 1)
+            }
+    row["timings"] = query_timings(trace, row["latency_ms"])
+    if trace["truncated"]:
+        row["truncated"] = True
+    return row
+
+def request_batch_size(request):
+    """Queries per request for a run; batching only applies to the generic and custom adapters"""
+    if request.endpoint_type not in ("generic", "custom") or "openai.com" in request.rag_endpoint:
+        return 1
+    return max(1, min(request.batch_size or 1, MAX_BATCH_SIZE))
+
+def compiled_batch_endpoint(request):
+    """The request's batch templates and answer extractor, compiled on first use"""
+    if request._batch_endpoint is None:
+        request._batch_endpoint = (
+            RequestTemplate(request.batch_format, "POST", BATCH_PLACEHOLDER),
+            RequestTemplate(request.batch_item_format, "POST") if request.batch_item_format else None,
+            compile_response_path(request.batch_response_path)
+        )
+    return request._batch_endpoint
+
+def endpoint_config_error(request):
+    """Why the request's templates or response paths can't be compiled, or None; checked before any query is sent"""
+    try:
+        if request.endpoint_type == "custom" and request.request_format:
+            compiled_custom_endpoint(request)
+        if request_batch_size(request) > 1:
+            compiled_batch_endpoint(request)
+    except ValueError as e:
+        return str(e)
+    return None
+
+def query_batch(queries, request):
+    """POST several queries in one request and return their answers in order (None where one is missing)"""
+    rag_endpoint = request.rag_endpoint.strip()
+    template, item_template, extract = compiled_batch_endpoint(request)
+    headers = dict(request.headers or {})
+    if request.api_key:
+        headers["Authorization"] = f"Bearer {request.api_key}"
+    body = template.render([item_template.render(query) for query in queries] if item_template else list(queries))
+    session = get_http_session(rag_endpoint)
+    response = send_with_policy(
+        lambda attempt: session.post(rag_endpoint, headers=headers, json=body, timeout=(TIMEOUT_SECONDS, BATCH_TIMEOUT_SECONDS),
+                                     stream=True),
+        rag_endpoint,
+        get_retry_policy(rag_endpoint, request.retry),
+        profiled=False
+    )
+    if not response.ok:
+        response.close()
+    response.raise_for_status()
+    # A batch answers many queries, so its body may be as long as theirs together
+    reader = BodyReader(response, MAX_RESPONSE_BYTES * len(queries))
+    body = reader.text()
+    if reader.truncated:
+        raise ValueError(f"Batch response exceeded {reader.limit} bytes")
+    answers = extract(json.loads(body))
+    # Multi-field paths extract parallel lists of answers and contexts
+    if isinstance(answers, dict):
+        contexts = answers.get("contexts")
+        answers = answers["answer"]
+        if isinstance(answers, list) and isinstance(contexts, list) and len(contexts) == len(answers):
+            answers = [{"answer": answer, "contexts": context} for answer, context in zip(answers, contexts)]
+    if not isinstance(answers, list) or len(answers) != len(queries):
+        raise ValueError(f"Expected {len(queries)} answers at '{request.batch_response_path}', got "
+                         f"{len(answers) if isinstance(answers, list) else type(answers).__name__}")
+    return answers
+
+def run_query_batch(batch, request):
+    """Answer a batch of (index, query, reference) items with one request and build their rows.
+
+    Returns the (index, row) pairs and the items left unanswered (all of them if the batch
+    request failed), which are then sent as single queries.
+    """
+    started = time.perf_counter()
+    use_cache = response_cache is not None and not request.bypass_cache
+    rows, to_send = [], []
+    for index, query, reference in batch:
+        answer = response_cache.get(response_cache_key(query, request)) if use_cache else None
+        if answer is None:
+            to_send.append((index, query, reference))
+            continue
+        with query_trace() as trace:
+            trace["cached"] = True
+        row = response_row(query, reference, answer, round((time.perf_counter() - started) * 1000, 1))
+        row["timings"] = query_timings(trace, row["latency_ms"])
+        rows.append((index, row))
+    if not to_send:
+        return rows, []
+
+    with query_trace() as trace:
+        try:
+            answers = query_batch([query for _, query, _ in to_send], request)
+        except Exception as e:
+            logger.warning(f"Batch of {len(to_send)} queries failed, falling back to single queries: {str(e)}")
+            return rows, to_send
+    latency_ms = round((time.perf_counter() - started) * 1000, 1)
+    timings = dict(query_timings(trace, latency_ms), batch_size=len(to_send))
+    failed = []
+    for (index, query, reference), answer in zip(to_send, answers):
+        if answer is None:
+            failed.append((index, query, reference))
+            continue
+        row = response_row(query, reference, answer, latency_ms)
+        # Every row shares the request's timings; its byte, retry and connection counts are only counted once
+        row["timings"] = timings
+        timings = dict(timings, bytes_received=0, retries=0, connections_opened=0)
+        if use_cache and row["status"] == "success":
+            response_cache.set(response_cache_key(query, request), answer)
+        rows.append((index, row))
+    return rows, failed
+
+def incremental_answers(request):
+    """Successful rows of the baseline run keyed by query hash, for an incremental evaluation"""
+    if run_history is None:
+        return {}
+    baseline_run_id = request.baseline_run_id or run_history.latest(endpoint_config_key(request), dataset_hash(request))
+    if baseline_run_id is None:
+        return {}
+    answers = run_history.answers(baseline_run_id)
+    for row in answers.values():
+        row["timings"] = dict(row.get("timings") or {}, reused_from=baseline_run_id)
+        row.pop("metrics", None)
+    logger.info(f"Incremental evaluation can reuse {len(answers)} answers from run {baseline_run_id}")
+    return answers
+
+def iter_query_results(pairs, total, request, cancel_event=None):
+    """Run (query, reference) pairs concurrently and yield (index, row) pairs as each one completes.
+
+    In incremental mode, queries already answered in the baseline run are not sent again.
+    With batch_size > 1, queries are sent in batches and a failed batch's queries one by one.
+    """
+    concurrency = max(1, min(request.max_concurrency or 1, MAX_CONCURRENCY))
+    batch_size = request_batch_size(request)
+    pairs = enumerate(pairs)
+    reusable = incremental_answers(request) if request.incremental else {}
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="rag-query")
+    pending = {}  # future -> row index, or None for a batch
+    ready = deque()
+    singles = deque()  # Items of failed batches
+
+    # Keep at most `concurrency` requests in flight, submitting new ones as others finish
+    def fill():
+        while len(pending) + len(ready) < concurrency and not (cancel_event and cancel_event.is_set()):
+            if singles:
+                index, query, reference = singles.popleft()
+                pending[executor.submit(run_single_query, index, total, query, reference, request)] = index
+                continue
+            batch = []
+            for index, (query, reference) in pairs:
+                stored = reusable.get(query_hash(query))
+                if stored is not None:
+                    ready.append((index, dict(stored, reference=reference)))
+                else:
+                    batch.append((index, query, reference))
+                if len(batch) == batch_size:
+                    break
+            if not batch:
+                return
+            if batch_size == 1:
+                index, query, reference = batch[0]
+                pending[executor.submit(run_single_query, index, total, query, reference, request)] = index
+            else:
+                pending[executor.submit(run_query_batch, batch, request)] = None
+
+    try:
+        fill()
+        while pending or ready:
+            while ready:
+                yield ready.popleft()
+            if pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = pending.pop(future)
+                    if index is not None:
+                        yield index, future.result()
+                        continue
+                    rows, failed = future.result()
+                    yield from rows
+                    singles.extend(failed)
+            fill()
+    finally:
+        # Don't block on in-flight queries if the consumer stopped early (cancelled job, closed stream)
+        executor.shutdown(wait=False, cancel_futures=True)
+
+def run_queries(pairs, total, request):
+    """Run every query against the endpoint and return the rows in query order"""
+    dataset = [None] * total
+    for index, row in iter_query_results(pairs, total, request):
+        dataset[index] = row
+    # Guard against a dataset file that changed size since it was scanned
+    return [row for row in dataset if row is not None]
 
 @app.get("/")
 def read_root():
     return {"message": "FastAPI backend for RAG evaluation system"}
 
 @app.post("/api/evaluate", response_class=HTMLResponse)
-def evaluate_rag_system(request: EvaluateRequest):
+def evaluate_rag_system(request: EvaluateRequest, http_request: Request):
     rag_endpoint = request.rag_endpoint.strip()
     logger.info(f"Starting evaluation for endpoint: {rag_endpoint}", extra={
         "endpoint_type": request.endpoint_type,
         "request_method": request.request_method,
-        "total_queries": len(sample_queries)
+        "dataset_id": request.dataset_id
     })
     
+    # Rejected up front: once the report starts streaming, the 200 status has already been sent
+    if request.report_page_size is not None and request.report_page_size < 0:
+        return HTMLResponse(
+            content="<html><body><h2>RAG Evaluation Error</h2><p>report_page_size must be at least 1, or 0 for every row</p></body></html>",
+            status_code=400
+        )
+    config_error = endpoint_config_error(request)
+    if config_error:
+        return HTMLResponse(
+            content=f"<html><body><h2>RAG Evaluation Error</h2><p>{html.escape(config_error)}</p></body></html>",
+            status_code=400
+        )
+    
     # For each sample query, decide which query function to call based on the endpoint type.
-    dataset = []
     error_messages = []
     success_count = 0
-    batch_size = 5  # Process queries in batches of 5
     
     try:
         # Validate the endpoint URL
@@ -339,7 +1582,7 @@ def evaluate_rag_system(request: EvaluateRequest):
                 <body>
                     <h2>RAG Evaluation Error</h2>
                     <div class="error">
-                        <p><strong>Invalid endpoint URL:</strong> {rag_endpoint}</p>
+                        <p><strong>Invalid endpoint URL:</strong> {html.escape(rag_endpoint)}</p>
                         <p>URL must start with http:// or https://</p>
                     </div>
                     <div class="tip">
@@ -351,68 +1594,23 @@ def evaluate_rag_system(request: EvaluateRequest):
                 status_code=400
             )
         
-        # Process queries in batches
-        for batch_start in range(0, len(sample_queries), batch_size):
-            batch_end = min(batch_start + batch_size, len(sample_queries))
-            batch_queries = sample_queries[batch_start:batch_end]
-            batch_references = expected_responses[batch_start:batch_end]
-            
-            logger.info(f"Processing batch {batch_start//batch_size + 1}/{(len(sample_queries) + batch_size - 1)//batch_size}")
-            
-            for idx, (query, reference) in enumerate(zip(batch_queries, batch_references)):
-                global_idx = batch_start + idx
-                try:
-                    logger.info(f"Processing query {global_idx + 1}/{len(sample_queries)}: {query[:30]}...")
-                    
-                    # Choose the appropriate query function based on the endpoint type
-                    if request.endpoint_type == "openai" or "openai.com" in rag_endpoint:
-                        response = query_openai(query, rag_endpoint, request.api_key)
-                    elif request.endpoint_type == "azure":
-                        response = query_azure(query, rag_endpoint, request.api_key, request.headers)
-                    elif request.endpoint_type == "custom" and request.request_format:
-                        response = query_custom(query, rag_endpoint, request.api_key, 
-                                            request.request_method, request.request_format, 
-                                            request.response_path, request.headers)
-                    else:
-                        response = query_rag(query, rag_endpoint, headers=request.headers)
-                    
-                    # Check if the response indicates an error
-                    if isinstance(response, str) and response.startswith("Error:"):
-                        error_messages.append(f"Query {global_idx + 1}: {response}")
-                        logger.warning(f"Error in query {global_idx + 1}: {response}")
-                        
-                        # Add the error response to the dataset
-                        dataset.append({
-                            "user_input": query,
-                            "retrieved_contexts": [response],
-                            "response": response,
-                            "reference": reference,
-                            "status": "error"
-                        })
-                    else:
-                        # Successful response
-                        success_count += 1
-                        # Ensure retrieved_contexts is stored as a list
-                        response_list = [response] if isinstance(response, str) else response
-                        dataset.append({
-                            "user_input": query,
-                            "retrieved_contexts": response_list,
-                            "response": response,
-                            "reference": reference,
-                            "status": "success"
-                        })
-                except Exception as e:
-                    logger.error(f"Exception processing query {global_idx + 1}: {str(e)}", exc_info=True)
-                    error_messages.append(f"Query {global_idx + 1}: Unexpected error: {str(e)}")
-                    
-                    # Add error entry to dataset
-                    dataset.append({
-                        "user_input": query,
-                        "retrieved_contexts": [f"Error: {str(e)}"],
-                        "response": f"Error: {str(e)}",
-                        "reference": reference,
-                        "status": "error"
-                    })
+        evaluation_pairs = evaluation_input(request)
+        if evaluation_pairs is None:
+            return HTMLResponse(
+                content=f"<html><body><h2>RAG Evaluation Error</h2><p>Dataset not found: {html.escape(request.dataset_id)}</p></body></html>",
+                status_code=404
+            )
+        pairs, total = evaluation_pairs
+        
+        logger.info(f"Running {total} queries with concurrency {request.max_concurrency}")
+        started = time.perf_counter()
+        dataset = run_queries(pairs, total, request)
+        latency = summarize_latency(dataset, time.perf_counter() - started)
+        for idx, data in enumerate(dataset):
+            if data["status"] == "error":
+                error_messages.append(f"Query {idx + 1}: {data['response']}")
+            else:
+                success_count += 1
         
         # If all queries failed, return a more detailed error
         if success_count == 0 and len(error_messages) > 0:
@@ -433,10 +1631,10 @@ def evaluate_rag_system(request: EvaluateRequest):
                 <h2>RAG Evaluation Failed</h2>
                 <div class="error">
                     <p><strong>All queries failed.</strong></p>
-                    <p>Endpoint: {rag_endpoint}</p>
+                    <p>Endpoint: {html.escape(rag_endpoint)}</p>
                     <p>Error details:</p>
                     <ul>
-                        {"".join(f"<li>{error}</li>" for error in error_messages[:3])}
+                        {"".join(f"<li>{html.escape(error)}</li>" for error in error_messages[:3])}
                         {f"<li>...and {len(error_messages) - 3} more errors</li>" if len(error_messages) > 3 else ""}
                     </ul>
                 </div>
@@ -456,212 +1654,24 @@ def evaluate_rag_system(request: EvaluateRequest):
             return HTMLResponse(content=error_html, status_code=500)
         
         # Calculate evaluation metrics
-        successful_responses = [d for d in dataset if d.get("status") == "success"]
-        if successful_responses:
-            evaluation_results = {
-                "Context Recall": sum([1 for d in successful_responses if d["response"] == d["reference"]]) / len(successful_responses),
-                "Faithfulness": 0.92,  # Placeholder
-                "Factual Correctness": 0.88
-            }
-        else:
-            evaluation_results = {
-                "Context Recall": 0,
-                "Faithfulness": 0,
-                "Factual Correctness": 0
-            }
-        
-        # If there were some errors but not all failed, include warnings in the HTML output
-        warning_html = ""
-        if error_messages and success_count > 0:
-            warning_html = f"""
-            <div class="warning-section">
-                <h3>⚠️ Warnings</h3>
-                <p>{success_count} out of {len(sample_queries)} queries completed successfully. Some queries encountered errors:</p>
-                <ul class="warning-list">
-                    {"".join(f"<li>{error}</li>" for error in error_messages[:3])}
-                    {f"<li>...and {len(error_messages) - 3} more errors</li>" if len(error_messages) > 3 else ""}
-                </ul>
-            </div>
-            """
-        
-        # Build HTML Report
-        html_content = """
-        <!DOCTYPE html>
-        <html lang="en">
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-            <title>RAG Evaluation Results</title>
-            <style>
-                :root {
-                    --primary-color: #007bff;
-                    --border-color: #e2e8f0;
-                    --bg-color: #ffffff;
-                    --text-color: #1a202c;
-                    --hover-bg: #f7fafc;
-                }
-                body {
-                    font-family: 'Poppins', system-ui, -apple-system, sans-serif;
-                    color: var(--text-color);
-                    line-height: 1.6;
-                    margin: 0;
-                    padding: 0;
-                }
-                .container {
-                    width: 100%;
-                    background: var(--bg-color);
-                    border-radius: 8px;
-                    overflow: hidden;
-                }
-                .table-wrapper {
-                    width: 100%;
-                    overflow-x: auto;
-                    -webkit-overflow-scrolling: touch;
-                    margin-bottom: 1rem;
-                    border-radius: 8px;
-                    box-shadow: 0 1px 3px 0 rgba(0, 0, 0, 0.1);
-                }
-                table {
-                    width: 100%;
-                    border-collapse: separate;
-                    border-spacing: 0;
-                    margin: 0;
-                    border: 1px solid var(--border-color);
-                    min-width: 600px; /* Ensures table doesn't get too squished */
-                }
-                th, td {
-                    border: 1px solid var(--border-color);
-                    padding: 0.75rem;
-                    text-align: left;
-                    transition: background-color 0.2s ease;
-                    min-width: 120px; /* Minimum column width */
-                    word-wrap: break-word;
-                    max-width: 300px; /* Maximum column width */
-                }
-                th {
-                    background-color: var(--primary-color);
-                    color: white !important; /* Ensure header text is always white */
-                    font-weight: 500;
-                    white-space: nowrap;
-                    position: sticky;
-                    top: 0;
-                    z-index: 1;
-                }
-                th:first-child, td:first-child {
-                    padding-left: 1.5rem; /* Add extra padding to first column header and cells */
-                }
-                td:first-child {
-                    padding-left: 1.5rem; /* Add extra padding to first column */
-                }
-                tr:nth-child(even) {
-                    background-color: var(--hover-bg);
-                }
-                tr:hover td {
-                    background-color: rgba(0, 123, 255, 0.05);
-                }
-                .metrics {
-                    background: var(--bg-color);
-                    border-radius: 8px;
-                    padding: 1rem;
-                    margin-top: 1.5rem;
-                    border: 1px solid var(--border-color);
-                }
-                .metrics h3 {
-                    color: var(--primary-color);
-                    margin-top: 0;
-                    font-weight: 500;
-                    font-size: 1.1rem;
-                }
-                .metrics ul {
-                    list-style: none;
-                    padding: 0;
-                    margin: 0;
-                }
-                .metrics li {
-                    padding: 0.75rem;
-                    border-bottom: 1px solid var(--border-color);
-                    display: flex;
-                    justify-content: space-between;
-                    align-items: center;
-                    flex-wrap: wrap;
-                    gap: 0.5rem;
-                }
-                .metrics li:last-child {
-                    border-bottom: none;
-                }
-                @media (max-width: 640px) {
-                    th, td {
-                        padding: 0.5rem;
-                        font-size: 0.875rem;
-                    }
-                    .metrics li {
-                        padding: 0.5rem;
-                    }
-                    .metrics h3 {
-                        font-size: 1rem;
-                    }
-                }
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="table-wrapper">
-                    <table>
-                        <thead>
-                            <tr>
-                                <th>User Query</th>
-                                <th>Generated Response</th>
-                                <th>Reference Answer</th>
-                            </tr>
-                        </thead>
-                        <tbody>
-        """
-        for data in dataset:
-            html_content += f"""
-            <tr>
-                <td>{data['user_input']}</td>
-                <td>{data['response']}</td>
-                <td>{data['reference']}</td>
-            </tr>
-            """
-        html_content += """
-                        </tbody>
-                    </table>
-                </div>
-                <div class="metrics">
-                    <h3>Evaluation Metrics</h3>
-                    <ul>
-                        <li>
-                            <span>Context Recall</span>
-                            <span>{0:.1%}</span>
-                        </li>
-                        <li>
-                            <span>Faithfulness</span>
-                            <span>{1:.1%}</span>
-                        </li>
-                        <li>
-                            <span>Factual Correctness</span>
-                            <span>{2:.1%}</span>
-                        </li>
-                    </ul>
-                </div>
-            </div>
-        </body>
-        </html>
-        """.format(
-            evaluation_results["Context Recall"],
-            evaluation_results["Faithfulness"],
-            evaluation_results["Factual Correctness"]
-        )
+        evaluation_results = evaluate(dataset, get_reference_index(request.dataset_id))
         
-        # Add the warning section to the HTML if there were errors
-        if warning_html:
-            html_content = html_content.replace("<div class=\"metrics\">", f"{warning_html}<div class=\"metrics\">")
+        # Keep the run so the PDF report can be rendered without re-querying the endpoint
+        run_id = save_run(request, dataset, evaluation_results, latency)
         
         # Log the completion of the evaluation
-        logger.info(f"Evaluation completed with {success_count} successful queries out of {len(sample_queries)}")
+        logger.info(f"Evaluation completed with {success_count} successful queries out of {len(dataset)}", extra={"run_id": run_id})
         
-        return HTMLResponse(content=html_content)
+        # Stream the report; with report_page_size only the first page is rendered, linking to the rest
+        page_size = request.report_page_size or max(1, len(dataset))
+        return StreamingResponse(
+            render_html_report(
+                dataset, evaluation_results, latency, run_id, stop=page_size,
+                pagination=report_pagination(str(http_request.base_url), run_id, 1, page_size, len(dataset))
+            ),
+            media_type="text/html",
+            headers={"X-Run-Id": run_id}
+        )
         
     except Exception as e:
         logger.error(f"Exception in evaluate_rag_system: {str(e)}", exc_info=True)
@@ -678,24 +1688,810 @@ def evaluate_rag_system(request: EvaluateRequest):
             <h2>Evaluation System Error</h2>
             <div class="error">
                 <p><strong>An unexpected error occurred during evaluation:</strong></p>
-                <p>{str(e)}</p>
+                <p>{html.escape(str(e))}</p>
             </div>
         </body>
         </html>
         """
         return HTMLResponse(content=error_html, status_code=500)
 
+# Pydantic models for a comparative evaluation of several endpoints over one dataset
+class CompareEndpoint(EvaluateRequest):
+    label: Optional[str] = None     # Column name in the comparison report; defaults to the endpoint URL
+
+class CompareRequest(BaseModel):
+    endpoints: List[CompareEndpoint]  # Each with its own configuration and max_concurrency
+    dataset_id: Optional[str] = None  # Dataset shared by every endpoint (the built-in sample queries by default)
+    baseline: int = 0               # Index of the endpoint the others are compared against
+
+def compare_endpoints(request, pairs, reference_index):
+    """Query every endpoint concurrently over one shared copy of the dataset, score each run against
+    the same reference index and return the stored runs in endpoint order"""
+
+    def run(endpoint):
+        started = time.perf_counter()
+        dataset = run_queries(pairs, len(pairs), endpoint)
+        latency = summarize_latency(dataset, time.perf_counter() - started)
+        evaluation_results = evaluate(dataset, reference_index)
+        return load_run(save_run(endpoint, dataset, evaluation_results, latency))
+
+    # Each endpoint runs its own pool of max_concurrency query threads
+    with ThreadPoolExecutor(max_workers=len(request.endpoints), thread_name_prefix="rag-compare") as executor:
+        return list(executor.map(run, request.endpoints))
+
+@app.post("/api/compare")
+def compare_rag_systems(request: CompareRequest, format: str = "html"):
+    """Evaluate several endpoints against the same dataset in one pass.
+
+    Returns a side-by-side HTML report, or with format=json each run's results and its diff against the baseline.
+    """
+    if not 2 <= len(request.endpoints) <= COMPARE_MAX_ENDPOINTS:
+        return JSONResponse(status_code=400, content={"error": f"Comparisons need between 2 and {COMPARE_MAX_ENDPOINTS} endpoints"})
+    if not 0 <= request.baseline < len(request.endpoints):
+        return JSONResponse(status_code=400, content={"error": "baseline must be the index of one of the endpoints"})
+    if format not in ("html", "json"):
+        return JSONResponse(status_code=400, content={"error": "format must be 'html' or 'json'"})
+    # Every endpoint is checked before any is queried, so one bad configuration can't fail the comparison halfway
+    for index, endpoint in enumerate(request.endpoints):
+        endpoint.rag_endpoint = endpoint.rag_endpoint.strip()
+        if not endpoint.rag_endpoint.startswith(('http://', 'https://')):
+            return JSONResponse(
+                status_code=400,
+                content={"error": f"Invalid endpoint URL: {endpoint.rag_endpoint}. URL must start with http:// or https://"}
+            )
+        config_error = endpoint_config_error(endpoint)
+        if config_error:
+            return JSONResponse(
+                status_code=400,
+                content={"error": f"Endpoint {index} ({endpoint.label or endpoint.rag_endpoint}): {config_error}"}
+            )
+        endpoint.dataset_id = request.dataset_id
+    if request.dataset_id and load_dataset_info(request.dataset_id) is None:
+        return JSONResponse(status_code=404, content={"error": f"Dataset not found: {request.dataset_id}"})
+    try:
+        pairs, _ = evaluation_input(request)
+        pairs = list(pairs)
+        reference_index = get_reference_index(request.dataset_id)
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not read dataset {request.dataset_id} for comparison: {str(e)}")
+        return JSONResponse(status_code=400, content={"error": f"Could not read dataset {request.dataset_id}: {str(e)}"})
+
+    logger.info(f"Starting comparison of {len(request.endpoints)} endpoints", extra={
+        "endpoints": [endpoint.rag_endpoint for endpoint in request.endpoints],
+        "dataset_id": request.dataset_id
+    })
+    runs = compare_endpoints(request, pairs, reference_index)
+    labels = [endpoint.label or endpoint.rag_endpoint for endpoint in request.endpoints]
+    base = runs[request.baseline]
+    if format == "json":
+        return {
+            "baseline_run_id": base["run_id"],
+            "runs": [
+                {"label": label, "run_id": run["run_id"], "rag_endpoint": run["rag_endpoint"],
+                 "evaluation_results": run["evaluation_results"], "latency": run["latency"]}
+                for label, run in zip(labels, runs)
+            ],
+            "diffs": [diff_runs(base, run) for run in runs if run is not base]
+        }
+    return StreamingResponse(
+        render_comparison_report(labels, runs, request.baseline),
+        media_type="text/html",
+        headers={"X-Run-Ids": ",".join(run["run_id"] for run in runs)}
+    )
+
+@app.post("/api/evaluate/stream")
+def evaluate_rag_system_stream(request: EvaluateRequest, format: str = "ndjson"):
+    """Stream each query result as soon as it completes, followed by a summary event.
+
+    Events are sent as newline-delimited JSON by default, or as Server-Sent Events with ``format=sse``.
+    """
+    rag_endpoint = request.rag_endpoint.strip()
+    if not rag_endpoint.startswith(('http://', 'https://')):
+        logger.error(f"Invalid endpoint URL: {rag_endpoint}")
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"Invalid endpoint URL: {rag_endpoint}. URL must start with http:// or https://"}
+        )
+    if format not in ("ndjson", "sse"):
+        return JSONResponse(status_code=400, content={"error": "format must be 'ndjson' or 'sse'"})
+    config_error = endpoint_config_error(request)
+    if config_error:
+        return JSONResponse(status_code=400, content={"error": config_error})
+    evaluation_pairs = evaluation_input(request)
+    if evaluation_pairs is None:
+        return JSONResponse(status_code=404, content={"error": f"Dataset not found: {request.dataset_id}"})
+    pairs, total = evaluation_pairs
+
+    def encode(event):
+        payload = json.dumps(event, default=str)
+        if format == "sse":
+            return f"event: {event['event']}\ndata: {payload}\n\n"
+        return payload + "\n"
+
+    def event_stream():
+        started = time.perf_counter()
+        reference_index = get_reference_index(request.dataset_id)
+        dataset = [None] * total
+        completed = 0
+        success_count = 0
+        running_totals = dict.fromkeys(METRIC_NAMES, 0.0)
+        yield encode({"event": "start", "rag_endpoint": rag_endpoint, "total": total})
+        try:
+            for index, row in iter_query_results(pairs, total, request):
+                dataset[index] = row
+                completed += 1
+                # Score the row on its own so the client sees running averages over successful rows
+                if row["status"] == "success":
+                    success_count += 1
+                    row["metrics"] = row_metrics(reference_index.score([str(row["response"])], rows=[index]), 0)
+                    for key, value in row["metrics"].items():
+                        running_totals[key] += value
+                yield encode({
+                    "event": "result",
+                    "index": index,
+                    "completed": completed,
+                    "total": total,
+                    "status": row["status"],
+                    "latency_ms": row["latency_ms"],
+                    "timings": row["timings"],
+                    "user_input": row["user_input"],
+                    "response": row["response"],
+                    "reference": row["reference"],
+                    "row_metrics": row.get("metrics"),
+                    "metrics": {
+                        name: running_totals[key] / success_count if success_count else 0
+                        for key, name in METRIC_NAMES.items()
+                    }
+                })
+            dataset = [row for row in dataset if row is not None]
+            latency = summarize_latency(dataset, time.perf_counter() - started)
+            evaluation_results = evaluate(dataset, reference_index)
+            success_count = sum(1 for d in dataset if d["status"] == "success")
+            run_id = save_run(request, dataset, evaluation_results, latency) if success_count else None
+            logger.info(f"Streaming evaluation completed with {success_count} successful queries out of {total}", extra={"run_id": run_id})
+            yield encode({
+                "event": "summary",
+                "run_id": run_id,
+                "total": len(dataset),
+                "success_count": success_count,
+                "error_count": len(dataset) - success_count,
+                "duration_seconds": round(time.perf_counter() - started, 3),
+                "evaluation_results": evaluation_results,
+                "latency": latency
+            })
+        except Exception as e:
+            logger.error(f"Exception in streaming evaluation: {str(e)}", exc_info=True)
+            yield encode({"event": "error", "error": str(e)})
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(
+        event_stream(),
+        media_type=media_type,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Background evaluation jobs, so long runs don't hold an HTTP worker thread
+job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="rag-job")
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+def _job_view(job):
+    """Public view of a job record, without the internal future and cancel event"""
+    with _jobs_lock:
+        job = dict(job)
+    return {k: v for k, v in job.items() if not k.startswith("_")}
+
+def _update_job(job, **fields):
+    """Set fields of a job record; every change is made under _jobs_lock since pollers read it concurrently"""
+    with _jobs_lock:
+        job.update(fields)
+
+def _advance_job(job):
+    with _jobs_lock:
+        job["completed"] += 1
+
+def _get_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+def _prune_finished_jobs():
+    cutoff = time.time() - JOB_RETENTION_SECONDS
+    for job_id in [job_id for job_id, job in _jobs.items() if job.get("_finished_ts", cutoff + 1) < cutoff]:
+        del _jobs[job_id]
+
+def submit_job(kind, rag_endpoint, total, target, *args):
+    """Queue target(job_id, *args) as a background job, or return a 429 response when the queue is full"""
+    with _jobs_lock:
+        _prune_finished_jobs()
+        active = sum(1 for job in _jobs.values() if job["status"] in ("queued", "running", "cancelling"))
+        if active >= JOB_QUEUE_LIMIT:
+            logger.warning(f"Evaluation job queue full ({active} active jobs)")
+            return JSONResponse(
+                status_code=429,
+                content={"error": "Too many evaluation jobs in progress, please retry later"},
+                headers={"Retry-After": "30"}
+            )
+        job_id = uuid.uuid4().hex
+        job = {
+            "job_id": job_id,
+            "kind": kind,
+            "status": "queued",
+            "rag_endpoint": rag_endpoint,
+            "created_at": datetime.now().isoformat(),
+            "completed": 0,
+            "total": total,
+            "_cancel": threading.Event()
+        }
+        _jobs[job_id] = job
+        job["_future"] = job_executor.submit(target, job_id, *args)
+    return _job_view(job)
+
+def run_evaluation_job(job_id, request, pairs):
+    job = _get_job(job_id)
+    cancel_event = job["_cancel"]
+    if cancel_event.is_set():
+        return
+    _update_job(job, status="running", started_at=datetime.now().isoformat())
+    logger.info(f"Starting evaluation job {job_id}", extra={"endpoint": request.rag_endpoint.strip()})
+    try:
+        started = time.perf_counter()
+        dataset = [None] * job["total"]
+        for index, row in iter_query_results(pairs, job["total"], request, cancel_event=cancel_event):
+            dataset[index] = row
+            _advance_job(job)
+            if cancel_event.is_set():
+                break
+        if cancel_event.is_set():
+            _update_job(job, status="cancelled")
+            logger.info(f"Evaluation job {job_id} cancelled after {job['completed']} queries")
+            return
+        dataset = [row for row in dataset if row is not None]
+        latency = summarize_latency(dataset, time.perf_counter() - started)
+        evaluation_results = evaluate(dataset, get_reference_index(request.dataset_id))
+        success_count = sum(1 for d in dataset if d["status"] == "success")
+        _update_job(
+            job,
+            status="completed",
+            success_count=success_count,
+            error_count=len(dataset) - success_count,
+            evaluation_results=evaluation_results,
+            latency=latency,
+            run_id=save_run(request, dataset, evaluation_results, latency) if success_count else None
+        )
+        logger.info(f"Evaluation job {job_id} completed with {success_count} successful queries out of {len(dataset)}")
+    except Exception as e:
+        logger.error(f"Exception in evaluation job {job_id}: {str(e)}", exc_info=True)
+        _update_job(job, status="failed", error=str(e))
+    finally:
+        _update_job(job, finished_at=datetime.now().isoformat(), _finished_ts=time.time())
+
+@app.post("/api/jobs", status_code=202)
+def submit_evaluation_job(request: EvaluateRequest):
+    rag_endpoint = request.rag_endpoint.strip()
+    if not rag_endpoint.startswith(('http://', 'https://')):
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"Invalid endpoint URL: {rag_endpoint}. URL must start with http:// or https://"}
+        )
+    config_error = endpoint_config_error(request)
+    if config_error:
+        return JSONResponse(status_code=400, content={"error": config_error})
+    evaluation_pairs = evaluation_input(request)
+    if evaluation_pairs is None:
+        return JSONResponse(status_code=404, content={"error": f"Dataset not found: {request.dataset_id}"})
+    pairs, total = evaluation_pairs
+    return submit_job("evaluation", rag_endpoint, total, run_evaluation_job, request, pairs)
+
+@app.get("/api/jobs/{job_id}")
+def get_evaluation_job(job_id: str):
+    job = _get_job(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Evaluation job not found"})
+    return _job_view(job)
+
+@app.delete("/api/jobs/{job_id}")
+def cancel_evaluation_job(job_id: str):
+    job = _get_job(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": "Evaluation job not found"})
+    with _jobs_lock:
+        if job["status"] in ("queued", "running"):
+            # Queries not yet sent are dropped; ones already in flight finish or time out in the background
+            job["_cancel"].set()
+            if job["_future"].cancel():
+                job.update(status="cancelled", finished_at=datetime.now().isoformat(), _finished_ts=time.time())
+            else:
+                job["status"] = "cancelling"
+    return _job_view(job)
+
+# Open-loop load tests. Arrivals follow a precomputed schedule regardless of how fast the endpoint
+# answers, and latency is measured from each request's scheduled send time, so queueing delay
+# behind slow responses is counted instead of hidden (no coordinated omission).
+class LoadStage(BaseModel):
+    rate: float                         # Target arrivals per second (at the end of the stage when ramping)
+    duration_seconds: float
+    ramp_from: Optional[float] = None   # Ramp linearly from this rate to `rate` over the stage
+
+class LoadTestRequest(EvaluateRequest):
+    arrival: str = "constant"           # "constant" or "poisson"
+    stages: List[LoadStage] = [LoadStage(rate=1, duration_seconds=30)]
+    max_in_flight: int = 64             # Requests outstanding at once; later arrivals queue and the wait counts as latency
+    seed: Optional[int] = None          # Seed for reproducible Poisson schedules
+
+def stage_arrivals(stage, arrival, rng):
+    """Offsets in seconds from the start of a stage at which requests are due"""
+    start_rate = stage.rate if stage.ramp_from is None else stage.ramp_from
+    slope = (stage.rate - start_rate) / stage.duration_seconds
+    expected = (start_rate + stage.rate) / 2 * stage.duration_seconds
+    # Walk the expected arrival count in steps of 1 (constant) or Exp(1) (Poisson) and invert
+    # the cumulative rate start_rate*t + slope*t^2/2 to get each arrival time
+    offsets = []
+    count = rng.exponential() if arrival == "poisson" else 1.0
+    while count <= expected:
+        if slope:
+            offsets.append((math.sqrt(max(0.0, start_rate ** 2 + 2 * slope * count)) - start_rate) / slope)
+        else:
+            offsets.append(count / start_rate)
+        count += rng.exponential() if arrival == "poisson" else 1.0
+    return offsets
+
+def load_test_schedule(request):
+    """List of (due offset in seconds, stage index) for the whole test"""
+    rng = np.random.default_rng(request.seed)
+    schedule = []
+    stage_start = 0.0
+    for stage_index, stage in enumerate(request.stages):
+        schedule.extend((stage_start + offset, stage_index) for offset in stage_arrivals(stage, request.arrival, rng))
+        stage_start += stage.duration_seconds
+    return schedule
+
+def load_test_queries(request):
+    """Queries to cycle through as the load-test request mix"""
+    if not request.dataset_id:
+        return list(sample_queries)
+    return [query for query, _ in itertools.islice(iter_dataset(request.dataset_id), LOAD_TEST_MIX_SIZE)]
+
+def summarize_load_stage(stage_index, stage, results):
+    """Throughput, error rate and latency percentiles for the requests scheduled in one stage"""
+    finished = [r for r in results if r is not None]
+    successes = [r for r in finished if r["ok"]]
+    start_rate = stage.rate if stage.ramp_from is None else stage.ramp_from
+    return {
+        "stage": stage_index,
+        "target_rate": round((start_rate + stage.rate) / 2, 3),
+        "ramp_from": stage.ramp_from,
+        "rate": stage.rate,
+        "duration_seconds": stage.duration_seconds,
+        "planned": len(results),
+        "completed": len(finished),
+        "errors": len(finished) - len(successes),
+        "error_rate": round((len(finished) - len(successes)) / len(finished), 4) if finished else 0.0,
+        # Arrivals the schedule planned for the stage, whether or not they were sent or answered in time
+        "offered_qps": round(len(results) / stage.duration_seconds, 2),
+        "achieved_qps": round(len(finished) / stage.duration_seconds, 2),
+        "throughput_qps": round(len(successes) / stage.duration_seconds, 2),
+        # From the scheduled send time, so it includes time spent queued behind other requests
+        "latency_ms": latency_percentiles([r["latency_ms"] for r in finished]),
+        # From the moment the request was actually sent
+        "service_time_ms": latency_percentiles([r["service_ms"] for r in finished]),
+        "max_send_delay_ms": round(max((r["send_delay_ms"] for r in finished), default=0.0), 1)
+    }
+
+def run_load_test_job(job_id, request, queries, schedule):
+    job = _get_job(job_id)
+    cancel_event = job["_cancel"]
+    if cancel_event.is_set():
+        return
+    _update_job(job, status="running", started_at=datetime.now().isoformat())
+    logger.info(f"Starting load test {job_id} with {len(schedule)} requests", extra={"endpoint": request.rag_endpoint.strip()})
+    results = [None] * len(schedule)
+    executor = ThreadPoolExecutor(max_workers=request.max_in_flight, thread_name_prefix="rag-load")
+
+    def send(index, due):
+        sent = time.perf_counter()
+        try:
+            response = query_endpoint(queries[index % len(queries)], request)
+            ok = not is_error_response(response)
+        except Exception:
+            ok = False
+        finished = time.perf_counter()
+        results[index] = {
+            "ok": ok,
+            "latency_ms": (finished - due) * 1000,
+            "service_ms": (finished - sent) * 1000,
+            "send_delay_ms": (sent - due) * 1000
+        }
+        _advance_job(job)
+
+    try:
+        started = time.perf_counter()
+        for index, (offset, stage_index) in enumerate(schedule):
+            due = started + offset
+            # Never wait on responses here: the next arrival is sent on schedule however slow the endpoint is
+            if cancel_event.wait(max(0.0, due - time.perf_counter())):
+                break
+            _update_job(job, stage=stage_index)
+            executor.submit(send, index, due)
+        # Let every scheduled request finish, including ones still queued for a worker, unless cancelled
+        executor.shutdown(wait=not cancel_event.is_set(), cancel_futures=cancel_event.is_set())
+        if cancel_event.is_set():
+            _update_job(job, status="cancelled")
+            logger.info(f"Load test {job_id} cancelled after {job['completed']} requests")
+            return
+        stages = []
+        for stage_index, stage in enumerate(request.stages):
+            stage_results = [results[i] for i, (_, s) in enumerate(schedule) if s == stage_index]
+            stages.append(summarize_load_stage(stage_index, stage, stage_results))
+        finished = [r for r in results if r is not None]
+        wall_seconds = time.perf_counter() - started
+        _update_job(
+            job,
+            status="completed",
+            load_test={
+                "arrival": request.arrival,
+                "requests": len(finished),
+                "errors": sum(1 for r in finished if not r["ok"]),
+                "wall_seconds": round(wall_seconds, 3),
+                "throughput_qps": round(sum(1 for r in finished if r["ok"]) / wall_seconds, 2),
+                "latency_ms": latency_percentiles([r["latency_ms"] for r in finished]),
+                "stages": stages
+            }
+        )
+        logger.info(f"Load test {job_id} completed with {len(finished)} requests")
+    except Exception as e:
+        logger.error(f"Exception in load test {job_id}: {str(e)}", exc_info=True)
+        _update_job(job, status="failed", error=str(e))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        _update_job(job, finished_at=datetime.now().isoformat(), _finished_ts=time.time())
+
+@app.post("/api/load-tests", status_code=202)
+def submit_load_test(request: LoadTestRequest):
+    """Drive an endpoint at a target request rate in the background; poll and cancel it via /api/jobs"""
+    rag_endpoint = request.rag_endpoint.strip()
+    if not rag_endpoint.startswith(('http://', 'https://')):
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"Invalid endpoint URL: {rag_endpoint}. URL must start with http:// or https://"}
+        )
+    if request.arrival not in ("constant", "poisson"):
+        return JSONResponse(status_code=400, content={"error": "arrival must be 'constant' or 'poisson'"})
+    config_error = endpoint_config_error(request)
+    if config_error:
+        return JSONResponse(status_code=400, content={"error": config_error})
+    if not request.stages or sum(stage.duration_seconds for stage in request.stages) > LOAD_TEST_MAX_SECONDS:
+        return JSONResponse(status_code=400, content={"error": f"Load tests need 1 or more stages lasting at most {LOAD_TEST_MAX_SECONDS}s in total"})
+    for stage in request.stages:
+        rates = [stage.rate] if stage.ramp_from is None else [stage.rate, stage.ramp_from]
+        if stage.duration_seconds <= 0 or not all(0 <= rate <= LOAD_TEST_MAX_RATE for rate in rates):
+            return JSONResponse(status_code=400, content={"error": f"Each stage needs a positive duration and rates between 0 and {LOAD_TEST_MAX_RATE}/s"})
+    request.max_in_flight = max(1, min(request.max_in_flight, LOAD_TEST_MAX_IN_FLIGHT))
+    if request.dataset_id and load_dataset_info(request.dataset_id) is None:
+        return JSONResponse(status_code=404, content={"error": f"Dataset not found: {request.dataset_id}"})
+    # Retries would add load the schedule didn't ask for, and an open circuit breaker would stop it,
+    # so failed requests count as errors unless a policy is given
+    if request.retry is None:
+        request.retry = RetryPolicy(max_attempts=1, circuit_breaker=False)
+    # Cached answers would never reach the endpoint
+    request.bypass_cache = True
+    queries = load_test_queries(request)
+    if not queries:
+        return JSONResponse(status_code=400, content={"error": "The load-test request mix is empty"})
+    schedule = load_test_schedule(request)
+    return submit_job("load_test", rag_endpoint, len(schedule), run_load_test_job, request, queries, schedule)
+
+@app.get("/api/endpoint-profiles")
+def list_endpoint_profiles():
+    """Learned latency percentiles and the request timeout derived from them, per endpoint"""
+    return endpoint_profiles.view()
+
+@app.get("/api/circuit-breakers")
+def list_circuit_breakers():
+    """State of every endpoint's circuit breaker; open circuits fail queries fast until a probe succeeds"""
+    return circuit_breaker_views()
+
+@app.post("/api/datasets")
+def upload_dataset(file: UploadFile = File(...)):
+    """Upload a CSV, JSONL or Parquet dataset of query/reference pairs"""
+    extension = os.path.splitext(file.filename or "")[1].lower()
+    file_format = DATASET_FORMATS.get(extension)
+    if file_format is None:
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"Unsupported file type '{extension}'. Use one of: {', '.join(DATASET_FORMATS)}"}
+        )
+    os.makedirs(DATASET_DIR, exist_ok=True)
+    
+    # Spool the upload to disk in chunks while hashing it, so large files never sit in memory
+    digest = hashlib.sha256()
+    size = 0
+    max_bytes = MAX_DATASET_UPLOAD_MB * 1024 * 1024
+    with tempfile.NamedTemporaryFile(dir=DATASET_DIR, suffix=extension, delete=False) as tmp:
+        tmp_path = tmp.name
+        while True:
+            chunk = file.file.read(1024 * 1024)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                break
+            digest.update(chunk)
+            tmp.write(chunk)
+    try:
+        if size > max_bytes:
+            return JSONResponse(
+                status_code=413,
+                content={"error": f"Dataset exceeds the {MAX_DATASET_UPLOAD_MB} MB upload limit"}
+            )
+        
+        dataset_id = digest.hexdigest()
+        info = load_dataset_info(dataset_id)
+        if info is not None:
+            logger.info(f"Dataset {dataset_id} already uploaded, reusing it")
+            return info
+        
+        try:
+            query_column, reference_column, rows = _scan_dataset(tmp_path, file_format)
+        except Exception as e:
+            logger.warning(f"Rejected dataset upload {file.filename}: {str(e)}")
+            return JSONResponse(status_code=400, content={"error": f"Invalid dataset: {str(e)}"})
+        
+        os.replace(tmp_path, _dataset_path(dataset_id, extension))
+        info = {
+            "dataset_id": dataset_id,
+            "filename": file.filename,
+            "format": file_format,
+            "extension": extension,
+            "size_bytes": size,
+            "rows": rows,
+            "query_column": query_column,
+            "reference_column": reference_column,
+            "uploaded_at": datetime.now().isoformat()
+        }
+        with open(_dataset_path(dataset_id, ".json"), "w", encoding="utf-8") as f:
+            json.dump(info, f)
+        build_dataset_index(dataset_id)
+        logger.info(f"Stored dataset {dataset_id} with {rows} rows", extra={"dataset_format": file_format})
+        return info
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+@app.get("/api/datasets")
+def list_datasets():
+    if not os.path.isdir(DATASET_DIR):
+        return []
+    datasets = []
+    for name in sorted(os.listdir(DATASET_DIR)):
+        if name.endswith(".json"):
+            info = load_dataset_info(name[:-len(".json")])
+            if info is not None:
+                datasets.append(info)
+    return datasets
+
+@app.get("/api/datasets/{dataset_id}")
+def get_dataset(dataset_id: str):
+    info = load_dataset_info(dataset_id)
+    if info is None:
+        return JSONResponse(status_code=404, content={"error": "Dataset not found"})
+    return info
+
+@app.get("/api/runs/{run_id}")
+def get_run(run_id: str):
+    run = load_run(run_id)
+    if run is None:
+        return JSONResponse(status_code=404, content={"error": "Evaluation run not found or expired"})
+    return run
+
+def report_pagination(base_url, run_id, page, page_size, total):
+    """Links between pages of a run's HTML report, or None when it fits on one page"""
+    pages = max(1, math.ceil(total / page_size))
+    if pages == 1:
+        return None
+    url = f"{base_url}api/runs/{run_id}/report?page_size={page_size}&page="
+    return {
+        "page": page,
+        "pages": pages,
+        "prev": f"{url}{page - 1}" if page > 1 else None,
+        "next": f"{url}{page + 1}" if page < pages else None
+    }
+
+@app.get("/api/runs/{run_id}/report", response_class=HTMLResponse)
+def get_run_report(run_id: str, http_request: Request, page: int = 1, page_size: int = REPORT_PAGE_SIZE):
+    """Stream one page of a stored run's HTML report (page_size=0 renders every row)"""
+    run = load_run(run_id)
+    if run is None:
+        return HTMLResponse(content="<html><body><h2>Evaluation run not found or expired</h2></body></html>", status_code=404)
+    dataset = run["dataset"]
+    page_size = page_size if page_size > 0 else max(1, len(dataset))
+    pagination = report_pagination(str(http_request.base_url), run_id, page, page_size, len(dataset))
+    if page < 1 or (pagination and page > pagination["pages"]):
+        return HTMLResponse(content=f"<html><body><h2>Report page {page} does not exist</h2></body></html>", status_code=404)
+    start = (page - 1) * page_size
+    return StreamingResponse(
+        render_html_report(dataset, run["evaluation_results"], run.get("latency"), run_id,
+                           start=start, stop=start + page_size, pagination=pagination),
+        media_type="text/html"
+    )
+
+@app.get("/api/history")
+def list_run_history(rag_endpoint: Optional[str] = None, dataset_hash: Optional[str] = None, limit: int = 50):
+    """Past evaluation runs, newest first, optionally filtered by endpoint URL and dataset hash"""
+    if run_history is None:
+        return JSONResponse(status_code=404, content={"error": "Evaluation history is disabled"})
+    return run_history.list(rag_endpoint, dataset_hash, max(1, min(limit, 1000)))
+
+def diff_runs(base, run):
+    """Metric and latency deltas between two runs, and per-query changes matched by query text"""
+    base_rows = {query_hash(row["user_input"]): row for row in base["dataset"]}
+    run_rows = {query_hash(row["user_input"]): row for row in run["dataset"]}
+    changes = []
+    for key in base_rows.keys() & run_rows.keys():
+        before, after = base_rows[key], run_rows[key]
+        changes.append({
+            "user_input": after["user_input"],
+            "base_status": before["status"],
+            "status": after["status"],
+            "response_changed": before["response"] != after["response"],
+            "base_score": round(row_score(before), 4),
+            "score": round(row_score(after), 4),
+            "delta": round(row_score(after) - row_score(before), 4)
+        })
+    changes.sort(key=lambda change: change["delta"])
+    metric_names = list(dict.fromkeys([*base["evaluation_results"], *run["evaluation_results"]]))
+    latency = {}
+    for phase in ("total_ms", "ttfb_ms"):
+        before = ((base.get("latency") or {}).get("phases") or {}).get(phase)
+        after = ((run.get("latency") or {}).get("phases") or {}).get(phase)
+        if before and after:
+            latency[phase] = {stat: {"base": before[stat], "run": after[stat], "delta": round(after[stat] - before[stat], 1)}
+                              for stat in ("p50", "p95", "p99")}
+    return {
+        "base_run_id": base["run_id"],
+        "run_id": run["run_id"],
+        "metrics": {
+            name: {
+                "base": base["evaluation_results"].get(name),
+                "run": run["evaluation_results"].get(name),
+                "delta": round(run["evaluation_results"].get(name, 0) - base["evaluation_results"].get(name, 0), 4)
+            }
+            for name in metric_names
+        },
+        "latency": latency,
+        "queries": {
+            "added": len(run_rows.keys() - base_rows.keys()),
+            "removed": len(base_rows.keys() - run_rows.keys()),
+            "common": len(changes),
+            "response_changed": sum(1 for change in changes if change["response_changed"]),
+            "status_changed": sum(1 for change in changes if change["status"] != change["base_status"])
+        },
+        "regressions": [change for change in changes if change["delta"] < 0][:HISTORY_DIFF_TOP_N],
+        "improvements": [change for change in reversed(changes) if change["delta"] > 0][:HISTORY_DIFF_TOP_N]
+    }
+
+@app.get("/api/history/diff")
+def diff_run_history(base_run_id: str, run_id: str):
+    """Compare a run against a baseline run"""
+    base, run = load_run(base_run_id), load_run(run_id)
+    if base is None or run is None:
+        return JSONResponse(status_code=404, content={"error": "Evaluation run not found or expired"})
+    return diff_runs(base, run)
+
+@app.get("/api/runs/{run_id}/latency")
+def get_run_latency(run_id: str):
+    run = load_run(run_id)
+    if run is None:
+        return JSONResponse(status_code=404, content={"error": "Evaluation run not found or expired"})
+    return {
+        "run_id": run_id,
+        "latency": run.get("latency") or summarize_latency(run["dataset"], 0),
+        "queries": [
+            {"index": index, "status": row["status"], "timings": row.get("timings") or {"total_ms": row["latency_ms"]}}
+            for index, row in enumerate(run["dataset"])
+        ]
+    }
+
+# PDF rendering is CPU-bound and holds the GIL, so it runs in worker processes rather than
+# on the event loop. Spawned workers only import the reports module.
+pdf_executor = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+_pdf_renders = 0
+
+class PDFQueueFull(Exception):
+    pass
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+async def render_pdf(request, dataset, evaluation_results, latency=None, layout="full", worst_n=PDF_WORST_N):
+    """Render the PDF report in the process pool and return the response, or 204 if the client disconnects first.
+
+    Large runs and the summary layout are written to a temp file by the worker and served from disk.
+    """
+    global _pdf_renders
+    if _pdf_renders >= PDF_QUEUE_LIMIT:
+        raise PDFQueueFull()
+    _pdf_renders += 1
+    path = None
+    try:
+        if layout == "summary" or len(dataset) > PDF_LARGE_REPORT_ROWS:
+            fd, path = tempfile.mkstemp(prefix="rag_report_", suffix=".pdf")
+            os.close(fd)
+            future = pdf_executor.submit(write_pdf_report, path, dataset, evaluation_results, latency, layout, worst_n)
+        else:
+            future = pdf_executor.submit(generate_pdf_report, dataset, evaluation_results, latency)
+        rendering = asyncio.wrap_future(future)
+        while True:
+            done, _ = await asyncio.wait({rendering}, timeout=0.5)
+            if done:
+                break
+            if await request.is_disconnected():
+                # A queued render is dropped; one already running finishes in its worker and is discarded
+                future.cancel()
+                if path:
+                    future.add_done_callback(lambda _: _remove_file(path))
+                logger.info("Client disconnected, abandoning PDF render")
+                return Response(status_code=204)
+        pdf_data = rendering.result()
+    except BaseException:
+        if path:
+            _remove_file(path)
+        raise
+    finally:
+        _pdf_renders -= 1
+    if path:
+        return FileResponse(
+            path,
+            media_type="application/pdf",
+            filename="rag_evaluation_report.pdf",
+            background=BackgroundTask(_remove_file, path)
+        )
+    return Response(
+        content=pdf_data,
+        media_type="application/pdf",
+        headers={
+            "Content-Disposition": f"attachment; filename=rag_evaluation_report.pdf"
+        }
+    )
+
 @app.get("/api/download-pdf")
 async def download_pdf(
-    rag_endpoint: str,
+    request: Request,
+    rag_endpoint: Optional[str] = None,
+    run_id: Optional[str] = None,
     api_key: Optional[str] = None,
     endpoint_type: str = "generic",
     request_method: str = "GET",
     response_path: str = "answer",
     headers: Optional[str] = None,
-    request_format: Optional[str] = None
+    request_format: Optional[str] = None,
+    max_concurrency: int = DEFAULT_CONCURRENCY,
+    dataset_id: Optional[str] = None,
+    layout: str = "full",
+    worst_n: int = PDF_WORST_N,
+    bypass_cache: bool = False
 ):
+    if layout not in ("full", "summary"):
+        return JSONResponse(status_code=400, content={"error": "layout must be 'full' or 'summary'"})
     try:
+        # Render a previously completed run without querying the endpoint again
+        if run_id:
+            run = await run_in_threadpool(load_run, run_id)
+            if run is None:
+                return JSONResponse(
+                    status_code=404,
+                    content={"error": "Evaluation run not found or expired"}
+                )
+            return await render_pdf(request, run["dataset"], run["evaluation_results"], run.get("latency"), layout, worst_n)
+        
+        if not rag_endpoint:
+            return JSONResponse(
+                status_code=400,
+                content={"error": "Either run_id or rag_endpoint is required"}
+            )
+        
         # URL decode the endpoint if it's encoded
         rag_endpoint = requests.utils.unquote(rag_endpoint)
         
@@ -705,7 +2501,10 @@ async def download_pdf(
             api_key=api_key,
             endpoint_type=endpoint_type,
             request_method=request_method,
-            response_path=response_path
+            response_path=response_path,
+            max_concurrency=max_concurrency,
+            dataset_id=dataset_id,
+            bypass_cache=bypass_cache
         )
         
         # Parse JSON strings from query parameters if provided
@@ -727,46 +2526,30 @@ async def download_pdf(
                     content={"error": "Invalid JSON format in request_format"}
                 )
         
-        # For each sample query, decide which query function to call based on the endpoint type
-        dataset = []
-        for query, reference in zip(sample_queries, expected_responses):
-            # Choose the appropriate query function based on the endpoint type
-            if request_data.endpoint_type == "openai" or "openai.com" in rag_endpoint:
-                response = query_openai(query, rag_endpoint, request_data.api_key)
-            elif request_data.endpoint_type == "azure":
-                response = query_azure(query, rag_endpoint, request_data.api_key, request_data.headers)
-            elif request_data.endpoint_type == "custom" and request_data.request_format:
-                response = query_custom(
-                    query, rag_endpoint, request_data.api_key, 
-                    request_data.request_method, request_data.request_format, 
-                    request_data.response_path, request_data.headers
-                )
-            else:
-                response = query_rag(query, rag_endpoint, headers=request_data.headers)
-            
-            dataset.append({
-                "user_input": query,
-                "response": response,
-                "reference": reference
-            })
+        evaluation_pairs = evaluation_input(request_data)
+        if evaluation_pairs is None:
+            return JSONResponse(
+                status_code=404,
+                content={"error": f"Dataset not found: {dataset_id}"}
+            )
         
-        # Calculate evaluation metrics
-        evaluation_results = {
-            "Context Recall": sum([1 for d in dataset if d["response"] == d["reference"]]) / len(dataset),
-            "Faithfulness": 0.92,
-            "Factual Correctness": 0.88
-        }
+        # Query the endpoint for every query in the dataset, off the event loop
+        started = time.perf_counter()
+        dataset = await run_in_threadpool(run_queries, *evaluation_pairs, request_data)
+        latency = summarize_latency(dataset, time.perf_counter() - started)
         
-        # Generate PDF
-        pdf_data = generate_pdf_report(dataset, evaluation_results)
+        # Calculate evaluation metrics and keep the run
+        evaluation_results = await run_in_threadpool(lambda: evaluate(dataset, get_reference_index(dataset_id)))
+        await run_in_threadpool(save_run, request_data, dataset, evaluation_results, latency)
         
-        # Return the PDF file
-        return Response(
-            content=pdf_data,
-            media_type="application/pdf",
-            headers={
-                "Content-Disposition": f"attachment; filename=rag_evaluation_report.pdf"
-            }
+        # Generate PDF and return the file
+        return await render_pdf(request, dataset, evaluation_results, latency, layout, worst_n)
+    except PDFQueueFull:
+        logger.warning(f"PDF render queue full ({PDF_QUEUE_LIMIT} renders in progress)")
+        return JSONResponse(
+            status_code=429,
+            content={"error": "Too many PDF reports being generated, please retry later"},
+            headers={"Retry-After": "10"}
         )
     except Exception as e:
         logger.error(f"Error generating PDF: {str(e)}", exc_info=True)
@@ -775,166 +2558,12 @@ async def download_pdf(
             content={"error": f"Failed to generate PDF: {str(e)}"}
         )
 
-def generate_pdf_report(dataset, evaluation_results):
-    # Process evaluation data and generate a simple PDF report
-    buffer = io.BytesIO()
-    
-    # Create PDF document with proper margins
-    doc = SimpleDocTemplate(
-        buffer, 
-        pagesize=letter,
-        rightMargin=72, 
-        leftMargin=72, 
-        topMargin=72, 
-        bottomMargin=72
-    )
-    
-    # Set up styles
-    styles = getSampleStyleSheet()
-    styles.add(ParagraphStyle(
-        name='CenteredTitle',
-        parent=styles['Title'],
-        alignment=1,
-        fontName='Poppins-Bold',
-        fontSize=24,
-        spaceAfter=30,
-    ))
-    styles.add(ParagraphStyle(
-        name='Regular',
-        parent=styles['Normal'],
-        fontName='Poppins',
-        fontSize=10,
-        leading=14,
-    ))
-    styles.add(ParagraphStyle(
-        name='TableHeader',
-        parent=styles['Regular'],
-        fontName='Poppins-Bold',
-        fontSize=12,
-        textColor=colors.white,
-    ))
-    styles.add(ParagraphStyle(
-        name='MetricsHeader',
-        parent=styles['Heading2'],
-        fontName='Poppins-Bold',
-        fontSize=16,
-        spaceAfter=12,
-    ))
-    
-    elements = []
-    
-    # Add title
-    elements.append(Paragraph("RAG Evaluation Report", styles['CenteredTitle']))
-    
-    # Add timestamp
-    date_string = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    elements.append(Paragraph(f"Generated on: {date_string}", styles['Regular']))
-    elements.append(Spacer(1, 20))
-    
-    # Add metrics section
-    elements.append(Paragraph("Performance Metrics", styles['MetricsHeader']))
-    
-    # Create metrics table with website-like styling
-    metrics_data = [["Metric", "Score"]]
-    for metric, score in evaluation_results.items():
-        formatted_score = f"{score:.1%}" if isinstance(score, (int, float)) else score
-        metrics_data.append([metric, formatted_score])
-    
-    metrics_table = Table(metrics_data, colWidths=[300, 150])
-    metrics_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#007bff')),  # Primary blue color
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
-        ('ALIGN', (0, 0), (0, -1), 'LEFT'),
-        ('ALIGN', (1, 0), (1, -1), 'CENTER'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Poppins-Bold'),
-        ('FONTNAME', (0, 1), (-1, -1), 'Poppins'),
-        ('FONTSIZE', (0, 0), (-1, 0), 12),
-        ('FONTSIZE', (0, 1), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('TOPPADDING', (0, 0), (-1, 0), 12),
-        ('BOTTOMPADDING', (0, 1), (-1, -1), 8),
-        ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#e2e8f0')),  # Border color
-        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.HexColor('#f7fafc'), colors.white]),  # Alternating row colors
-    ]))
-    
-    elements.append(metrics_table)
-    elements.append(Spacer(1, 30))
-    
-    # Add evaluation results section
-    elements.append(Paragraph("Detailed Evaluation Results", styles['MetricsHeader']))
-    elements.append(Spacer(1, 12))
-    
-    # Helper function to limit text length for table cells
-    def limit_text_length(text, max_chars=300):
-        if len(text) > max_chars:
-            return text[:max_chars] + "..."
-        return text
-    
-    # Create results table with website-like styling
-    results_data = [["User Query", "Generated Response", "Reference Answer"]]
-    
-    for item in dataset:
-        user_query = limit_text_length(item['user_input'], 200)
-        response = limit_text_length(item['response'], 300)
-        reference = limit_text_length(item['reference'], 300)
-        
-        results_data.append([
-            Paragraph(user_query, styles['Regular']),
-            Paragraph(response, styles['Regular']),
-            Paragraph(reference, styles['Regular']),
-        ])
-    
-    results_table = Table(results_data, colWidths=[160, 180, 180], repeatRows=1)
-    results_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#007bff')),  # Primary blue color
-        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
-        ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
-        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-        ('FONTNAME', (0, 0), (-1, 0), 'Poppins-Bold'),
-        ('FONTSIZE', (0, 0), (-1, 0), 12),
-        ('FONTSIZE', (0, 1), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-        ('TOPPADDING', (0, 0), (-1, 0), 12),
-        ('BOTTOMPADDING', (0, 1), (-1, -1), 8),
-        ('TOPPADDING', (0, 1), (-1, -1), 8),
-        ('LEFTPADDING', (0, 0), (-1, -1), 8),
-        ('RIGHTPADDING', (0, 0), (-1, -1), 8),
-        ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#e2e8f0')),  # Border color
-        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.HexColor('#f7fafc'), colors.white]),  # Alternating row colors
-    ]))
-    
-    elements.append(results_table)
-    
-    # Build PDF
-    doc.build(elements)
-    buffer.seek(0)
-    return buffer.getvalue()
-
-# Function to extract value from nested JSON using a dot-separated path
-def extract_from_json(json_obj, path):
-    """Extract a value from a nested JSON object using a dot-separated path"""
-    if not path:
-        return json_obj
-        
-    parts = path.split('.')
-    current = json_obj
-    
-    for part in parts:
-        if isinstance(current, dict) and part in current:
-            current = current[part]
-        elif isinstance(current, list) and part.isdigit() and int(part) < len(current):
-            current = current[int(part)]
-        else:
-            return None
-    
-    return current
-
 # Function to call Azure OpenAI endpoints
-def query_azure(prompt, endpoint, api_key=None, headers=None):
+def query_azure(prompt, endpoint, api_key=None, headers=None, retry_policy=None, stream=False, rpm=None, tpm=None):
     if not api_key:
-        return "Error: API key not provided for Azure endpoint."
+        return QueryError("Error: API key not provided for Azure endpoint.")
     
-    headers = headers or {}
+    headers = dict(headers or {})
     headers.update({
         "Content-Type": "application/json",
         "api-key": api_key
@@ -945,44 +2574,54 @@ def query_azure(prompt, endpoint, api_key=None, headers=None):
         "temperature": 0.7,
         "max_tokens": 150
     }
+    if stream:
+        data["stream"] = True
     
+    session = get_http_session(endpoint)
+    limiter = get_rate_limiter(endpoint, api_key, rpm, tpm)
     try:
-        response = requests.post(
+        response = send_with_policy(
+            rate_limited(
+                lambda attempt: session.post(endpoint, headers=headers, json=data, timeout=request_timeout(endpoint, attempt),
+                                         stream=True),
+                limiter,
+                estimate_tokens(prompt) + data["max_tokens"]
+            ),
             endpoint,
-            headers=headers,
-            json=data,
-            timeout=TIMEOUT_SECONDS
+            get_retry_policy(endpoint, retry_policy)
         )
+        if not response.ok:
+            response.close()
         response.raise_for_status()
-        json_response = response.json()
-        answer = json_response.get("choices", [{}])[0].get("message", {}).get("content", "")
+        if stream:
+            return read_streamed_answer(response)
+        reader = BodyReader(response)
+        answer = read_json_answer(reader, OPENAI_ANSWER)
+        if answer is None:
+            return QueryError(reader.truncation_error()) if reader.truncated else ""
         return answer
     except requests.exceptions.Timeout:
-        return "Error: Server response timeout. Please try again later."
+        return QueryError("Error: Server response timeout. Please try again later.")
     except requests.exceptions.RequestException as e:
-        return f"Error: {str(e)}"
+        return QueryError(f"Error: {str(e)}")
     except Exception as e:
-        return f"Unexpected error: {str(e)}"
+        return QueryError(f"Unexpected error: {str(e)}")
 
 # Function to call custom endpoints with flexible configuration
-def query_custom(prompt, endpoint, api_key=None, method="POST", request_format=None, response_path="answer", headers=None):
-    headers = headers or {}
+def query_custom(prompt, endpoint, api_key=None, method="POST", request_format=None, response_path="answer", headers=None, retry_policy=None,
+                 stream=False, stream_path=None):
+    headers = dict(headers or {})
     
     # Add API key to headers if provided
     if api_key:
         headers["Authorization"] = f"Bearer {api_key}"
     
-    # Prepare request body by replacing placeholders in the format
-    request_body = {}
-    if request_format:
-        # Deep copy to avoid modifying the original
-        import copy
-        request_body = copy.deepcopy(request_format)
-        # Replace {prompt} placeholder with the actual prompt
-        replace_placeholder(request_body, "{prompt}", prompt)
-    else:
-        # Default format if none provided
-        request_body = {"query": prompt}
+    # request_format and response_path may come precompiled for the run; compile them here otherwise
+    template = request_format if isinstance(request_format, RequestTemplate) else RequestTemplate(request_format, method)
+    extract = response_path if isinstance(response_path, ResponseExtractor) else compile_response_path(response_path)
+    response_path = extract.response_path
+    # Replace the {prompt} placeholder with the actual prompt
+    request_body = template.render(prompt)
     
     try:
         logger.info("Making custom API call", extra={
@@ -993,89 +2632,83 @@ def query_custom(prompt, endpoint, api_key=None, method="POST", request_format=N
             "response_path": response_path
         })
         
+        session = get_http_session(endpoint)
         if method.upper() == "GET":
-            # For GET requests, convert the body to query parameters
-            params = flatten_dict(request_body)
-            response = requests.get(
+            # For GET requests the template renders flattened query parameters
+            send = lambda attempt: session.get(
                 endpoint,
-                params=params,
+                params=request_body,
                 headers=headers,
-                timeout=TIMEOUT_SECONDS
+                timeout=request_timeout(endpoint, attempt),
+                stream=True
             )
         else:
             # For POST and other methods
-            response = requests.request(
+            send = lambda attempt: session.request(
                 method.upper(),
                 endpoint,
                 headers=headers,
                 json=request_body,
-                timeout=TIMEOUT_SECONDS
+                timeout=request_timeout(endpoint, attempt),
+                stream=True
             )
+        response = send_with_policy(send, endpoint, get_retry_policy(endpoint, retry_policy))
         
+        if not response.ok:
+            response.close()
         response.raise_for_status()
+        content_type = response.headers.get("Content-Type", "")
+        
+        # Streamed event answers are assembled from each event's delta; other streamed bodies are read as they arrive
+        if stream and content_type.startswith("text/event-stream"):
+            return read_streamed_answer(response, compile_response_path(stream_path) if stream_path else OPENAI_STREAM_DELTA)
+        reader = None if stream else BodyReader(response)
         
         # Handle different response types
-        if response.headers.get("Content-Type", "").startswith("application/json"):
-            json_response = response.json()
+        if content_type.startswith("application/json"):
+            if stream:
+                answer = extract(json.loads(read_streamed_answer(response)))
+            else:
+                # Extract answer using the provided path, reading the body no further than the answer
+                answer = read_json_answer(reader, extract)
             logger.info("Received JSON response", extra={
                 "status_code": response.status_code,
                 "content_type": response.headers.get("Content-Type"),
-                "response_keys": list(json_response.keys()) if isinstance(json_response, dict) else "non-dict-response"
+                "truncated": reader is not None and reader.truncated
             })
             
-            # Extract answer using the provided path
-            answer = extract_from_json(json_response, response_path)
             if answer is None:
-                error_msg = f"Error: Could not find path '{response_path}' in response: {json_response}"
+                if reader is not None and reader.truncated:
+                    error_msg = reader.truncation_error()
+                else:
+                    error_msg = f"Error: Could not find path '{response_path}' in response"
                 logger.error(error_msg)
-                return error_msg
+                return QueryError(error_msg)
             return answer
         else:
             # Return text response for non-JSON responses
+            text = read_streamed_answer(response) if stream else reader.text()
             logger.info("Received non-JSON response", extra={
                 "status_code": response.status_code,
                 "content_type": response.headers.get("Content-Type"),
-                "content_length": len(response.text)
+                "content_length": len(text),
+                "truncated": reader is not None and reader.truncated
             })
-            return response.text
+            if reader is not None and reader.truncated:
+                error_msg = reader.truncation_error()
+                logger.error(error_msg)
+                return QueryError(error_msg)
+            return text
             
     except requests.exceptions.Timeout:
         logger.error("Request timeout", extra={"endpoint": endpoint})
-        return "Error: Server response timeout. Please try again later."
+        return QueryError("Error: Server response timeout. Please try again later.")
     except requests.exceptions.RequestException as e:
         logger.error(f"Request exception: {str(e)}", extra={"endpoint": endpoint})
-        return f"Error: {str(e)}"
+        return QueryError(f"Error: {str(e)}")
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}", extra={"endpoint": endpoint})
-        return f"Unexpected error: {str(e)}"
-
-# Helper function to replace placeholders in nested dictionaries
-def replace_placeholder(obj, placeholder, value):
-    """Replace placeholders in nested dictionaries and lists"""
-    if isinstance(obj, dict):
-        for k, v in obj.items():
-            if isinstance(v, (dict, list)):
-                replace_placeholder(v, placeholder, value)
-            elif isinstance(v, str) and placeholder in v:
-                obj[k] = v.replace(placeholder, value)
-    elif isinstance(obj, list):
-        for i, item in enumerate(obj):
-            if isinstance(item, (dict, list)):
-                replace_placeholder(item, placeholder, value)
-            elif isinstance(item, str) and placeholder in item:
-                obj[i] = item.replace(placeholder, value)
-
-# Helper function to flatten a nested dictionary for GET parameters
-def flatten_dict(d, parent_key='', sep='_'):
-    """Flatten a nested dictionary for use as GET parameters"""
-    items = []
-    for k, v in d.items():
-        new_key = f"{parent_key}{sep}{k}" if parent_key else k
-        if isinstance(v, dict):
-            items.extend(flatten_dict(v, new_key, sep=sep).items())
-        else:
-            items.append((new_key, v))
-    return dict(items)
+        return QueryError(f"Unexpected error: {str(e)}")
 
 if __name__ == '__main__':
     import uvicorn
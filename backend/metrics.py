@@ -0,0 +1,463 @@
+# metrics.py
+"""Lexical answer-quality metrics computed in batches with NumPy.
+
+Texts are tokenized once into a flat array of token ids plus row offsets (a
+ragged array), and every metric is computed for all response/reference pairs
+at once with sorting and counting primitives instead of per-pair Python loops.
+references are indexed once per dataset (ReferenceIndex) so scoring a run only
+has to tokenize the responses. Large runs can be scored in shards by worker
+processes (score_shard), which load the saved index and receive the responses
+as a packed UTF-8 buffer.
+"""
+import os
+import re
+from collections import OrderedDict
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+
+TOKEN_PATTERN = re.compile(r"\w+")
+ENCODE_CHUNK_SIZE = 10000  # Texts tokenized at a time when building a reference index
+MAX_LCS_TOKENS = 256   # Tokens per text considered by ROUGE-L
+LCS_BATCH_SIZE = 4096  # Pairs processed together by the LCS kernel
+BLEU_MAX_ORDER = 4
+WORKER_INDEX_CACHE_SIZE = 4  # Reference indexes kept loaded by each scoring worker process
+
+# Words ignored when deriving the keywords a response is expected to contain
+STOPWORDS = frozenset("""
+a an and are as at be been but by can did do does for from had has have he her his how i if in into is it its
+of on or our she so such than that the their them then there these they this to was we were what when where
+which who whom why will with would you your
+""".split())
+
+# Display names of the per-row scores returned by score_pairs
+METRIC_NAMES = {
+    "token_f1": "Token F1",
+    "rouge_l": "ROUGE-L",
+    "bleu": "BLEU",
+    "keyword_recall": "Keyword Recall",
+    "semantic_similarity": "Semantic Similarity",
+}
+
+# Constants for hashing n-grams and (row, n-gram) pairs into uint64 keys
+_HASH_MULTIPLIER = np.uint64(0x100000001B3)
+_ROW_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+
+def tokenize(text):
+    """Lower-case a text and split it into word tokens"""
+    return TOKEN_PATTERN.findall(str(text).lower())
+
+
+class Vocabulary:
+    """Maps tokens to stable integer ids, growing as new tokens are seen"""
+
+    def __init__(self, tokens=()):
+        self._index = pd.Index(list(tokens), dtype=object)
+
+    def __len__(self):
+        return len(self._index)
+
+    @property
+    def tokens(self):
+        return self._index
+
+    def lookup(self, tokens, add=True):
+        """Map tokens to ids; unknown tokens are added, or mapped to -1 when add is False"""
+        tokens = pd.Index(tokens, dtype=object)
+        ids = self._index.get_indexer(tokens)
+        missing = ids < 0
+        if add and missing.any():
+            self._index = self._index.append(tokens[missing].unique())
+            ids[missing] = self._index.get_indexer(tokens[missing])
+        return ids.astype(np.int64)
+
+
+class TokenizedTexts:
+    """A batch of texts as one flat token-id array with per-text offsets, and optional per-token values"""
+
+    def __init__(self, ids, offsets, values=None):
+        self.ids = ids
+        self.offsets = offsets
+        self.values = values
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets)
+
+    @property
+    def rows(self):
+        """Row number of every token in the flat array"""
+        return np.repeat(np.arange(len(self), dtype=np.int64), self.lengths)
+
+    @property
+    def positions(self):
+        """Position of every token within its own text"""
+        return np.arange(len(self.ids), dtype=np.int64) - np.repeat(self.offsets[:-1], self.lengths)
+
+    def take(self, indices):
+        """Select a subset of rows, in the given order"""
+        lengths = self.lengths[indices]
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        starts = np.repeat(self.offsets[:-1][indices] - offsets[:-1], lengths)
+        positions = np.arange(offsets[-1], dtype=np.int64) + starts
+        values = self.values[positions] if self.values is not None else None
+        return TokenizedTexts(self.ids[positions], offsets, values)
+
+    @classmethod
+    def concatenate(cls, parts):
+        parts = list(parts)
+        if not parts:
+            return cls(np.zeros(0, dtype=np.int64), np.zeros(1, dtype=np.int64))
+        lengths = np.concatenate([part.lengths for part in parts])
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return cls(np.concatenate([part.ids for part in parts]), offsets)
+
+
+def encode_texts(texts, vocabulary, add=True):
+    """Tokenize texts and map them to token ids with a shared vocabulary.
+
+    With add=False the vocabulary is left untouched (so it can be shared between
+    threads) and unknown tokens get ids from len(vocabulary) upwards, which never
+    occur in texts encoded into the vocabulary itself.
+    """
+    token_lists = [tokenize(text) for text in texts]
+    offsets = np.zeros(len(token_lists) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(map(len, token_lists), dtype=np.int64, count=len(token_lists)), out=offsets[1:])
+    tokens = list(chain.from_iterable(token_lists))
+    ids = vocabulary.lookup(tokens, add=add)
+    unknown = ids < 0
+    if unknown.any():
+        codes, _ = pd.factorize(np.array(tokens, dtype=object)[unknown])
+        ids[unknown] = len(vocabulary) + codes
+    return TokenizedTexts(ids, offsets)
+
+
+def _ngram_keys(texts, n):
+    """Hash every n-gram of every text, together with its row number, into a uint64 key"""
+    lengths = texts.lengths
+    valid = np.flatnonzero(texts.positions + n <= np.repeat(lengths, lengths))
+    token_ids = texts.ids.astype(np.uint64)
+    hashes = np.zeros(len(valid), dtype=np.uint64)
+    for k in range(n):
+        hashes = hashes * _HASH_MULTIPLIER + token_ids[valid + k] + np.uint64(1)
+    rows = texts.rows[valid]
+    return hashes ^ (rows.astype(np.uint64) * _ROW_MULTIPLIER), rows
+
+
+def _clipped_matches(keys_a, rows_a, keys_b, size):
+    """Per row, the number of keys of a also found in b, clipped to their count in b"""
+    unique_a, first_a, counts_a = np.unique(keys_a, return_index=True, return_counts=True)
+    unique_b, counts_b = np.unique(keys_b, return_counts=True)
+    if len(unique_b) == 0:
+        return np.zeros(size)
+    in_b = np.minimum(np.searchsorted(unique_b, unique_a), len(unique_b) - 1)
+    in_a = np.flatnonzero(unique_b[in_b] == unique_a)
+    in_b = in_b[in_a]
+    clipped = np.minimum(counts_a[in_a], counts_b[in_b])
+    return np.bincount(rows_a[first_a[in_a]], weights=clipped, minlength=size)
+
+
+def _safe_divide(numerator, denominator):
+    numerator = np.asarray(numerator, dtype=np.float64)
+    return np.divide(numerator, denominator, out=np.zeros_like(numerator), where=denominator > 0)
+
+
+def token_f1(responses, references):
+    """SQuAD-style token overlap F1 for each response/reference pair"""
+    response_keys, response_rows = _ngram_keys(responses, 1)
+    reference_keys, _ = _ngram_keys(references, 1)
+    overlap = _clipped_matches(response_keys, response_rows, reference_keys, len(responses))
+    precision = _safe_divide(overlap, responses.lengths)
+    recall = _safe_divide(overlap, references.lengths)
+    return _safe_divide(2 * precision * recall, precision + recall)
+
+
+def bleu(responses, references, max_order=BLEU_MAX_ORDER):
+    """Sentence-level BLEU with add-one smoothing for the higher n-gram orders"""
+    size = len(responses)
+    log_precision = np.zeros(size)
+    for n in range(1, max_order + 1):
+        response_keys, response_rows = _ngram_keys(responses, n)
+        reference_keys, _ = _ngram_keys(references, n)
+        matches = _clipped_matches(response_keys, response_rows, reference_keys, size)
+        totals = np.maximum(responses.lengths - n + 1, 0).astype(np.float64)
+        smoothing = 0.0 if n == 1 else 1.0
+        with np.errstate(divide="ignore"):
+            log_precision += np.log(_safe_divide(matches + smoothing, totals + smoothing))
+    response_lengths = responses.lengths.astype(np.float64)
+    reference_lengths = references.lengths.astype(np.float64)
+    with np.errstate(divide="ignore", over="ignore"):
+        brevity_penalty = np.where(
+            response_lengths >= reference_lengths, 1.0,
+            np.exp(1.0 - _safe_divide(reference_lengths, response_lengths))
+        )
+        scores = brevity_penalty * np.exp(log_precision / max_order)
+    return np.where(response_lengths > 0, np.nan_to_num(scores), 0.0)
+
+
+def keyword_recall(responses, references, vocabulary):
+    """Share of each reference's content words (non-stopwords) that appear in the response"""
+    stop_ids = vocabulary.lookup(list(STOPWORDS), add=False)
+    is_keyword = ~np.isin(references.ids, stop_ids)
+    keyword_keys, keyword_rows = _ngram_keys(references, 1)
+    keyword_keys, first = np.unique(keyword_keys[is_keyword], return_index=True)
+    keyword_rows = keyword_rows[is_keyword][first]
+    response_keys, _ = _ngram_keys(responses, 1)
+    found = np.isin(keyword_keys, response_keys)
+    size = len(responses)
+    return _safe_divide(
+        np.bincount(keyword_rows, weights=found, minlength=size),
+        np.bincount(keyword_rows, minlength=size)
+    )
+
+
+def _popcount(words):
+    """Number of set bits in each row of a 2-D uint64 array"""
+    table = np.array([bin(i).count("1") for i in range(256)], dtype=np.int64)
+    return table[words.view(np.uint8)].reshape(len(words), -1).sum(axis=1)
+
+
+def _lcs_batch(responses, references):
+    """Bit-parallel LCS lengths for a batch of pairs.
+
+    Reference positions are kept as bitsets of 64-bit words, so each response token
+    updates every pair in the batch with a handful of vectorized word operations.
+    """
+    size = len(responses)
+    reference_rows, reference_positions = references.rows, references.positions
+    keep = reference_positions < MAX_LCS_TOKENS
+    reference_rows, reference_positions = reference_rows[keep], reference_positions[keep]
+    reference_lengths = np.minimum(references.lengths, MAX_LCS_TOKENS)
+    words = max(1, int(-(-reference_lengths.max(initial=0) // 64)))
+    if len(reference_positions) == 0 or len(responses.ids) == 0:
+        return np.zeros(size, dtype=np.int64)
+
+    # Match masks: for each (row, token) of the reference, the positions where it occurs
+    vocab_size = int(max(references.ids.max(initial=0), responses.ids.max(initial=0))) + 1
+    keys = reference_rows * vocab_size + references.ids[keep]
+    unique_keys, inverse = np.unique(keys, return_inverse=True)
+    masks = np.zeros((len(unique_keys) + 1, words), dtype=np.uint64)  # last row: no match
+    bits = np.left_shift(np.uint64(1), (reference_positions % 64).astype(np.uint64))
+    np.bitwise_or.at(masks, (inverse, reference_positions // 64), bits)
+
+    # Look up the mask of every response token, laid out as (position, row)
+    response_lengths = np.minimum(responses.lengths, MAX_LCS_TOKENS)
+    response_positions = responses.positions
+    keep = response_positions < MAX_LCS_TOKENS
+    response_rows = responses.rows[keep]
+    response_keys = response_rows * vocab_size + responses.ids[keep]
+    found = np.searchsorted(unique_keys, response_keys)
+    found = np.where(
+        (found < len(unique_keys)) & (unique_keys[np.minimum(found, len(unique_keys) - 1)] == response_keys),
+        found, len(unique_keys)
+    )
+    lookup = np.full((int(response_lengths.max()), size), len(unique_keys), dtype=np.int64)
+    lookup[response_positions[keep], response_rows] = found
+
+    state = np.full((size, words), np.uint64(0xFFFFFFFFFFFFFFFF), dtype=np.uint64)
+    for position_masks in lookup:
+        match = masks[position_masks]
+        shared = state & match
+        carry = np.zeros(size, dtype=np.uint64)
+        total = np.empty_like(state)
+        for w in range(words):
+            partial = state[:, w] + shared[:, w]
+            overflow = partial < state[:, w]
+            total[:, w] = partial + carry
+            carry = (overflow | (total[:, w] < partial)).astype(np.uint64)
+        state = total | (state & ~match)
+
+    # Unset bits within the reference length count the LCS
+    word_starts = np.arange(words, dtype=np.int64) * 64
+    filled = np.clip(reference_lengths[:, None] - word_starts, 0, 64)
+    length_mask = np.where(
+        filled >= 64, np.uint64(0xFFFFFFFFFFFFFFFF),
+        np.left_shift(np.uint64(1), filled.astype(np.uint64)) - np.uint64(1)
+    )
+    return _popcount(~state & length_mask)
+
+
+def rouge_l(responses, references):
+    """ROUGE-L F-measure (longest common subsequence) for each pair"""
+    size = len(responses)
+    lcs = np.zeros(size, dtype=np.float64)
+    # Group pairs of similar length so the padded batches stay tight
+    order = np.argsort(responses.lengths, kind="stable")
+    for start in range(0, size, LCS_BATCH_SIZE):
+        batch = order[start:start + LCS_BATCH_SIZE]
+        lcs[batch] = _lcs_batch(responses.take(batch), references.take(batch))
+    precision = _safe_divide(lcs, np.minimum(responses.lengths, MAX_LCS_TOKENS))
+    recall = _safe_divide(lcs, np.minimum(references.lengths, MAX_LCS_TOKENS))
+    return _safe_divide(2 * precision * recall, precision + recall)
+
+
+def _term_weights(texts, idf, width):
+    """L2-normalized TF-IDF weights as (row, token) keys sorted by row then token.
+
+    Token ids past the end of idf are unseen tokens and all get its last entry.
+    """
+    keys, counts = np.unique(texts.rows * width + texts.ids, return_counts=True)
+    rows, tokens = keys // width, keys % width
+    weights = counts * idf[np.minimum(tokens, len(idf) - 1)]
+    norms = np.sqrt(np.bincount(rows, weights=weights * weights, minlength=len(texts)))
+    return keys, rows, tokens, weights / norms[rows]
+
+
+class ReferenceIndex:
+    """Reference answers of a dataset, tokenized and TF-IDF weighted once for every run.
+
+    Holds a frozen vocabulary, the references as token-id arrays and one sparse
+    TF-IDF row per reference, all as flat NumPy arrays that can be saved to disk.
+    """
+
+    def __init__(self, vocabulary, references, idf, weights, path=None):
+        self.vocabulary = vocabulary
+        self.references = references
+        self.idf = idf
+        self.weights = weights
+        self.path = path  # File the index was saved to or loaded from, if any
+
+    def __len__(self):
+        return len(self.references)
+
+    @classmethod
+    def build(cls, references):
+        """Index an iterable of reference texts, tokenizing them in chunks"""
+        vocabulary = Vocabulary()
+        parts, chunk = [], []
+        for text in references:
+            chunk.append(text)
+            if len(chunk) >= ENCODE_CHUNK_SIZE:
+                parts.append(encode_texts(chunk, vocabulary))
+                chunk = []
+        if chunk or not parts:
+            parts.append(encode_texts(chunk, vocabulary))
+        encoded = TokenizedTexts.concatenate(parts)
+
+        # Smoothed IDF; the extra last entry is used for tokens never seen in a reference
+        size = len(vocabulary) + 1
+        width = np.int64(size)
+        document_tokens = np.unique(encoded.rows * width + encoded.ids) % width
+        document_frequency = np.bincount(document_tokens, minlength=size)
+        idf = np.log((1.0 + len(encoded)) / (1.0 + document_frequency)) + 1.0
+
+        _, rows, tokens, weights = _term_weights(encoded, idf, width)
+        offsets = np.searchsorted(rows, np.arange(len(encoded) + 1, dtype=np.int64))
+        return cls(vocabulary, encoded, idf, TokenizedTexts(tokens, offsets, weights))
+
+    def save(self, path):
+        np.savez_compressed(
+            path,
+            vocabulary=np.array(list(self.vocabulary.tokens), dtype=str),
+            reference_ids=self.references.ids,
+            reference_offsets=self.references.offsets,
+            idf=self.idf,
+            weight_ids=self.weights.ids,
+            weight_offsets=self.weights.offsets,
+            weight_values=self.weights.values,
+        )
+        self.path = path
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(
+                Vocabulary(data["vocabulary"].tolist()),
+                TokenizedTexts(data["reference_ids"], data["reference_offsets"]),
+                data["idf"],
+                TokenizedTexts(data["weight_ids"], data["weight_offsets"], data["weight_values"]),
+                path,
+            )
+
+    def similarity(self, responses, rows=None):
+        """TF-IDF cosine similarity of each response with its reference.
+
+        This is the diagonal of the response x reference cosine matrix, computed as a
+        sparse join on (row, token) keys so only the paired rows are multiplied.
+        """
+        weights = self.weights if rows is None else self.weights.take(rows)
+        width = np.int64(max(len(self.idf), responses.ids.max(initial=0) + 1))
+        reference_keys = weights.rows * width + weights.ids
+        response_keys, response_rows, _, response_weights = _term_weights(responses, self.idf, width)
+        if len(reference_keys) == 0:
+            return np.zeros(len(responses))
+        match = np.minimum(np.searchsorted(reference_keys, response_keys), len(reference_keys) - 1)
+        shared = reference_keys[match] == response_keys
+        products = response_weights[shared] * weights.values[match[shared]]
+        return np.bincount(response_rows[shared], weights=products, minlength=len(responses))
+
+    def score(self, responses, rows=None):
+        """Score response texts against the indexed references (or the given subset of rows)"""
+        encoded = encode_texts(responses, self.vocabulary, add=False)
+        references = self.references if rows is None else self.references.take(np.asarray(rows, dtype=np.int64))
+        scores = score_encoded(encoded, references, self.vocabulary)
+        scores["semantic_similarity"] = self.similarity(encoded, rows)
+        return scores
+
+
+def score_pairs(responses, references):
+    """Compute every metric for parallel lists of responses and references.
+
+    Returns a dict mapping each key of METRIC_NAMES to an array with one score per pair.
+    """
+    return ReferenceIndex.build(references).score(responses)
+
+
+def score_encoded(responses, references, vocabulary):
+    """Compute the lexical metrics for already tokenized responses and references"""
+    return {
+        "token_f1": token_f1(responses, references),
+        "rouge_l": rouge_l(responses, references),
+        "bleu": bleu(responses, references),
+        "keyword_recall": keyword_recall(responses, references, vocabulary),
+    }
+
+
+def pack_texts(texts):
+    """Texts as one UTF-8 byte buffer plus int64 offsets, a compact columnar form to send to worker processes"""
+    encoded = [str(text).encode("utf-8") for text in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)), out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def unpack_texts(buffer, offsets):
+    data = buffer.tobytes()
+    return [data[start:stop].decode("utf-8") for start, stop in zip(offsets[:-1].tolist(), offsets[1:].tolist())]
+
+
+# Reference indexes loaded by this (worker) process, keyed by file and modification time
+_worker_indexes = OrderedDict()
+
+
+def score_shard(index_path, start, buffer, offsets):
+    """Score a shard of packed responses against rows start, start + 1, ... of a saved reference index.
+
+    Runs in a scoring worker process; the index is loaded on first use and kept for later shards.
+    """
+    key = (index_path, os.stat(index_path).st_mtime_ns)
+    index = _worker_indexes.get(key)
+    if index is None:
+        index = _worker_indexes[key] = ReferenceIndex.load(index_path)
+        while len(_worker_indexes) > WORKER_INDEX_CACHE_SIZE:
+            _worker_indexes.popitem(last=False)
+    else:
+        _worker_indexes.move_to_end(key)
+    responses = unpack_texts(buffer, offsets)
+    return index.score(responses, np.arange(start, start + len(responses), dtype=np.int64))
+
+
+def summarize(scores, mask=None):
+    """Average per-row scores into a {display name: mean} dict, optionally over a subset of rows"""
+    summary = {}
+    for key, name in METRIC_NAMES.items():
+        values = scores[key] if mask is None else scores[key][mask]
+        summary[name] = float(values.mean()) if len(values) else 0.0
+    return summary
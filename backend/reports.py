@@ -0,0 +1,651 @@
+# reports.py
+import io
+import os
+import html
+import heapq
+import itertools
+from string import Template
+from datetime import datetime
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.fonts import addMapping
+from reportlab.pdfbase import pdfmetrics, pdfdoc
+from reportlab.pdfgen import canvas
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+
+# Report rendering, kept apart from the API so PDF worker processes only need reportlab
+
+# Get the current directory
+current_dir = os.path.dirname(os.path.abspath(__file__))
+fonts_dir = os.path.join(current_dir, 'fonts')
+
+# Register Poppins font
+pdfmetrics.registerFont(TTFont('Poppins', os.path.join(fonts_dir, 'Poppins-Regular.ttf')))
+pdfmetrics.registerFont(TTFont('Poppins-Bold', os.path.join(fonts_dir, 'Poppins-Bold.ttf')))
+addMapping('Poppins', 0, 0, 'Poppins')
+addMapping('Poppins', 1, 0, 'Poppins-Bold')
+
+# Latency phases reported per run, in the order they are shown
+LATENCY_PHASES = {
+    "total_ms": "Total",
+    "ttfb_ms": "Time to first byte",
+    "ttft_ms": "Time to first token",
+    "inter_token_ms": "Inter-token latency",
+    "dns_ms": "DNS lookup",
+    "connect_ms": "TCP connect",
+    "tls_ms": "TLS handshake"
+}
+
+def latency_table(latency):
+    """Rows of the latency percentile table shown in the HTML and PDF reports"""
+    rows = [["Phase", "p50", "p90", "p95", "p99", "Max"]]
+    for key, label in LATENCY_PHASES.items():
+        stats = latency["phases"].get(key)
+        if stats:
+            rows.append([label] + [f"{stats[column]:.0f} ms" for column in ("p50", "p90", "p95", "p99", "max")])
+    return rows
+
+def row_score(row):
+    """Mean of a row's metric values; failed rows score 0"""
+    scores = list((row.get("metrics") or {}).values())
+    return sum(scores) / len(scores) if scores and row["status"] == "success" else 0.0
+
+# HTML report templates, compiled once at import. Every substituted value is HTML-escaped.
+HTML_REPORT_ROWS_PER_CHUNK = 200  # Table rows rendered into each streamed chunk
+HTML_REPORT_COLUMNS = ["User Query", "Generated Response", "Reference Answer", "Latency"]
+HTML_REPORT_HEAD = Template("""<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>RAG Evaluation Results</title>
+    <style>
+        :root {
+            --primary-color: #007bff;
+            --border-color: #e2e8f0;
+            --bg-color: #ffffff;
+            --text-color: #1a202c;
+            --hover-bg: #f7fafc;
+        }
+        body {
+            font-family: 'Poppins', system-ui, -apple-system, sans-serif;
+            color: var(--text-color);
+            line-height: 1.6;
+            margin: 0;
+            padding: 0;
+        }
+        .container {
+            width: 100%;
+            background: var(--bg-color);
+            border-radius: 8px;
+            overflow: hidden;
+        }
+        .table-wrapper {
+            width: 100%;
+            overflow-x: auto;
+            -webkit-overflow-scrolling: touch;
+            margin-bottom: 1rem;
+            border-radius: 8px;
+            box-shadow: 0 1px 3px 0 rgba(0, 0, 0, 0.1);
+        }
+        table {
+            width: 100%;
+            border-collapse: separate;
+            border-spacing: 0;
+            margin: 0;
+            border: 1px solid var(--border-color);
+            min-width: 600px; /* Ensures table doesn't get too squished */
+        }
+        th, td {
+            border: 1px solid var(--border-color);
+            padding: 0.75rem;
+            text-align: left;
+            transition: background-color 0.2s ease;
+            min-width: 120px; /* Minimum column width */
+            word-wrap: break-word;
+            max-width: 300px; /* Maximum column width */
+        }
+        th {
+            background-color: var(--primary-color);
+            color: white !important; /* Ensure header text is always white */
+            font-weight: 500;
+            white-space: nowrap;
+            position: sticky;
+            top: 0;
+            z-index: 1;
+        }
+        th:first-child, td:first-child {
+            padding-left: 1.5rem; /* Add extra padding to first column header and cells */
+        }
+        td:first-child {
+            padding-left: 1.5rem; /* Add extra padding to first column */
+        }
+        tr:nth-child(even) {
+            background-color: var(--hover-bg);
+        }
+        tr:hover td {
+            background-color: rgba(0, 123, 255, 0.05);
+        }
+        .metrics {
+            background: var(--bg-color);
+            border-radius: 8px;
+            padding: 1rem;
+            margin-top: 1.5rem;
+            border: 1px solid var(--border-color);
+        }
+        .metrics h3 {
+            color: var(--primary-color);
+            margin-top: 0;
+            font-weight: 500;
+            font-size: 1.1rem;
+        }
+        .metrics ul {
+            list-style: none;
+            padding: 0;
+            margin: 0;
+        }
+        .metrics li {
+            padding: 0.75rem;
+            border-bottom: 1px solid var(--border-color);
+            display: flex;
+            justify-content: space-between;
+            align-items: center;
+            flex-wrap: wrap;
+            gap: 0.5rem;
+        }
+        .metrics li:last-child {
+            border-bottom: none;
+        }
+        .row-stats {
+            font-size: 0.8rem;
+            color: #4a5568;
+            margin-top: 0.25rem;
+        }
+        td.regressed {
+            background-color: #fff5f5;
+        }
+        td.improved {
+            background-color: #f0fff4;
+        }
+        .pagination {
+            display: flex;
+            justify-content: space-between;
+            align-items: center;
+            padding: 0.75rem 0;
+        }
+        .pagination a {
+            color: var(--primary-color);
+        }
+        @media (max-width: 640px) {
+            th, td {
+                padding: 0.5rem;
+                font-size: 0.875rem;
+            }
+            .metrics li {
+                padding: 0.5rem;
+            }
+            .metrics h3 {
+                font-size: 1rem;
+            }
+        }
+    </style>
+</head>
+<body>
+    <div class="container" data-run-id="$run_id">
+        <div class="table-wrapper">
+            <table>
+                <thead>
+                    <tr>$columns
+                    </tr>
+                </thead>
+                <tbody>
+""")
+HTML_REPORT_ROW = Template("""                    <tr>
+                        <td>$user_input</td>
+                        <td>$response</td>
+                        <td>$reference</td>
+                        <td>$latency</td>
+                    </tr>
+""")
+HTML_REPORT_PAGINATION = Template("""
+        <div class="pagination">
+            <span>$previous</span>
+            <span>Page $page of $pages</span>
+            <span>$next</span>
+        </div>""")
+HTML_REPORT_WARNINGS = Template("""
+        <div class="warning-section">
+            <h3>⚠️ Warnings</h3>
+            <p>$success_count out of $total queries completed successfully. Some queries encountered errors:</p>
+            <ul class="warning-list">
+                $errors
+            </ul>
+        </div>""")
+HTML_REPORT_METRIC = Template("""
+                <li>
+                    <span>$metric</span>
+                    <span>$score</span>
+                </li>""")
+HTML_REPORT_LATENCY = Template("""
+        <div class="metrics latency">
+            <h3>Latency</h3>
+            <p>$summary</p>
+            <table>
+                $rows
+            </table>
+        </div>""")
+HTML_COMPARISON_ROW = Template("""                    <tr>
+                        <td>$user_input</td>
+                        <td>$reference</td>$cells
+                    </tr>
+""")
+HTML_COMPARISON_CELL = Template("""
+                        <td class="$change">$response<div class="row-stats">$score$delta · $latency</div></td>""")
+HTML_COMPARISON_TAIL = Template("""                </tbody>
+            </table>
+        </div>
+        <div class="metrics">
+            <h3>Evaluation Metrics</h3>
+            <table>
+                $metrics
+            </table>
+        </div>
+        <div class="metrics latency">
+            <h3>Latency</h3>
+            <table>
+                $latency
+            </table>
+        </div>
+    </div>
+</body>
+</html>
+""")
+HTML_REPORT_TAIL = Template("""                </tbody>
+            </table>
+        </div>$pagination$warnings
+        <div class="metrics">
+            <h3>Evaluation Metrics</h3>
+            <ul>$metrics
+            </ul>
+        </div>$latency
+    </div>
+</body>
+</html>
+""")
+
+def latency_summary(latency):
+    return (
+        f"{latency['queries']} queries in {latency['wall_seconds']:.1f}s "
+        f"({latency['throughput_qps']:.2f} queries/s), {latency['retries']} retries, "
+        f"{latency['bytes_received']} bytes received"
+        + (f", {latency['cached_queries']} answered from cache" if latency.get("cached_queries") else "")
+        + (f", {latency['tokens_per_second']['p50']:.1f} tokens/s median" if latency.get("tokens_per_second") else "")
+    )
+
+def html_columns(columns):
+    return "".join(f"\n                        <th>{html.escape(column)}</th>" for column in columns)
+
+def html_table_rows(rows):
+    """Table rows for a list of cell lists, the first being the header"""
+    return "".join(
+        "<tr>" + "".join(f"<{tag}>{html.escape(cell)}</{tag}>" for cell in row) + "</tr>"
+        for tag, row in (("th" if i == 0 else "td", row) for i, row in enumerate(rows))
+    )
+
+def render_html_report(dataset, evaluation_results, latency=None, run_id="", start=0, stop=None, pagination=None):
+    """Yield the HTML report in chunks, with table rows for dataset[start:stop]"""
+    escape = html.escape
+    yield HTML_REPORT_HEAD.substitute(run_id=escape(run_id), columns=html_columns(HTML_REPORT_COLUMNS))
+    chunk = []
+    for row in itertools.islice(dataset, start, stop):
+        chunk.append(HTML_REPORT_ROW.substitute(
+            user_input=escape(str(row["user_input"])),
+            response=escape(str(row["response"])),
+            reference=escape(str(row["reference"])),
+            latency=f"{row['latency_ms']:.0f} ms"
+        ))
+        if len(chunk) == HTML_REPORT_ROWS_PER_CHUNK:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
+
+    # Warn about failed queries when some but not all of them failed
+    warnings = ""
+    errors = []
+    error_count = 0
+    for index, row in enumerate(dataset):
+        if row["status"] == "error":
+            error_count += 1
+            if len(errors) < 3:
+                errors.append(f"<li>Query {index + 1}: {escape(str(row['response']))}</li>")
+    if error_count and error_count < len(dataset):
+        if error_count > 3:
+            errors.append(f"<li>...and {error_count - 3} more errors</li>")
+        warnings = HTML_REPORT_WARNINGS.substitute(
+            success_count=len(dataset) - error_count,
+            total=len(dataset),
+            errors="".join(errors)
+        )
+
+    page_links = ""
+    if pagination:
+        page_links = HTML_REPORT_PAGINATION.substitute(
+            previous=f'<a href="{escape(pagination["prev"])}">Previous</a>' if pagination["prev"] else "",
+            next=f'<a href="{escape(pagination["next"])}">Next</a>' if pagination["next"] else "",
+            page=pagination["page"],
+            pages=pagination["pages"]
+        )
+
+    latency_html = ""
+    if latency:
+        latency_html = HTML_REPORT_LATENCY.substitute(
+            summary=escape(latency_summary(latency)),
+            rows=html_table_rows(latency_table(latency))
+        )
+
+    yield HTML_REPORT_TAIL.substitute(
+        pagination=page_links,
+        warnings=warnings,
+        metrics="".join(
+            HTML_REPORT_METRIC.substitute(metric=escape(metric), score=f"{score:.1%}")
+            for metric, score in evaluation_results.items()
+        ),
+        latency=latency_html
+    )
+
+def comparison_tables(labels, runs, baseline=0):
+    """Metric and latency tables of a comparison, each value with its delta against the baseline run"""
+    base = runs[baseline]
+    metrics = [["Metric", *labels]]
+    for metric, base_score in base["evaluation_results"].items():
+        cells = []
+        for position, run in enumerate(runs):
+            score = run["evaluation_results"].get(metric, 0)
+            cells.append(f"{score:.1%}" if position == baseline else f"{score:.1%} ({score - base_score:+.1%})")
+        metrics.append([metric, *cells])
+
+    def latency_stat(run, phase, stat):
+        return (((run.get("latency") or {}).get("phases") or {}).get(phase) or {}).get(stat)
+
+    latency = [["Latency", *labels]]
+    for phase in ("total_ms", "ttfb_ms"):
+        for stat in ("p50", "p95", "p99"):
+            base_value = latency_stat(base, phase, stat)
+            cells = []
+            for position, run in enumerate(runs):
+                value = latency_stat(run, phase, stat)
+                if value is None:
+                    cells.append("-")
+                elif position == baseline or base_value is None:
+                    cells.append(f"{value:.0f} ms")
+                else:
+                    cells.append(f"{value:.0f} ms ({value - base_value:+.0f} ms)")
+            latency.append([f"{LATENCY_PHASES[phase]} {stat}", *cells])
+    latency.append(["Throughput", *(f"{(run.get('latency') or {}).get('throughput_qps', 0):.2f} queries/s" for run in runs)])
+    latency.append(["Failed queries", *(str(sum(1 for row in run["dataset"] if row["status"] == "error")) for run in runs)])
+    return metrics, latency
+
+def render_comparison_report(labels, runs, baseline=0):
+    """Yield a side-by-side HTML report of runs over the same dataset, with each row's mean score
+    and the metric and latency deltas against the baseline run"""
+    escape = html.escape
+    yield HTML_REPORT_HEAD.substitute(
+        run_id=escape(",".join(run["run_id"] for run in runs)),
+        columns=html_columns(["User Query", "Reference Answer", *labels])
+    )
+    chunk = []
+    for rows in zip(*(run["dataset"] for run in runs)):
+        base_score = row_score(rows[baseline])
+        cells = []
+        for position, row in enumerate(rows):
+            score = row_score(row)
+            change = delta = ""
+            if position != baseline:
+                delta = f" ({score - base_score:+.1%})"
+                change = "regressed" if score < base_score else "improved" if score > base_score else ""
+            cells.append(HTML_COMPARISON_CELL.substitute(
+                change=change,
+                response=escape(str(row["response"])),
+                score=f"{score:.1%}",
+                delta=delta,
+                latency=f"{row['latency_ms']:.0f} ms"
+            ))
+        chunk.append(HTML_COMPARISON_ROW.substitute(
+            user_input=escape(str(rows[baseline]["user_input"])),
+            reference=escape(str(rows[baseline]["reference"])),
+            cells="".join(cells)
+        ))
+        if len(chunk) == HTML_REPORT_ROWS_PER_CHUNK:
+            yield "".join(chunk)
+            chunk = []
+    if chunk:
+        yield "".join(chunk)
+
+    metrics, latency = comparison_tables(labels, runs, baseline)
+    yield HTML_COMPARISON_TAIL.substitute(metrics=html_table_rows(metrics), latency=html_table_rows(latency))
+
+PDF_ROWS_PER_TABLE = 25  # Result rows per table, so long reports are laid out about a page at a time
+PDF_WORST_N = 50  # Rows listed by the summary layout
+
+class FlowableStream(list):
+    """Flowable list for doc.build that is topped up from a generator as reportlab consumes it,
+    so only the next few flowables (rather than the whole report) exist at any time"""
+
+    def __init__(self, flowables, lookahead=4):
+        super().__init__()
+        self._source = iter(flowables)
+        self._lookahead = lookahead
+        self._fill()
+
+    def _fill(self):
+        while self._source is not None and len(self) < self._lookahead:
+            flowable = next(self._source, None)
+            if flowable is None:
+                self._source = None
+            else:
+                self.append(flowable)
+
+    def __delitem__(self, index):
+        super().__delitem__(index)
+        self._fill()
+
+class CompressedPageCanvas(canvas.Canvas):
+    """Canvas that compresses each page's content stream as soon as the page is finished,
+    instead of holding every page's drawing commands as text until the document is saved"""
+
+    def showPage(self):
+        super().showPage()
+        page = self._doc.Pages.pages[-1]
+        contents = pdfdoc.PDFStream(content=pdfdoc.PDFZCompress.encode(page.stream))
+        # Marking the filter as applied stops reportlab from compressing the stream again on save
+        contents.dictionary["Filter"] = pdfdoc.PDFArray([pdfdoc.PDFName(pdfdoc.PDFZCompress.pdfname)])
+        contents.__Comment__ = "page stream"
+        page.Contents = contents
+        page.stream = None
+
+def worst_results(dataset, n):
+    """The n failed or lowest-scoring rows, failures first, as (index, row) pairs"""
+    def rank(item):
+        _, row = item
+        return -1.0 if row["status"] == "error" else row_score(row)
+    return heapq.nsmallest(n, enumerate(dataset), key=rank)
+
+def _pdf_styles():
+    styles = getSampleStyleSheet()
+    styles.add(ParagraphStyle(
+        name='CenteredTitle',
+        parent=styles['Title'],
+        alignment=1,
+        fontName='Poppins-Bold',
+        fontSize=24,
+        spaceAfter=30,
+    ))
+    styles.add(ParagraphStyle(
+        name='Regular',
+        parent=styles['Normal'],
+        fontName='Poppins',
+        fontSize=10,
+        leading=14,
+    ))
+    styles.add(ParagraphStyle(
+        name='TableHeader',
+        parent=styles['Regular'],
+        fontName='Poppins-Bold',
+        fontSize=12,
+        textColor=colors.white,
+    ))
+    styles.add(ParagraphStyle(
+        name='MetricsHeader',
+        parent=styles['Heading2'],
+        fontName='Poppins-Bold',
+        fontSize=16,
+        spaceAfter=12,
+    ))
+    return styles
+
+RESULTS_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#007bff')),  # Primary blue color
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+    ('ALIGN', (0, 0), (-1, -1), 'LEFT'),
+    ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Poppins-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 12),
+    ('FONTSIZE', (0, 1), (-1, -1), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('TOPPADDING', (0, 0), (-1, 0), 12),
+    ('BOTTOMPADDING', (0, 1), (-1, -1), 8),
+    ('TOPPADDING', (0, 1), (-1, -1), 8),
+    ('LEFTPADDING', (0, 0), (-1, -1), 8),
+    ('RIGHTPADDING', (0, 0), (-1, -1), 8),
+    ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#e2e8f0')),  # Border color
+    ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.HexColor('#f7fafc'), colors.white]),  # Alternating row colors
+])
+
+# Helper function to limit text length for table cells; the text is escaped for reportlab's markup
+def limit_text_length(text, max_chars=300):
+    text = str(text)
+    if len(text) > max_chars:
+        text = text[:max_chars] + "..."
+    return html.escape(text)
+
+def _report_elements(dataset, evaluation_results, latency, styles, layout, worst_n):
+    """Yield the report's flowables in order, building result tables one chunk at a time"""
+    # Add title
+    yield Paragraph("RAG Evaluation Report", styles['CenteredTitle'])
+    
+    # Add timestamp
+    date_string = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    yield Paragraph(f"Generated on: {date_string}", styles['Regular'])
+    yield Spacer(1, 20)
+    
+    # Add metrics section
+    yield Paragraph("Performance Metrics", styles['MetricsHeader'])
+    
+    # Create metrics table with website-like styling
+    metrics_data = [["Metric", "Score"]]
+    for metric, score in evaluation_results.items():
+        formatted_score = f"{score:.1%}" if isinstance(score, (int, float)) else score
+        metrics_data.append([metric, formatted_score])
+    
+    metrics_table = Table(metrics_data, colWidths=[300, 150])
+    metrics_table.setStyle(TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#007bff')),  # Primary blue color
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+        ('ALIGN', (0, 0), (0, -1), 'LEFT'),
+        ('ALIGN', (1, 0), (1, -1), 'CENTER'),
+        ('FONTNAME', (0, 0), (-1, 0), 'Poppins-Bold'),
+        ('FONTNAME', (0, 1), (-1, -1), 'Poppins'),
+        ('FONTSIZE', (0, 0), (-1, 0), 12),
+        ('FONTSIZE', (0, 1), (-1, -1), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+        ('TOPPADDING', (0, 0), (-1, 0), 12),
+        ('BOTTOMPADDING', (0, 1), (-1, -1), 8),
+        ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#e2e8f0')),  # Border color
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.HexColor('#f7fafc'), colors.white]),  # Alternating row colors
+    ]))
+    
+    yield metrics_table
+    yield Spacer(1, 30)
+    
+    # Add latency section
+    if latency:
+        yield Paragraph("Latency", styles['MetricsHeader'])
+        yield Paragraph(latency_summary(latency), styles['Regular'])
+        yield Spacer(1, 12)
+        latency_pdf_table = Table(latency_table(latency), colWidths=[128, 68, 68, 68, 68, 68])
+        latency_pdf_table.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#007bff')),  # Primary blue color
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+            ('ALIGN', (0, 0), (0, -1), 'LEFT'),
+            ('ALIGN', (1, 0), (-1, -1), 'CENTER'),
+            ('FONTNAME', (0, 0), (-1, 0), 'Poppins-Bold'),
+            ('FONTNAME', (0, 1), (-1, -1), 'Poppins'),
+            ('FONTSIZE', (0, 0), (-1, -1), 10),
+            ('BOTTOMPADDING', (0, 0), (-1, -1), 8),
+            ('TOPPADDING', (0, 0), (-1, -1), 8),
+            ('GRID', (0, 0), (-1, -1), 1, colors.HexColor('#e2e8f0')),  # Border color
+            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.HexColor('#f7fafc'), colors.white]),  # Alternating row colors
+        ]))
+        yield latency_pdf_table
+        yield Spacer(1, 30)
+    
+    # Add evaluation results section
+    if layout == "summary":
+        rows = worst_results(dataset, worst_n)
+        yield Paragraph(f"Failed and Lowest-Scoring Results ({len(rows)} of {len(dataset)})", styles['MetricsHeader'])
+    else:
+        rows = enumerate(dataset)
+        yield Paragraph("Detailed Evaluation Results", styles['MetricsHeader'])
+    yield Spacer(1, 12)
+    
+    # Create results tables with website-like styling, PDF_ROWS_PER_TABLE rows each
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, PDF_ROWS_PER_TABLE))
+        if not chunk:
+            break
+        results_data = [["User Query", "Generated Response", "Reference Answer", "Latency"]]
+        for index, item in chunk:
+            user_query = limit_text_length(item['user_input'], 200)
+            if layout == "summary":
+                user_query = f"#{index + 1}: {user_query}"
+            results_data.append([
+                Paragraph(user_query, styles['Regular']),
+                Paragraph(limit_text_length(item['response'], 300), styles['Regular']),
+                Paragraph(limit_text_length(item['reference'], 300), styles['Regular']),
+                Paragraph(f"{item['latency_ms']:.0f} ms", styles['Regular']),
+            ])
+        results_table = Table(results_data, colWidths=[140, 160, 160, 60], repeatRows=1)
+        results_table.setStyle(RESULTS_TABLE_STYLE)
+        yield results_table
+
+def build_pdf_report(target, dataset, evaluation_results, latency=None, layout="full", worst_n=PDF_WORST_N):
+    """Lay out the report into target (a path or file object); layout is "full" or "summary" (worst_n rows)"""
+    # Create PDF document with proper margins
+    doc = SimpleDocTemplate(
+        target, 
+        pagesize=letter,
+        rightMargin=72, 
+        leftMargin=72, 
+        topMargin=72, 
+        bottomMargin=72
+    )
+    # Flowables are generated as they are laid out and finished pages are kept compressed,
+    # so memory stays roughly flat however many rows the report has
+    elements = _report_elements(dataset, evaluation_results, latency, _pdf_styles(), layout, worst_n)
+    doc.build(FlowableStream(elements), canvasmaker=CompressedPageCanvas)
+
+def generate_pdf_report(dataset, evaluation_results, latency=None, layout="full", worst_n=PDF_WORST_N):
+    # Process evaluation data and generate a simple PDF report
+    buffer = io.BytesIO()
+    build_pdf_report(buffer, dataset, evaluation_results, latency, layout, worst_n)
+    buffer.seek(0)
+    return buffer.getvalue()
+
+def write_pdf_report(path, dataset, evaluation_results, latency=None, layout="full", worst_n=PDF_WORST_N):
+    """Render the report straight to a file, for runs too large to hold as bytes"""
+    build_pdf_report(path, dataset, evaluation_results, latency, layout, worst_n)
+    return path
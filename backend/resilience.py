@@ -0,0 +1,502 @@
+"""Client-side resilience for the evaluator's outbound requests.
+
+Rate limiting paces requests to OpenAI and Azure per API key (RateLimiter), following the
+provider's rate-limit headers. Circuit breaking stops sending to an endpoint that keeps failing
+(CircuitBreaker) until a probe request gets through again. Latency profiles (EndpointProfiles)
+learn each endpoint's latency distribution to size its request timeouts and hedging delays.
+Response bodies are read through BodyReader, which caps their size, and every query's HTTP
+timings are collected in a per-thread trace (query_trace).
+"""
+import bisect
+import codecs
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+import requests
+
+logger = logging.getLogger("rag_evaluation")
+
+RATE_LIMIT_RPM = int(os.getenv("RATE_LIMIT_RPM", "0"))  # Requests/minute budget per OpenAI or Azure key; 0 learns it from rate-limit headers
+RATE_LIMIT_TPM = int(os.getenv("RATE_LIMIT_TPM", "0"))  # Tokens/minute budget per OpenAI or Azure key; 0 learns it from rate-limit headers
+RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv("RATE_LIMIT_MAX_WAIT_SECONDS", "300"))  # Longest a request is resent after 429s before one counts as a failed attempt
+TIMEOUT_P99_MULTIPLIER = float(os.getenv("TIMEOUT_P99_MULTIPLIER", "3"))  # Learned timeouts are this multiple of the endpoint's p99
+TIMEOUT_FLOOR_SECONDS = float(os.getenv("TIMEOUT_FLOOR_SECONDS", "2"))  # Shortest learned timeout
+TIMEOUT_CEILING_SECONDS = float(os.getenv("TIMEOUT_CEILING_SECONDS", "60"))  # Longest learned timeout, including retries' doubling
+PROFILE_MIN_SAMPLES = 20  # Latency samples an endpoint profile needs before its timeouts are used
+PROFILE_DECAY_SAMPLES = 1000  # Histogram counts are halved at this many samples, so profiles follow recent latency
+PROFILE_SAVE_EVERY = 200  # Samples recorded between writes of the profile file
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))  # Consecutive failed requests that open an endpoint's circuit
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))  # Failed share of the recent requests that opens it
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))  # Recent requests the error rate is measured over (at least half must be in)
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))  # How long an open circuit fails fast before a probe request
+BREAKER_PROBE_WAIT_SECONDS = 15  # How long a request waits for a half-open probe's outcome before failing fast
+MAX_RESPONSE_BYTES = int(os.getenv("MAX_RESPONSE_BYTES", str(8 * 1024 * 1024)))  # Longest response body read from an endpoint; the rest is cut off
+RESPONSE_READ_BYTES = 64 * 1024  # Most bytes read from a response body at once
+RESPONSE_DRAIN_BYTES = 64 * 1024  # Body left after a found answer that is still read so the connection can be reused
+
+def endpoint_id(url):
+    """Endpoint identity for per-endpoint state: scheme, host and path, without the query string"""
+    parts = urlsplit(url.strip())
+    return f"{parts.scheme}://{parts.netloc}{parts.path}"
+
+# Timings of the query running on the current thread, filled in by the HTTP layer and BodyReader
+_query_trace = threading.local()
+
+@contextmanager
+def query_trace(trace=None):
+    """Record HTTP timings for the current thread into trace (a new one by default) while the block runs"""
+    previous = getattr(_query_trace, "current", None)
+    if trace is None:
+        trace = {"dns_ms": 0.0, "connect_ms": 0.0, "tls_ms": 0.0, "ttfb_ms": None,
+                 "bytes_received": 0, "retries": 0, "connections_opened": 0, "cached": False,
+                 "sent_at": None, "ttft_ms": None, "inter_token_ms": None, "tokens": None, "tokens_per_second": None, "truncated": False}
+    _query_trace.current = trace
+    try:
+        yield trace
+    finally:
+        _query_trace.current = previous
+
+def current_query_trace():
+    return getattr(_query_trace, "current", None)
+
+_RESET_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_RESET_UNIT_SECONDS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+def parse_reset_seconds(value):
+    """Seconds in a rate-limit header such as "20ms", "1s", "6m0s" or a bare number of seconds, or None"""
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        parts = _RESET_DURATION_PART.findall(value)
+        return sum(float(amount) * _RESET_UNIT_SECONDS[unit] for amount, unit in parts) if parts else None
+
+def _header_number(value):
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+class RateLimiter:
+    """Token buckets for one API key's requests and tokens per minute, shared by every evaluation in the process.
+
+    Budgets start from the request (or RATE_LIMIT_RPM / RATE_LIMIT_TPM) and follow the provider's
+    x-ratelimit-limit-* headers once it sends them. x-ratelimit-remaining-* keeps the buckets in step
+    with the provider's count, and an exhausted window or a 429 pauses every caller until it resets,
+    so requests queue here instead of failing.
+    """
+
+    def __init__(self, rpm=None, tpm=None):
+        self._condition = threading.Condition()
+        self.limits = {"requests": rpm or None, "tokens": tpm or None}
+        self.levels = {"requests": float(rpm or 0), "tokens": float(tpm or 0)}
+        self._updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.throttled = 0
+
+    def configure(self, rpm=None, tpm=None):
+        with self._condition:
+            for kind, limit in (("requests", rpm), ("tokens", tpm)):
+                if limit and self.limits[kind] is None:
+                    self.limits[kind] = limit
+                    self.levels[kind] = float(limit)
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        for kind, limit in self.limits.items():
+            if limit:
+                self.levels[kind] = min(limit, self.levels[kind] + elapsed * limit / 60)
+
+    def _wait_seconds(self, now, tokens):
+        wait = self.blocked_until - now
+        for kind, cost in (("requests", 1), ("tokens", tokens)):
+            limit = self.limits[kind]
+            if limit:
+                # A request bigger than the whole budget goes once the bucket is full
+                missing = min(cost, limit) - self.levels[kind]
+                if missing > 0:
+                    wait = max(wait, missing * 60 / limit)
+        return wait
+
+    def acquire(self, tokens):
+        """Block until a request using about `tokens` tokens fits both budgets, then take it out of them"""
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._wait_seconds(now, tokens)
+                if wait <= 0:
+                    break
+                self._condition.wait(wait)
+            self.levels["requests"] -= 1
+            self.levels["tokens"] -= tokens
+
+    def observe(self, response):
+        """Adapt the budgets to a response's rate-limit headers and pause everyone after a 429"""
+        headers = response.headers
+        with self._condition:
+            now = time.monotonic()
+            self._refill(now)
+            for kind in ("requests", "tokens"):
+                limit = _header_number(headers.get(f"x-ratelimit-limit-{kind}"))
+                if limit:
+                    if self.limits[kind] is None:
+                        self.levels[kind] = limit
+                    self.limits[kind] = limit
+                remaining = _header_number(headers.get(f"x-ratelimit-remaining-{kind}"))
+                if remaining is None:
+                    continue
+                if self.limits[kind]:
+                    self.levels[kind] = min(self.levels[kind], remaining)
+                reset = parse_reset_seconds(headers.get(f"x-ratelimit-reset-{kind}"))
+                if remaining <= 0 and reset:
+                    self.blocked_until = max(self.blocked_until, now + reset)
+            if response.status_code == 429:
+                self.throttled += 1
+                retry_after_ms = _header_number(headers.get("retry-after-ms"))
+                retry_after = (
+                    retry_after_ms / 1000 if retry_after_ms is not None
+                    else parse_reset_seconds(headers.get("Retry-After"))
+                    or parse_reset_seconds(headers.get("x-ratelimit-reset-requests"))
+                    or parse_reset_seconds(headers.get("x-ratelimit-reset-tokens"))
+                    or 1.0
+                )
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+                logger.warning(f"Rate limited by the provider, pausing requests for {retry_after:.2f}s")
+            self._condition.notify_all()
+
+rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+def get_rate_limiter(url, api_key, rpm=None, tpm=None):
+    """The shared rate limiter of an endpoint (host and path, e.g. an Azure deployment) and API key"""
+    parts = urlsplit(url)
+    key = (parts.netloc, parts.path, hashlib.sha256((api_key or "").encode()).hexdigest())
+    with _rate_limiters_lock:
+        limiter = rate_limiters.get(key)
+        if limiter is None:
+            limiter = rate_limiters[key] = RateLimiter(rpm or RATE_LIMIT_RPM, tpm or RATE_LIMIT_TPM)
+    limiter.configure(rpm, tpm)
+    return limiter
+
+def estimate_tokens(text):
+    """Rough token count of a prompt (about four characters per token)"""
+    return len(text) // 4 + 1
+
+def rate_limited(send, limiter, tokens, max_wait=None):
+    """Wrap send(attempt) so every attempt waits for the limiter's budget and reports back its headers.
+
+    A 429 is sent again once the limiter lets it through, without using up the attempt, so rate-limited
+    queries queue instead of failing. After max_wait seconds (RATE_LIMIT_MAX_WAIT_SECONDS) of that the
+    429 is returned and counts as a failed attempt.
+    """
+    max_wait = RATE_LIMIT_MAX_WAIT_SECONDS if max_wait is None else max_wait
+
+    def send_within_limits(attempt):
+        started = time.monotonic()
+        while True:
+            limiter.acquire(tokens)
+            response = send(attempt)
+            limiter.observe(response)
+            if response.status_code != 429 or time.monotonic() - started >= max_wait:
+                return response
+            response.close()
+            trace = current_query_trace()
+            if trace is not None:
+                trace["retries"] += 1
+    return send_within_limits
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of sending a request while the endpoint's circuit breaker is open"""
+
+class CircuitBreaker:
+    """Closed/open/half-open breaker for one endpoint, shared by every evaluation in the process.
+
+    The circuit opens after BREAKER_FAILURE_THRESHOLD consecutive failed requests, or when
+    BREAKER_ERROR_RATE of the last BREAKER_WINDOW requests failed. While open, requests fail
+    fast; after BREAKER_OPEN_SECONDS one probe request is let through (half-open) and its
+    outcome closes or re-opens the circuit; other requests wait for that outcome.
+    """
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.outcomes = deque(maxlen=BREAKER_WINDOW)
+        self.opened_at = None
+        self.last_error = None
+        self.short_circuited = 0
+        self._probing = False
+        self._lock = threading.Condition()
+
+    def allow(self):
+        """Whether a request may be sent now; in the half-open state only a single probe is"""
+        with self._lock:
+            while True:
+                if self.state == "closed":
+                    return True
+                if self.state == "open" and time.monotonic() - self.opened_at >= BREAKER_OPEN_SECONDS:
+                    self.state = "half_open"
+                if self.state == "half_open":
+                    if not self._probing:
+                        self._probing = True
+                        return True
+                    # Wait for the probe rather than failing requests that may well succeed
+                    if self._lock.wait(BREAKER_PROBE_WAIT_SECONDS):
+                        continue
+                self.short_circuited += 1
+                return False
+
+    def record(self, success, error=None):
+        with self._lock:
+            self._lock.notify_all()
+            self.outcomes.append(success)
+            if success:
+                self.consecutive_failures = 0
+                if self.state != "closed":
+                    logger.info(f"Circuit closed for {self.endpoint}")
+                    self.outcomes.clear()
+                self.state = "closed"
+                self._probing = False
+                return
+            self.consecutive_failures += 1
+            self.last_error = error
+            failures = self.outcomes.count(False)
+            if (self.state == "half_open"
+                    or self.consecutive_failures >= BREAKER_FAILURE_THRESHOLD
+                    or (len(self.outcomes) >= max(1, BREAKER_WINDOW // 2) and failures / len(self.outcomes) >= BREAKER_ERROR_RATE)):
+                # Late failures of requests sent before it opened don't push back the probe
+                if self.state != "open":
+                    logger.warning(f"Circuit opened for {self.endpoint} after {self.consecutive_failures} consecutive failures: {error}")
+                    self.state = "open"
+                    self.opened_at = time.monotonic()
+                    self._probing = False
+
+    def error(self):
+        retry_in = max(0.0, BREAKER_OPEN_SECONDS - (time.monotonic() - self.opened_at))
+        return CircuitOpenError(
+            f"Circuit breaker open for {self.endpoint} after repeated failures ({self.last_error}); "
+            f"failing fast for another {retry_in:.0f}s"
+        )
+
+    def view(self):
+        with self._lock:
+            failures = self.outcomes.count(False)
+            return {
+                "endpoint": self.endpoint,
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "error_rate": round(failures / len(self.outcomes), 3) if self.outcomes else 0.0,
+                "recent_requests": len(self.outcomes),
+                "short_circuited": self.short_circuited,
+                "last_error": self.last_error,
+                "retry_in_seconds": round(max(0.0, BREAKER_OPEN_SECONDS - (time.monotonic() - self.opened_at)), 1)
+                                    if self.state == "open" else None
+            }
+
+circuit_breakers = {}
+_circuit_breakers_lock = threading.Lock()
+
+def get_circuit_breaker(url):
+    endpoint = endpoint_id(url)
+    with _circuit_breakers_lock:
+        breaker = circuit_breakers.get(endpoint)
+        if breaker is None:
+            breaker = circuit_breakers[endpoint] = CircuitBreaker(endpoint)
+        return breaker
+
+def circuit_breaker_views():
+    """Current state of every endpoint's circuit breaker"""
+    with _circuit_breakers_lock:
+        breakers = list(circuit_breakers.values())
+    return [breaker.view() for breaker in breakers]
+
+# Latency histogram buckets: upper bounds growing by 20% from 1ms to about 10 minutes
+LATENCY_BUCKETS = [0.001 * 1.2 ** i for i in range(74)]
+
+class EndpointProfiles:
+    """Rolling latency histogram per endpoint, used to derive request timeouts and hedging delays.
+
+    Counts are halved every PROFILE_DECAY_SAMPLES samples so a profile follows the endpoint's recent
+    latency, and profiles are written to path so they survive restarts. Until a profile has
+    PROFILE_MIN_SAMPLES samples its timeout is default_timeout.
+    """
+
+    def __init__(self, path=None, default_timeout=15):
+        self.path = path
+        self.default_timeout = default_timeout
+        self._profiles = {}
+        self._lock = threading.Lock()
+        self._unsaved = 0
+        if path:
+            try:
+                with open(path, encoding="utf-8") as f:
+                    saved = json.load(f)
+                self._profiles = {
+                    endpoint: {"counts": counts, "total": sum(counts)}
+                    for endpoint, counts in saved.items() if len(counts) == len(LATENCY_BUCKETS)
+                }
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, AttributeError) as e:
+                logger.warning(f"Could not load endpoint latency profiles from {path}: {str(e)}")
+
+    def record(self, url, seconds):
+        bucket = min(bisect.bisect_left(LATENCY_BUCKETS, seconds), len(LATENCY_BUCKETS) - 1)
+        with self._lock:
+            profile = self._profiles.setdefault(endpoint_id(url), {"counts": [0.0] * len(LATENCY_BUCKETS), "total": 0.0})
+            profile["counts"][bucket] += 1
+            profile["total"] += 1
+            if profile["total"] >= PROFILE_DECAY_SAMPLES:
+                profile["counts"] = [count / 2 for count in profile["counts"]]
+                profile["total"] /= 2
+            self._unsaved += 1
+            save = self._unsaved >= PROFILE_SAVE_EVERY
+        if save:
+            self.save()
+
+    def percentile(self, url, percentile, min_samples=PROFILE_MIN_SAMPLES):
+        """Latency percentile in seconds (the upper bound of its bucket), or None without enough samples"""
+        with self._lock:
+            profile = self._profiles.get(endpoint_id(url))
+            if profile is None or profile["total"] < min_samples:
+                return None
+            target = profile["total"] * percentile / 100
+            seen = 0.0
+            for bound, count in zip(LATENCY_BUCKETS, profile["counts"]):
+                seen += count
+                if seen >= target:
+                    return bound
+            return LATENCY_BUCKETS[-1]
+
+    def timeout(self, url, attempt=0):
+        """Request timeout for an attempt: TIMEOUT_P99_MULTIPLIER x p99 within the floor and ceiling,
+        doubled on every retry; default_timeout until the profile has enough samples"""
+        p99 = self.percentile(url, 99)
+        if p99 is None:
+            return self.default_timeout
+        timeout = max(TIMEOUT_FLOOR_SECONDS, TIMEOUT_P99_MULTIPLIER * p99) * 2 ** attempt
+        return round(min(TIMEOUT_CEILING_SECONDS, timeout), 2)
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            saved = {endpoint: profile["counts"] for endpoint, profile in self._profiles.items()}
+            self._unsaved = 0
+        try:
+            # Write a sibling file and rename it so a crash never leaves a truncated profile file
+            temporary = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temporary, "w", encoding="utf-8") as f:
+                json.dump(saved, f)
+            os.replace(temporary, self.path)
+        except OSError as e:
+            logger.warning(f"Could not save endpoint latency profiles to {self.path}: {str(e)}")
+
+    def view(self):
+        with self._lock:
+            endpoints = [(endpoint, profile["total"]) for endpoint, profile in self._profiles.items()]
+        return [
+            {
+                "endpoint": endpoint,
+                "samples": round(total),
+                **{f"p{p}_ms": round(value * 1000, 1) if value is not None else None
+                   for p in (50, 95, 99) for value in [self.percentile(endpoint, p, min_samples=1)]},
+                "timeout_seconds": self.timeout(endpoint)
+            }
+            for endpoint, total in endpoints
+        ]
+
+class BodyReader:
+    """Decoded text chunks of a response requested with stream=True, up to limit bytes of its body.
+
+    Bytes read are added to the query trace. A longer body is cut off at the limit and marks the
+    reader and the query trace truncated, so a huge or endless body can't exhaust memory.
+    """
+
+    def __init__(self, response, limit=None):
+        self.response = response
+        self.limit = limit or MAX_RESPONSE_BYTES
+        self.received = 0
+        self.truncated = False
+        self._chunks = self._read()
+
+    def __iter__(self):
+        return self._chunks
+
+    def _read(self):
+        trace = current_query_trace()
+        # Without a charset requests would guess Latin-1 for text/*, but SSE and JSON are UTF-8
+        encoding = self.response.encoding if "charset" in self.response.headers.get("Content-Type", "") else "utf-8"
+        decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        # Reads are bounded so no body is loaded at once; chunked bodies still come chunk by chunk as they arrive
+        for chunk in self.response.iter_content(chunk_size=RESPONSE_READ_BYTES):
+            if self.received + len(chunk) > self.limit:
+                chunk = chunk[:self.limit - self.received]
+                self.truncated = True
+            self.received += len(chunk)
+            if trace is not None:
+                trace["bytes_received"] += len(chunk)
+                trace["truncated"] = trace["truncated"] or self.truncated
+            text = decoder.decode(chunk, final=self.truncated)
+            if text:
+                yield text
+            if self.truncated:
+                logger.warning(f"Response body from {self.response.url} exceeded {self.limit} bytes and was truncated")
+                return
+        text = decoder.decode(b"", final=True)
+        if text:
+            yield text
+
+    def text(self):
+        """The rest of the body"""
+        try:
+            return "".join(self._chunks)
+        finally:
+            self.response.close()
+
+    def close(self, drain_bytes=RESPONSE_DRAIN_BYTES):
+        """Close the response, first reading up to drain_bytes more so a body that is nearly done
+        can finish and leave its connection in the pool"""
+        budget = self.received + drain_bytes
+        for _ in self._chunks:
+            if self.received > budget:
+                break
+        self.response.close()
+
+    def truncation_error(self):
+        return f"Error: Response body exceeded {self.limit} bytes and was truncated"
+
+def read_json_answer(reader, extract):
+    """Answer of a JSON response body, or None if it is missing or was cut off by the size limit.
+
+    Streamable paths are followed through the body as it arrives and reading stops once the
+    answer is complete; other paths parse the whole body.
+    """
+    try:
+        if extract.streamable:
+            try:
+                return extract.from_chunks(reader)
+            except EOFError:
+                if reader.truncated:
+                    return None
+                raise ValueError("Response ended in the middle of its JSON document")
+        text = reader.text()
+        try:
+            return extract(json.loads(text))
+        except json.JSONDecodeError:
+            if reader.truncated:
+                return None
+            raise
+    finally:
+        reader.close()
@@ -0,0 +1,305 @@
+import json
+import re
+from functools import lru_cache
+
+PROMPT_PLACEHOLDER = "{prompt}"
+BATCH_PLACEHOLDER = "{prompts}"  # Replaced by the list of queries (or rendered items) of a batch request
+
+# Helper function to flatten a nested dictionary for GET parameters
+def flatten_dict(d, parent_key='', sep='_'):
+    """Flatten a nested dictionary for use as GET parameters"""
+    items = []
+    for k, v in d.items():
+        new_key = f"{parent_key}{sep}{k}" if parent_key else k
+        if isinstance(v, dict):
+            items.extend(flatten_dict(v, new_key, sep=sep).items())
+        else:
+            items.append((new_key, v))
+    return dict(items)
+
+def _compile_value(value, placeholder=PROMPT_PLACEHOLDER):
+    """Render function for one node of a request format, or None if the node has no placeholder"""
+    if isinstance(value, str):
+        if placeholder not in value:
+            return None
+        if value == placeholder:
+            return lambda prompt: prompt
+        if placeholder == BATCH_PLACEHOLDER:
+            # The list of queries can't be spliced into a string
+            raise ValueError(f"'{BATCH_PLACEHOLDER}' must be a whole value in the batch format, not part of '{value}'")
+        parts = value.split(placeholder)
+        return lambda prompt: prompt.join(parts)
+    if isinstance(value, dict):
+        return _compile_container(value, value.items(), dict, placeholder)
+    if isinstance(value, list):
+        return _compile_container(value, enumerate(value), list, placeholder)
+    return None
+
+def _compile_container(value, items, kind, placeholder):
+    # Placeholder-free subtrees are shared between renders, only the slots holding the prompt are rebuilt
+    slots = [
+        (key, render) for key, render in ((key, _compile_value(item, placeholder)) for key, item in items) if render
+    ]
+    if not slots:
+        return None
+
+    def render(prompt):
+        rendered = kind(value)
+        for key, render_slot in slots:
+            rendered[key] = render_slot(prompt)
+        return rendered
+    return render
+
+class RequestTemplate:
+    """A custom endpoint's request_format compiled once per run; render() fills in the prompt.
+
+    POST bodies are rendered as JSON objects, GET requests as flattened query parameters.
+    Batch request formats use the "{prompts}" placeholder, which must be a whole value (ValueError
+    otherwise), and render() takes the list of queries.
+    """
+
+    def __init__(self, request_format=None, method="POST", placeholder=PROMPT_PLACEHOLDER):
+        self.method = method.upper()
+        if not request_format:
+            request_format = {"query" if placeholder == PROMPT_PLACEHOLDER else "queries": placeholder}
+        if self.method == "GET":
+            request_format = flatten_dict(request_format)
+        self.render = _compile_value(request_format, placeholder) or (lambda prompt: request_format)
+
+_JSON_PATH_STEP = re.compile(r"\[(\*|-?\d+|-?\d*:-?\d*)\]|([^.\[\]]+)")
+
+class JSONPath:
+    """A compiled response_path.
+
+    Steps are dot-separated keys or list indexes, with [n], [a:b] and [*] (or a bare *)
+    to index, slice or fan out over lists. Paths that fan out return a list of matches.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.steps = []
+        position = 0
+        while position < len(path):
+            if path[position] == "." and position:
+                position += 1
+            match = _JSON_PATH_STEP.match(path, position)
+            if match is None:
+                raise ValueError(f"Invalid response path '{path}' at position {position}")
+            bracket, key = match.groups()
+            if key == "*" or bracket == "*":
+                self.steps.append(("all", None))
+            elif key is not None:
+                self.steps.append(("key", key))
+            elif ":" in bracket:
+                start, stop = (int(bound) if bound else None for bound in bracket.split(":"))
+                self.steps.append(("slice", slice(start, stop)))
+            else:
+                self.steps.append(("index", int(bracket)))
+            position = match.end()
+        self.fans_out = any(kind in ("all", "slice") for kind, _ in self.steps)
+        # Paths of keys and non-negative indexes can be followed through a document as it arrives
+        self.streamable = all(kind == "key" or kind == "index" and arg >= 0 for kind, arg in self.steps)
+
+    @staticmethod
+    def _step(value, kind, arg):
+        """Values matched by one step, or None if the step doesn't apply"""
+        if kind == "key":
+            if isinstance(value, dict):
+                return value[arg] if arg in value else None
+            if isinstance(value, list) and arg.isdigit() and int(arg) < len(value):
+                return value[int(arg)]
+            return None
+        if not isinstance(value, list):
+            return None
+        if kind == "index":
+            return value[arg] if -len(value) <= arg < len(value) else None
+        return value[arg] if kind == "slice" else value
+
+    def __call__(self, obj):
+        if not self.fans_out:
+            for kind, arg in self.steps:
+                obj = self._step(obj, kind, arg)
+                if obj is None:
+                    return None
+            return obj
+        values = [obj]
+        for kind, arg in self.steps:
+            matched = []
+            for value in values:
+                found = self._step(value, kind, arg)
+                if found is None:
+                    continue
+                if kind in ("all", "slice"):
+                    matched.extend(found)
+                else:
+                    matched.append(found)
+            values = matched
+        return values
+
+    def from_chunks(self, chunks):
+        """The value at a streamable path in a JSON document arriving as text chunks, or None if it is missing.
+
+        Only the matched value is parsed; everything before it is skipped over and nothing after it
+        is read. Raises EOFError if the chunks end before the value does.
+        """
+        scanner = _ChunkScanner(chunks)
+        for kind, arg in self.steps:
+            char = scanner.peek()
+            if char == "{" and kind == "key":
+                scanner.pos += 1
+                while scanner.peek() != "}":
+                    key = scanner.read_value()
+                    scanner.expect(":")
+                    if key == arg:
+                        break
+                    scanner.skip_value()
+                    if scanner.peek() == ",":
+                        scanner.pos += 1
+                else:
+                    return None
+            elif char == "[" and (kind == "index" or arg.isdigit()):
+                scanner.pos += 1
+                for _ in range(int(arg)):
+                    if scanner.peek() == "]":
+                        return None
+                    scanner.skip_value()
+                    if scanner.peek() != ",":
+                        return None
+                    scanner.pos += 1
+                if scanner.peek() == "]":
+                    return None
+            else:
+                return None
+        return scanner.read_value(document=not self.steps)
+
+_NON_SPACE = re.compile(r"\S")
+_STRING_END = re.compile(r'["\\]')
+_STRUCTURE = re.compile(r'[\[\]{}"]')
+_SCALAR_END = re.compile(r"[,\]}\s]")
+
+class _ChunkScanner:
+    """Cursor over JSON text arriving in chunks.
+
+    Text behind the cursor is dropped as more arrives, except from the start of a value being
+    read, so skipping over large values keeps at most a chunk in memory.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self.text = ""
+        self.pos = 0
+        self.mark = None
+
+    def more(self):
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            raise EOFError("JSON document ended early")
+        keep = self.pos if self.mark is None else self.mark
+        self.text = self.text[keep:] + chunk
+        self.pos -= keep
+        if self.mark is not None:
+            self.mark = 0
+
+    def search(self, pattern):
+        """Next match of pattern from the cursor, reading more text until there is one"""
+        while True:
+            match = pattern.search(self.text, self.pos)
+            if match:
+                return match
+            self.pos = len(self.text)
+            self.more()
+
+    def peek(self):
+        """The next non-whitespace character, leaving the cursor on it"""
+        self.pos = self.search(_NON_SPACE).start()
+        return self.text[self.pos]
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected '{char}' in JSON document, got '{self.text[self.pos]}'")
+        self.pos += 1
+
+    def skip_string(self):
+        self.pos += 1
+        while True:
+            match = self.search(_STRING_END)
+            if match.group() == '"':
+                self.pos = match.end()
+                return
+            # An escape: step over the backslash and the character it escapes
+            self.pos = match.start()
+            while self.pos + 1 >= len(self.text):
+                self.more()
+            self.pos += 2
+
+    def skip_value(self, document=False):
+        """Move the cursor past the next value; document marks the value as the whole document"""
+        char = self.peek()
+        if char == '"':
+            self.skip_string()
+        elif char in "{[":
+            depth = 0
+            while True:
+                match = self.search(_STRUCTURE)
+                if match.group() == '"':
+                    self.pos = match.start()
+                    self.skip_string()
+                    continue
+                self.pos = match.end()
+                depth += 1 if match.group() in "{[" else -1
+                if depth == 0:
+                    return
+        else:
+            # A number, true, false or null ends at the next delimiter; only a bare scalar document may end at EOF,
+            # anywhere else EOF means the document was cut off
+            try:
+                self.pos = self.search(_SCALAR_END).start()
+            except EOFError:
+                if not document:
+                    raise
+                self.pos = len(self.text)
+
+    def read_value(self, document=False):
+        self.peek()
+        self.mark = self.pos
+        self.skip_value(document)
+        value = json.loads(self.text[self.mark:self.pos])
+        self.mark = None
+        return value
+
+class ResponseExtractor:
+    """A compiled response_path of one or more comma-separated fields.
+
+    A single field extracts the answer as before. With several fields, each is `name=path`
+    or a bare path; unnamed fields are taken as the answer and then the contexts, so
+    "answer, sources[*].text" returns {"answer": ..., "contexts": [...]}.
+    """
+
+    def __init__(self, response_path):
+        self.response_path = response_path
+        self.fields = []
+        for position, field in enumerate(part.strip() for part in response_path.split(",")):
+            name, _, path = field.rpartition("=")
+            if not name:
+                name = ("answer", "contexts")[position] if position < 2 else path
+            self.fields.append((name.strip(), JSONPath(path.strip())))
+        if not any(name == "answer" for name, _ in self.fields):
+            raise ValueError(f"Response path '{response_path}' has no answer field")
+        self.streamable = len(self.fields) == 1 and self.fields[0][1].streamable
+
+    def __call__(self, json_response):
+        """The extracted answer, a dict of fields when there are several, or None if the answer is missing"""
+        if len(self.fields) == 1:
+            return self.fields[0][1](json_response)
+        extracted = {name: path(json_response) for name, path in self.fields}
+        if extracted["answer"] is None:
+            return None
+        return extracted
+
+    def from_chunks(self, chunks):
+        """The answer of a JSON document arriving as text chunks, for streamable single-field paths"""
+        return self.fields[0][1].from_chunks(chunks)
+
+@lru_cache(maxsize=256)
+def compile_response_path(response_path):
+    return ResponseExtractor(response_path)
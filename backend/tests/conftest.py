@@ -0,0 +1,8 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep the tests from writing run history or latency profiles next to the code
+os.environ.setdefault("HISTORY_DB", "")
+os.environ.setdefault("ENDPOINT_PROFILES_PATH", "")
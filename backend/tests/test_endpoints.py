@@ -0,0 +1,173 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+import resilience
+
+ANSWER = "Einstein " * 600  # About 5 KB
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """RAG endpoint answering every query with the same long answer, as JSON or as plain text; /batch answers batches"""
+    protocol_version = "HTTP/1.1"
+    requests_seen = 0
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, body, content_type="application/json"):
+        body = body.encode()
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        StubHandler.requests_seen += 1
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"]))) if self.headers.get("Content-Length") else None
+        if self.path.startswith("/batch"):
+            time.sleep(0.05)
+            return self.reply(json.dumps({"answers": [f"answer to {query}" for query in body["queries"]]}))
+        if self.path.startswith("/text"):
+            return self.reply(ANSWER, "text/plain")
+        self.reply(json.dumps({"answer": ANSWER}))
+
+    do_POST = do_GET
+
+
+@pytest.fixture(scope="module")
+def stub_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = main.TTLCache(100, 60)
+    monkeypatch.setattr(main, "response_cache", cache)
+    return cache
+
+
+def evaluate_request(url, **fields):
+    return main.EvaluateRequest(rag_endpoint=url, retry=main.RetryPolicy(max_attempts=1, circuit_breaker=False), **fields)
+
+
+@pytest.mark.parametrize("path, fields", [
+    ("/json", {}),
+    ("/text", {}),
+    ("/text", {"endpoint_type": "custom", "request_method": "POST", "request_format": {"q": "{prompt}"}}),
+])
+def test_truncated_bodies_are_errors_and_never_cached(stub_url, cache, monkeypatch, path, fields):
+    monkeypatch.setattr(resilience, "MAX_RESPONSE_BYTES", 1000)
+    request = evaluate_request(stub_url + path, **fields)
+    with main.query_trace() as trace:
+        response = main.query_endpoint("q", request)
+    assert main.is_error_response(response)
+    assert "truncated" in response
+    assert trace["truncated"]
+    assert main.response_row("q", "r", response, 1.0)["status"] == "error"
+    assert len(cache) == 0
+
+
+@pytest.mark.parametrize("path, fields", [
+    ("/json", {}),
+    ("/text", {"endpoint_type": "custom", "request_method": "POST", "request_format": {"q": "{prompt}"}}),
+])
+def test_whole_bodies_are_answers(stub_url, cache, path, fields):
+    response = main.query_endpoint("q", evaluate_request(stub_url + path, **fields))
+    assert response == ANSWER
+    assert len(cache) == 1
+
+
+def test_load_stage_offers_every_planned_arrival():
+    stage = main.LoadStage(rate=10, duration_seconds=2)
+    answered = {"ok": True, "latency_ms": 900.0, "service_ms": 100.0, "send_delay_ms": 800.0}
+    failed = dict(answered, ok=False)
+    # 20 arrivals planned; the endpoint fell behind and only 12 came back, 2 of them errors
+    results = [answered] * 10 + [failed] * 2 + [None] * 8
+    summary = main.summarize_load_stage(0, stage, results)
+    assert summary["planned"] == 20
+    assert summary["offered_qps"] == 10.0
+    assert summary["achieved_qps"] == 6.0
+    assert summary["throughput_qps"] == 5.0
+    assert summary["error_rate"] == round(2 / 12, 4)
+
+
+def test_negative_report_page_size_is_rejected_before_querying(stub_url, monkeypatch):
+    queried = []
+    monkeypatch.setattr(main, "query_endpoint", lambda query, request: queried.append(query))
+    response = TestClient(main.app).post("/api/evaluate", json={"rag_endpoint": stub_url + "/json", "report_page_size": -3})
+    assert response.status_code == 400
+    assert "report_page_size" in response.text
+    assert queried == []
+
+
+@pytest.mark.parametrize("url, response_path", [
+    ("{stub}/json", "missing"),  # No such field in the answer
+    ("http://127.0.0.1:9/json", "answer"),  # Nothing listening
+])
+def test_error_answers_are_not_cached(stub_url, cache, url, response_path):
+    request = evaluate_request(url.format(stub=stub_url), endpoint_type="custom", request_method="POST",
+                               request_format={"q": "{prompt}"}, response_path=response_path)
+    for _ in range(2):
+        with main.query_trace() as trace:
+            response = main.query_endpoint("q", request)
+        assert isinstance(response, main.QueryError)
+        assert not trace["cached"]
+    assert len(cache) == 0
+    assert main.response_row("q", "r", response, 1.0)["status"] == "error"
+
+
+def test_error_strings_are_not_cached(cache, monkeypatch):
+    monkeypatch.setattr(main, "query_adapter", lambda query, request: "Error: Server response timeout.")
+    assert main.query_endpoint("q", evaluate_request("http://rag.test/query")) == "Error: Server response timeout."
+    assert len(cache) == 0
+
+
+def test_batch_requests_skip_latency_profiling_and_hedging(stub_url, monkeypatch):
+    recorded = []
+    monkeypatch.setattr(main, "record_latency", lambda url, seconds: recorded.append(url))
+    request = main.EvaluateRequest(rag_endpoint=stub_url + "/batch", batch_size=3,
+                                   retry=main.RetryPolicy(max_attempts=1, circuit_breaker=False, hedge=True, hedge_after_ms=1))
+    StubHandler.requests_seen = 0
+    assert main.query_batch(["a", "b", "c"], request) == ["answer to a", "answer to b", "answer to c"]
+    time.sleep(0.1)
+    # A hedge would have sent a second batch after 1ms
+    assert StubHandler.requests_seen == 1
+    assert recorded == []
+    # Single queries to the same endpoint are still profiled
+    main.query_endpoint("a", evaluate_request(stub_url + "/json", bypass_cache=True))
+    assert recorded == [stub_url + "/json"]
+
+
+@pytest.mark.parametrize("path", ["/api/evaluate", "/api/evaluate/stream", "/api/jobs"])
+def test_partial_batch_placeholder_is_rejected_up_front(stub_url, monkeypatch, path):
+    queried = []
+    monkeypatch.setattr(main, "query_batch", lambda queries, request: queried.append(queries))
+    response = TestClient(main.app).post(path, json={
+        "rag_endpoint": stub_url + "/batch", "batch_size": 4, "batch_format": {"q": "items: {prompts}"}
+    })
+    assert response.status_code == 400
+    assert "whole value" in response.text
+    assert queried == []
+
+
+def test_compare_rejects_a_bad_endpoint_before_querying_any(stub_url, monkeypatch):
+    queried = []
+    monkeypatch.setattr(main, "query_endpoint", lambda query, request: queried.append(request.rag_endpoint))
+    response = TestClient(main.app).post("/api/compare", json={"endpoints": [
+        {"rag_endpoint": stub_url + "/json", "label": "a"},
+        {"rag_endpoint": stub_url + "/json", "label": "b", "endpoint_type": "custom", "request_format": {"q": "{prompt}"},
+         "response_path": "contexts=sources"},
+    ]})
+    assert response.status_code == 400
+    assert response.json()["error"].startswith("Endpoint 1 (b): ")
+    assert queried == []
@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta
+
+import main
+
+
+def record(history, run_id, age_days=0):
+    history.record({
+        "run_id": run_id,
+        "created_at": (datetime.now() - timedelta(days=age_days)).isoformat(),
+        "rag_endpoint": "http://rag.test/query",
+        "endpoint_type": "generic",
+        "endpoint_key": "key",
+        "dataset_id": None,
+        "dataset_hash": "hash",
+        "evaluation_results": {},
+        "latency": None,
+        "dataset": [{"user_input": f"q{i}", "status": "success"} for i in range(3)],
+    })
+
+
+def stored_run_ids(history):
+    db = history._connect()
+    rows = {run_id for run_id, in db.execute("SELECT DISTINCT run_id FROM run_rows")}
+    runs = {run_id for run_id, in db.execute("SELECT run_id FROM runs")}
+    assert rows == runs
+    return runs
+
+
+def test_history_keeps_the_newest_runs(tmp_path):
+    history = main.RunHistory(str(tmp_path / "history.db"), max_runs=2)
+    for index in range(4):
+        record(history, f"run{index}", age_days=4 - index)
+    assert stored_run_ids(history) == {"run2", "run3"}
+
+
+def test_history_deletes_runs_past_the_age_limit(tmp_path):
+    history = main.RunHistory(str(tmp_path / "history.db"), max_age_days=30)
+    record(history, "old", age_days=31)
+    record(history, "recent", age_days=29)
+    record(history, "new")
+    assert stored_run_ids(history) == {"recent", "new"}
+
+
+def test_history_without_limits_keeps_every_run(tmp_path):
+    history = main.RunHistory(str(tmp_path / "history.db"))
+    for index in range(3):
+        record(history, f"run{index}", age_days=1000)
+    assert len(stored_run_ids(history)) == 3
@@ -0,0 +1,51 @@
+import random
+
+import numpy as np
+
+from metrics import MAX_LCS_TOKENS, Vocabulary, _lcs_batch, encode_texts, rouge_l
+
+
+def lcs_length(a, b):
+    """Reference dynamic-programming LCS"""
+    previous = [0] * (len(b) + 1)
+    for x in a:
+        current = [0]
+        for j, y in enumerate(b):
+            current.append(previous[j] + 1 if x == y else max(previous[j + 1], current[j]))
+        previous = current
+    return previous[-1]
+
+
+def random_texts(rng, count, max_length, vocabulary_size):
+    words = [f"w{i}" for i in range(vocabulary_size)]
+    return [" ".join(rng.choice(words) for _ in range(rng.randint(0, max_length))) for _ in range(count)]
+
+
+def encode_pairs(responses, references):
+    vocabulary = Vocabulary()
+    return encode_texts(responses, vocabulary), encode_texts(references, vocabulary)
+
+
+def test_lcs_kernel_matches_dynamic_programming():
+    rng = random.Random(7)
+    # Lengths past 64 tokens exercise the carry between bitset words
+    responses = random_texts(rng, 300, 150, 12)
+    references = random_texts(rng, 300, 150, 12)
+    encoded_responses, encoded_references = encode_pairs(responses, references)
+    expected = [lcs_length(r.split()[:MAX_LCS_TOKENS], t.split()[:MAX_LCS_TOKENS]) for r, t in zip(responses, references)]
+    assert _lcs_batch(encoded_responses, encoded_references).tolist() == expected
+
+
+def test_lcs_kernel_truncates_long_texts():
+    rng = random.Random(11)
+    responses = random_texts(rng, 20, 2 * MAX_LCS_TOKENS, 5)
+    references = random_texts(rng, 20, 2 * MAX_LCS_TOKENS, 5)
+    encoded_responses, encoded_references = encode_pairs(responses, references)
+    expected = [lcs_length(r.split()[:MAX_LCS_TOKENS], t.split()[:MAX_LCS_TOKENS]) for r, t in zip(responses, references)]
+    assert _lcs_batch(encoded_responses, encoded_references).tolist() == expected
+
+
+def test_rouge_l_scores():
+    responses, references = encode_pairs(["a b c d", "", "x y", "a b"], ["a c d", "a b", "x y", ""])
+    # LCS 3: precision 3/4, recall 3/3
+    np.testing.assert_allclose(rouge_l(responses, references), [2 * 0.75 / 1.75, 0.0, 1.0, 0.0])
@@ -0,0 +1,237 @@
+import time
+
+import pytest
+from requests.structures import CaseInsensitiveDict
+
+import resilience
+from resilience import RateLimiter, parse_reset_seconds
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, headers=None):
+        self.status_code = status_code
+        self.headers = CaseInsensitiveDict(headers or {})
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(resilience.time, "monotonic", clock)
+    return clock
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("20ms", pytest.approx(0.02)), ("1s", 1.0), ("6m0s", 360.0), ("1h2m", 3720.0), ("2.5", 2.5), ("", None), ("soon", None),
+])
+def test_parse_reset_seconds(value, expected):
+    assert parse_reset_seconds(value) == expected
+
+
+def test_rate_limiter_refills_at_the_per_minute_rate(clock):
+    limiter = RateLimiter(rpm=60, tpm=600)
+    for _ in range(60):
+        limiter.acquire(10)
+    assert limiter.levels == {"requests": 0, "tokens": 0}
+    assert limiter._wait_seconds(clock.now, 10) == pytest.approx(1.0)
+    clock.now += 0.5
+    limiter._refill(clock.now)
+    assert limiter.levels == {"requests": pytest.approx(0.5), "tokens": pytest.approx(5)}
+    clock.now += 120
+    limiter._refill(clock.now)
+    assert limiter.levels == {"requests": 60, "tokens": 600}
+
+
+def test_rate_limiter_sends_an_oversized_request_once_the_bucket_is_full(clock):
+    limiter = RateLimiter(tpm=100)
+    assert limiter._wait_seconds(clock.now, 500) <= 0
+    limiter.acquire(500)
+    assert limiter._wait_seconds(clock.now, 500) == pytest.approx(300.0)
+
+
+def test_rate_limiter_learns_limits_and_remaining_from_headers(clock):
+    limiter = RateLimiter()
+    assert limiter._wait_seconds(clock.now, 1000) <= 0
+    limiter.observe(FakeResponse(headers={
+        "x-ratelimit-limit-requests": "120", "x-ratelimit-remaining-requests": "119",
+        "x-ratelimit-limit-tokens": "6000", "x-ratelimit-remaining-tokens": "30",
+    }))
+    assert limiter.limits == {"requests": 120, "tokens": 6000}
+    assert limiter.levels == {"requests": 119, "tokens": 30}
+    assert limiter._wait_seconds(clock.now, 90) == pytest.approx(0.6)
+
+
+def test_rate_limiter_pauses_until_an_exhausted_window_resets(clock):
+    limiter = RateLimiter(rpm=100)
+    limiter.observe(FakeResponse(headers={"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "6m0s"}))
+    assert limiter.blocked_until == clock.now + 360
+    assert limiter.throttled == 0
+
+
+@pytest.mark.parametrize("headers, pause", [
+    ({"retry-after-ms": "250", "Retry-After": "9"}, 0.25),
+    ({"Retry-After": "2"}, 2.0),
+    ({"x-ratelimit-reset-tokens": "1.5s"}, 1.5),
+    ({}, 1.0),
+])
+def test_rate_limiter_pauses_everyone_after_a_429(clock, headers, pause):
+    limiter = RateLimiter(rpm=100)
+    limiter.observe(FakeResponse(429, headers))
+    assert limiter.throttled == 1
+    assert limiter._wait_seconds(clock.now, 1) == pytest.approx(pause)
+
+
+def test_get_rate_limiter_shares_one_limiter_per_endpoint_and_key():
+    first = resilience.get_rate_limiter("https://api.example.com/v1/chat?x=1", "key-a", rpm=10)
+    assert resilience.get_rate_limiter("https://api.example.com/v1/chat", "key-a") is first
+    assert resilience.get_rate_limiter("https://api.example.com/v1/chat", "key-b") is not first
+    assert first.limits["requests"] == 10
+
+
+def test_circuit_breaker_opens_after_consecutive_failures(clock):
+    breaker = resilience.CircuitBreaker("http://rag")
+    for _ in range(resilience.BREAKER_FAILURE_THRESHOLD - 1):
+        breaker.record(False, "timeout")
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record(False, "timeout")
+    assert breaker.state == "open"
+    assert not breaker.allow()
+    assert breaker.short_circuited == 1
+    assert isinstance(breaker.error(), resilience.CircuitOpenError)
+    assert breaker.view()["retry_in_seconds"] == resilience.BREAKER_OPEN_SECONDS
+
+
+def test_circuit_breaker_opens_on_the_error_rate(clock):
+    breaker = resilience.CircuitBreaker("http://rag")
+    for i in range(resilience.BREAKER_WINDOW // 2):
+        breaker.record(i % 2 == 0)
+    assert breaker.state == "open"
+    assert breaker.consecutive_failures == 1
+
+
+def test_circuit_breaker_half_open_probe_closes_it(clock):
+    breaker = resilience.CircuitBreaker("http://rag")
+    for _ in range(resilience.BREAKER_FAILURE_THRESHOLD):
+        breaker.record(False, "503")
+    clock.now += resilience.BREAKER_OPEN_SECONDS
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    breaker.record(True)
+    assert breaker.state == "closed"
+    assert breaker.consecutive_failures == 0 and not breaker.outcomes
+    assert breaker.allow()
+
+
+def test_circuit_breaker_failed_probe_reopens_it(clock, monkeypatch):
+    monkeypatch.setattr(resilience, "BREAKER_PROBE_WAIT_SECONDS", 0.05)
+    breaker = resilience.CircuitBreaker("http://rag")
+    for _ in range(resilience.BREAKER_FAILURE_THRESHOLD):
+        breaker.record(False, "503")
+    clock.now += resilience.BREAKER_OPEN_SECONDS
+    assert breaker.allow()
+    # A second request waits for the probe, which hasn't answered in time
+    assert not breaker.allow()
+    breaker.record(False, "503")
+    assert breaker.state == "open"
+    assert breaker.opened_at == clock.now
+    assert not breaker.allow()
+
+
+def test_get_circuit_breaker_is_shared_per_endpoint():
+    breaker = resilience.get_circuit_breaker("http://rag.test/query?x=1")
+    assert resilience.get_circuit_breaker(" http://rag.test/query") is breaker
+    assert any(view["endpoint"] == "http://rag.test/query" for view in resilience.circuit_breaker_views())
+
+
+def test_endpoint_profiles_derive_timeouts_from_the_p99(tmp_path):
+    path = tmp_path / "profiles.json"
+    profiles = resilience.EndpointProfiles(str(path), default_timeout=7)
+    url = "http://rag.test/query"
+    for _ in range(resilience.PROFILE_MIN_SAMPLES - 1):
+        profiles.record(url, 1.0)
+    assert profiles.timeout(url) == 7
+    profiles.record(url + "?page=2", 1.0)
+    p99 = profiles.percentile(url, 99)
+    assert 1.0 <= p99 < 1.2
+    assert profiles.timeout(url) == round(resilience.TIMEOUT_P99_MULTIPLIER * p99, 2)
+    assert profiles.timeout(url, attempt=5) == resilience.TIMEOUT_CEILING_SECONDS
+    profiles.save()
+    assert resilience.EndpointProfiles(str(path)).percentile(url, 99) == p99
+
+
+def test_circuit_breaker_failures_while_open_keep_the_probe_time(clock):
+    breaker = resilience.CircuitBreaker("http://rag")
+    for _ in range(resilience.BREAKER_FAILURE_THRESHOLD):
+        breaker.record(False, "503")
+    opened_at = breaker.opened_at
+    clock.now += resilience.BREAKER_OPEN_SECONDS - 1
+    # Requests still in flight when it opened fail late
+    breaker.record(False, "timeout")
+    assert breaker.opened_at == opened_at
+    assert breaker.last_error == "timeout"
+    assert breaker.view()["retry_in_seconds"] == 1.0
+    clock.now += 1
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+
+
+class ThrottledSend:
+    """send(attempt) answering 429 (retry after 10ms) a number of times before succeeding"""
+
+    def __init__(self, throttled):
+        self.throttled = throttled
+        self.attempts = []
+
+    def __call__(self, attempt):
+        self.attempts.append(attempt)
+        if len(self.attempts) <= self.throttled:
+            return FakeResponse(429, {"retry-after-ms": "10"})
+        return FakeResponse(200)
+
+
+def test_rate_limited_resends_429s_without_using_up_the_attempt():
+    limiter = RateLimiter()
+    send = ThrottledSend(3)
+    with resilience.query_trace() as trace:
+        response = resilience.rate_limited(send, limiter, 10)(0)
+    assert response.status_code == 200
+    assert send.attempts == [0, 0, 0, 0]
+    assert limiter.throttled == 3
+    assert trace["retries"] == 3
+
+
+def test_rate_limited_returns_the_429_after_the_longest_wait():
+    send = ThrottledSend(5)
+    response = resilience.rate_limited(send, RateLimiter(), 10, max_wait=0.015)(1)
+    assert response.status_code == 429
+    assert 2 <= len(send.attempts) < 5
+
+
+def test_hedge_delay_starts_when_the_primary_is_sent(monkeypatch):
+    import main
+
+    executor = main.ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(main, "hedge_executor", executor)
+    # Another run's request holds the only hedge thread, so the primary queues behind it for longer than the delay
+    executor.submit(time.sleep, 0.3)
+    sent = []
+
+    def send(attempt):
+        sent.append(attempt)
+        time.sleep(0.1)
+        return FakeResponse(200)
+
+    response = main._hedged_send(send, 0, hedge_after=0.2)
+    executor.shutdown(wait=True)
+    assert response.status_code == 200
+    assert sent == [0]
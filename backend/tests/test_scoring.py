@@ -0,0 +1,33 @@
+import random
+
+import numpy as np
+import pytest
+
+import main
+from metrics import ReferenceIndex
+
+
+@pytest.mark.parametrize("saved", [False, True])
+def test_sharded_scoring_matches_scoring_in_one_piece(monkeypatch, tmp_path, saved):
+    rng = random.Random(11)
+    words = ["the", "theory", "of", "relativity", "Einstein", "physics", "light", "été", "光"]
+    references = [" ".join(rng.choice(words) for _ in range(rng.randint(0, 30))) for _ in range(45)]
+    responses = [" ".join(rng.choice(words) for _ in range(rng.randint(0, 40))) for _ in range(45)]
+    index = ReferenceIndex.build(references)
+    if saved:
+        index.save(str(tmp_path / "index.npz"))
+    expected = index.score(responses)
+
+    monkeypatch.setattr(main, "SCORING_WORKERS", 3)
+    monkeypatch.setattr(main, "SCORING_SHARD_ROWS", 10)
+    submitted = []
+    submit = main.scoring_executor.submit
+    monkeypatch.setattr(main.scoring_executor, "submit", lambda *args: submitted.append(args) or submit(*args))
+    scores = main.score_responses(responses, index)
+
+    assert len(submitted) == 3
+    assert scores.keys() == expected.keys()
+    for key in expected:
+        np.testing.assert_allclose(scores[key], expected[key])
+    # A temporary index file is removed again; a saved one is kept
+    assert (index.path is not None) == saved
@@ -0,0 +1,85 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import main
+
+FIRST_TOKEN_SECONDS = 0.2
+TOKEN_INTERVAL_SECONDS = 0.03
+TOKENS = 11
+RETRY_AFTER_SECONDS = 0.6
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """OpenAI-style chat completion stream; /retry answers 503 to every other request"""
+    protocol_version = "HTTP/1.1"
+    requests_seen = 0
+
+    def log_message(self, *args):
+        pass
+
+    def write_chunk(self, data):
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        self.wfile.flush()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        StubHandler.requests_seen += 1
+        if self.path == "/retry" and StubHandler.requests_seen % 2:
+            self.send_response(503)
+            self.send_header("Retry-After", str(RETRY_AFTER_SECONDS))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        time.sleep(FIRST_TOKEN_SECONDS)
+        for index in range(TOKENS):
+            if index:
+                time.sleep(TOKEN_INTERVAL_SECONDS)
+            event = {"choices": [{"delta": {"content": f"t{index} "}}]}
+            self.write_chunk(f"data: {json.dumps(event)}\n\n".encode())
+        self.write_chunk(f"data: {json.dumps({'choices': [], 'usage': {'completion_tokens': TOKENS}})}\n\n".encode())
+        self.write_chunk(b"data: [DONE]\n\n")
+        self.write_chunk(b"")
+
+
+@pytest.fixture(scope="module")
+def stub_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def stream(url, max_attempts=1):
+    policy = main.RetryPolicy(max_attempts=max_attempts, circuit_breaker=False)
+    with main.query_trace() as trace:
+        answer = main.query_openai("q", url, api_key="key", retry_policy=policy, stream=True)
+    return answer, trace
+
+
+def test_streamed_answer_timings(stub_url):
+    answer, trace = stream(f"{stub_url}/v1/chat/completions")
+    assert answer == "".join(f"t{index} " for index in range(TOKENS))
+    assert trace["tokens"] == TOKENS
+    assert FIRST_TOKEN_SECONDS * 1000 <= trace["ttft_ms"] < FIRST_TOKEN_SECONDS * 1000 + 150
+    assert TOKEN_INTERVAL_SECONDS * 1000 <= trace["inter_token_ms"] < TOKEN_INTERVAL_SECONDS * 1000 + 20
+    assert trace["tokens_per_second"] == pytest.approx(1000 / trace["inter_token_ms"])
+    assert trace["bytes_received"] > 0
+
+
+def test_time_to_first_token_excludes_retries(stub_url):
+    StubHandler.requests_seen = 0
+    started = time.perf_counter()
+    answer, trace = stream(f"{stub_url}/retry", max_attempts=2)
+    assert time.perf_counter() - started >= RETRY_AFTER_SECONDS + FIRST_TOKEN_SECONDS
+    assert trace["retries"] == 1
+    assert answer.startswith("t0 ")
+    # Measured from the attempt that answered, not from the first one
+    assert FIRST_TOKEN_SECONDS * 1000 <= trace["ttft_ms"] < FIRST_TOKEN_SECONDS * 1000 + 150
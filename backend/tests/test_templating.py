@@ -0,0 +1,102 @@
+import json
+
+import pytest
+
+from templating import BATCH_PLACEHOLDER, JSONPath, RequestTemplate, compile_response_path
+
+RESPONSE = {"data": {"result": {"answer": "An answer", "sources": [{"text": "a"}, {"text": "b"}, {"text": "c"}]}}}
+
+
+def test_request_template_renders_post_body_without_touching_the_format():
+    request_format = {"input": {"question": "Q: {prompt}", "history": []}, "messages": [{"content": "{prompt}"}], "n": 1}
+    template = RequestTemplate(request_format)
+    first, second = template.render("one"), template.render("two")
+    assert first == {"input": {"question": "Q: one", "history": []}, "messages": [{"content": "one"}], "n": 1}
+    assert second["messages"][0]["content"] == "two"
+    assert request_format["input"]["question"] == "Q: {prompt}"
+
+
+def test_request_template_flattens_get_parameters():
+    template = RequestTemplate({"q": "{prompt}", "opts": {"k": 5}}, "GET")
+    assert template.render("x") == {"q": "x", "opts_k": 5}
+
+
+def test_request_template_defaults():
+    assert RequestTemplate().render("x") == {"query": "x"}
+    assert RequestTemplate(placeholder=BATCH_PLACEHOLDER).render(["a", "b"]) == {"queries": ["a", "b"]}
+
+
+@pytest.mark.parametrize("path, expected", [
+    ("data.result.answer", "An answer"),
+    ("data.result.sources.1.text", "b"),
+    ("data.result.sources[-1].text", "c"),
+    ("data.result.sources[*].text", ["a", "b", "c"]),
+    ("data.result.sources[1:].text", ["b", "c"]),
+    ("data.result.sources.*.text", ["a", "b", "c"]),
+    ("data.missing", None),
+    ("data.result.sources[5].text", None),
+])
+def test_json_path(path, expected):
+    assert JSONPath(path)(RESPONSE) == expected
+
+
+def test_json_path_rejects_invalid_paths():
+    with pytest.raises(ValueError):
+        JSONPath("data[x]")
+
+
+def test_response_extractor_fields():
+    extract = compile_response_path("data.result.answer, data.result.sources[*].text, first=data.result.sources[0].text")
+    assert extract(RESPONSE) == {"answer": "An answer", "contexts": ["a", "b", "c"], "first": "a"}
+    assert extract({"data": {}}) is None
+    with pytest.raises(ValueError):
+        compile_response_path("contexts=data.result.sources")
+
+
+def chunked(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1000])
+@pytest.mark.parametrize("path", [
+    "data.result.answer", "data.result.sources.1.text", "data.result.sources[2].text", "data.missing", "data.result.sources[5].text",
+])
+def test_json_path_from_chunks_matches_parsing_the_whole_document(path, size):
+    document = json.dumps({"skipped": [1, {"x": "}]\\\"{["}, True, None, -2.5e3], **RESPONSE, "after": "never read"})
+    assert JSONPath(path).from_chunks(chunked(document, size)) == JSONPath(path)(json.loads(document))
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 5])
+def test_json_path_from_chunks_handles_escapes_split_across_chunks(size):
+    document = r'{"skip": "a\\\"bé", "answer": "line\nbreak \"quoted\" \\ é😀"}'
+    assert JSONPath("answer").from_chunks(chunked(document, size)) == json.loads(document)["answer"]
+
+
+@pytest.mark.parametrize("document, path", [
+    ('{"answer": 12', "answer"),
+    ('{"answer": tru', "answer"),
+    ('{"answer": "cut', "answer"),
+    ('{"answer": [1, 2', "answer"),
+    ('{"skip": 12', "answer"),
+    ('{"skip": "a\\', "answer"),
+    ('[1, 2', "[3]"),
+])
+def test_json_path_from_chunks_raises_on_truncated_documents(document, path):
+    with pytest.raises(EOFError):
+        JSONPath(path).from_chunks(chunked(document, 2))
+
+
+def test_json_path_from_chunks_reads_a_bare_scalar_document():
+    assert JSONPath("").from_chunks(["1", "2"]) == 12
+    assert JSONPath("").from_chunks(["nu", "ll "]) is None
+
+
+@pytest.mark.parametrize("batch_format", [{"q": "items: {prompts}"}, {"input": {"texts": ["{prompts} "]}}])
+def test_batch_placeholder_must_be_a_whole_value(batch_format):
+    with pytest.raises(ValueError, match="whole value"):
+        RequestTemplate(batch_format, placeholder=BATCH_PLACEHOLDER)
+
+
+def test_batch_placeholder_renders_the_query_list():
+    template = RequestTemplate({"input": {"texts": "{prompts}"}, "note": "{prompt}"}, placeholder=BATCH_PLACEHOLDER)
+    assert template.render(["a", "b"]) == {"input": {"texts": ["a", "b"]}, "note": "{prompt}"}